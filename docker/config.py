@@ -116,7 +116,8 @@ CELERY_TIMEZONE = os.getenv('CELERY_TIMEZONE', 'Europe/Madrid')
 CELERY_TASK_DEFAULT_QUEUE = 'tasks'
 CELERY_QUEUES = (
     Queue('tasks', routing_key='task.#'),
-    Queue('transient', routing_key='transient.#', delivery_mode=1)
+    Queue('transient', routing_key='transient.#', delivery_mode=1),
+    Queue('thumbnails', routing_key='thumbnails.#')
 )
 CELERY_TASK_DEFAULT_EXCHANGE = 'tasks'
 CELERY_TASK_DEFAULT_EXCHANGE_TYPE = 'topic'
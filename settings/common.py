@@ -45,6 +45,8 @@ CACHES = {
 INSTANCE_TYPE = "SRC"
 
 # CELERY
+# Without celery (and its beat), the periodic tasks must be run by other means, i.e. the
+# daily buckets of the project totals with the `compact_projects_totals_buckets` command
 CELERY_ENABLED = False
 from kombu import Queue  # noqa
 
@@ -57,7 +59,8 @@ CELERY_TIMEZONE = 'Europe/Madrid'
 CELERY_TASK_DEFAULT_QUEUE = 'tasks'
 CELERY_QUEUES = (
     Queue('tasks', routing_key='task.#'),
-    Queue('transient', routing_key='transient.#', delivery_mode=1)
+    Queue('transient', routing_key='transient.#', delivery_mode=1),
+    Queue('thumbnails', routing_key='thumbnails.#')
 )
 CELERY_TASK_DEFAULT_EXCHANGE = 'tasks'
 CELERY_TASK_DEFAULT_EXCHANGE_TYPE = 'topic'
@@ -216,7 +219,16 @@ DJMAIL_TEMPLATE_EXTENSION = "jinja"
 # Events backend
 EVENTS_PUSH_BACKEND = "taiga.events.backends.postgresql.EventsPushBackend"
 # EVENTS_PUSH_BACKEND = "taiga.events.backends.rabbitmq.EventsPushBackend"
-# EVENTS_PUSH_BACKEND_OPTIONS = {"url": "//guest:guest@127.0.0.1/"}
+# EVENTS_PUSH_BACKEND_OPTIONS = {"url": "//guest:guest@127.0.0.1/",
+#                                "confirm_publish": True,
+#                                "connect_timeout": 5,
+#                                "confirm_timeout": 5}
+
+# Merge the change events of a transaction that share project and content type
+# in one message with a list of pks (needs a taiga-events version that supports it)
+EVENTS_COALESCE_CHANGES = False
+# Max number of pks sent in one change event message
+EVENTS_MAX_IDS_PER_MESSAGE = 500
 
 # Message System
 MESSAGE_STORAGE = "django.contrib.messages.storage.session.SessionStorage"
@@ -560,6 +572,10 @@ THUMBNAIL_ALIASES = {
     },
 }
 
+# Time (in seconds) that a generated (or failed) thumbnail is remembered to
+# avoid scheduling its generation again (in the "thumbnails" celery queue)
+THUMBNAILS_GENERATED_CACHE_TIMEOUT = 86400
+
 # Feedback module settings
 FEEDBACK_ENABLED = True
 FEEDBACK_EMAIL = "support@taiga.io"
@@ -598,9 +614,39 @@ GITLAB_VALID_ORIGIN_IPS = []
 
 EXPORTS_TTL = 60 * 60 * 24  # 24 hours
 
+# Rows read from the database at once by the CSV exports of user stories,
+# tasks, issues and epics (they are streamed)
+CSV_EXPORT_CHUNK_SIZE = 500
+# Cache the CSV exports until the exported items change (they are regenerated
+# in background with celery, or in the request without it, and served
+# compressed to the clients accepting gzip)
+CSV_EXPORT_CACHE_ENABLED = True
+CSV_EXPORT_CACHE_COMPRESS = True
+CSV_EXPORT_CACHE_TIMEOUT = 60 * 60 * 24
+CSV_EXPORT_CACHE_LOCK_TIMEOUT = 10 * 60
+
 WEBHOOKS_ENABLED = False
 WEBHOOKS_ALLOW_PRIVATE_ADDRESS = False
 WEBHOOKS_ALLOW_REDIRECTS = False
+# Timeouts (in seconds) of the webhook requests
+WEBHOOKS_CONNECT_TIMEOUT = 5
+WEBHOOKS_READ_TIMEOUT = 30
+# The webhooks of a project are called in parallel by this number of threads
+WEBHOOKS_MAX_WORKERS = 4
+# Hosts whose sessions (connections) are kept alive by every worker process
+WEBHOOKS_SESSIONS_MAX_HOSTS = 100
+# Failed webhook requests are retried with an exponential backoff (in seconds)
+# by a celery beat task (they aren't retried without celery)
+WEBHOOKS_MAX_RETRIES = 5
+WEBHOOKS_RETRY_BACKOFF = 60
+WEBHOOKS_RETRY_MAX_BACKOFF = 60 * 60
+WEBHOOKS_RETRY_PERIODICITY = 60
+WEBHOOKS_RETRY_BATCH_SIZE = 50
+# After this number of consecutive failures the requests to a webhook are
+# postponed for WEBHOOKS_CIRCUIT_BREAKER_TIMEOUT seconds
+WEBHOOKS_CIRCUIT_BREAKER_THRESHOLD = 5
+WEBHOOKS_CIRCUIT_BREAKER_TIMEOUT = 5 * 60
+WEBHOOKS_LOGS_PRUNE_BATCH_SIZE = 1000
 
 # If is True /front/sitemap.xml show a valid sitemap of taiga-front client
 FRONT_SITEMAP_ENABLED = False
@@ -661,11 +707,33 @@ IMPORTERS = {
 
 # Configuration for sending notifications
 NOTIFICATIONS_CUSTOM_FILTER = False
+# Emails of a notification sent with the same connection and batches sent in parallel
+NOTIFICATIONS_EMAIL_BATCH_SIZE = 50
+NOTIFICATIONS_EMAIL_MAX_WORKERS = 4
+# Due notifications are claimed in batches by this number of parallel celery tasks
+NOTIFICATIONS_DISPATCH_SHARDS = 4
+NOTIFICATIONS_DISPATCH_BATCH_SIZE = 50
 
 # MDRENDER
 MDRENDER_CACHE_ENABLE = True
 MDRENDER_CACHE_MIN_SIZE = 40
 MDRENDER_CACHE_TIMEOUT = 86400
+MDRENDER_LOCAL_CACHE_SIZE = 16 * 1024 * 1024  # Max bytes of rendered texts cached in each process
+MDRENDER_VERSION_LOCAL_TIMEOUT = 5  # Seconds that a process reuses the cache version of a project
+MDRENDER_POOL_SIZE = 32  # Max reusable Markdown instances per thread
+
+# HISTORY
+# Cache the snapshots rebuilt from the history entries of an object
+HISTORY_SNAPSHOT_CACHE_ENABLE = True
+HISTORY_SNAPSHOT_CACHE_TIMEOUT = 86400
+# Objects locked at once (one advisory lock each) by the bulk snapshots
+HISTORY_BULK_SNAPSHOTS_CHUNK_SIZE = 100
+
+# TIMELINE
+# Max time (in seconds) that the timeline visibility of a user (projects and
+# contents visible to the user) is cached. It's invalidated when the user's
+# memberships or roles change.
+TIMELINE_VISIBILITY_CACHE_TIMEOUT = 3600
 
 # TELEMETRY
 
@@ -12,6 +12,8 @@ from django.core.paginator import (
     Paginator,
     InvalidPage,
 )
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 from django.http import Http404
 from django.http import QueryDict
 from django.utils.translation import gettext as _
@@ -20,6 +22,8 @@ from .settings import api_settings
 
 from urllib import parse as urlparse
 
+import base64
+import json
 import warnings
 
 
@@ -131,6 +135,83 @@ class LazyPaginator(Paginator):
     page_range = property(_get_page_range)
 
 
+def encode_cursor(values):
+    """
+    Encode the ordering values of the last object of a page as an opaque
+    cursor.
+    """
+    values = [v.isoformat() if hasattr(v, "isoformat") else v for v in values]
+    data = json.dumps(values).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def decode_cursor(cursor, num_values):
+    """
+    Decode a cursor generated by `encode_cursor`. Raise `ValueError` if
+    it is not valid.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+    if not isinstance(values, list) or len(values) != num_values:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+class CursorPage(object):
+    def __init__(self, object_list, next_cursor, paginator):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.paginator = paginator
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+class CursorPaginator(object):
+    """
+    Keyset pagination: instead of an offset, every page is filtered with the
+    ordering values of the last object of the previous page (encoded in an
+    opaque cursor), so the cost of a page does not depend on how deep it is.
+
+    `ordering` must be a unique ordering, with all the fields in the same
+    direction, e.g. `("-created", "-id")`.
+    """
+
+    def __init__(self, object_list, per_page, ordering):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.ordering = ordering
+        self.fields = [f.lstrip("-") for f in ordering]
+        self.descending = ordering[0].startswith("-")
+
+    def _get_cursor_filter(self, values):
+        lookup = "lt" if self.descending else "gt"
+        cursor_filter = Q()
+        for i, field in enumerate(self.fields):
+            conditions = {f: v for f, v in zip(self.fields[:i], values[:i])}
+            conditions["{}__{}".format(field, lookup)] = values[i]
+            cursor_filter |= Q(**conditions)
+        return cursor_filter
+
+    def page(self, cursor=None):
+        queryset = self.object_list.order_by(*self.ordering)
+        if cursor:
+            values = decode_cursor(cursor, len(self.fields))
+            queryset = queryset.filter(self._get_cursor_filter(values))
+
+        # Retrieve one more object to check if there is a next page.
+        objects = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(objects) > self.per_page:
+            objects = objects[:self.per_page]
+            next_cursor = encode_cursor([getattr(objects[-1], f) for f in self.fields])
+
+        return CursorPage(objects, next_cursor, self)
+
+
 class PaginationMixin(object):
     # Pagination settings
     paginate_by = api_settings.PAGINATE_BY
@@ -138,6 +219,10 @@ class PaginationMixin(object):
     max_paginate_by = api_settings.MAX_PAGINATE_BY
     page_kwarg = 'page'
     paginator_class = Paginator
+    # Views with a unique ordering can set it to allow the clients to use
+    # cursor pagination (see `CursorPaginator`).
+    cursor_ordering = None
+    cursor_kwarg = 'cursor'
 
     def get_paginate_by(self, queryset=None, **kwargs):
         """
@@ -175,6 +260,10 @@ class PaginationMixin(object):
         if "x-disable-pagination" in self.request.headers:
             return None
 
+        if self.cursor_ordering and ("x-cursor-pagination" in self.request.headers or
+                                     self.cursor_kwarg in self.request.QUERY_PARAMS):
+            return self.paginate_queryset_with_cursor(queryset)
+
         if "x-lazy-pagination" in self.request.headers:
             self.paginator_class = LazyPaginator
 
@@ -247,5 +336,28 @@ class PaginationMixin(object):
 
         return page
 
+    def paginate_queryset_with_cursor(self, queryset):
+        page_size = self.get_paginate_by()
+        if not page_size:
+            return None
+
+        paginator = CursorPaginator(queryset, page_size, self.cursor_ordering)
+        cursor = self.request.QUERY_PARAMS.get(self.cursor_kwarg, None)
+        try:
+            page = paginator.page(cursor)
+        except (ValueError, ValidationError):
+            raise Http404(_("Invalid cursor"))
+
+        self.headers["x-paginated"] = "true"
+        self.headers["x-paginated-by"] = page.paginator.per_page
+
+        if page.has_next():
+            url = self.request.build_absolute_uri()
+            url = replace_query_param(url, self.cursor_kwarg, page.next_cursor)
+            self.headers["X-Pagination-Next"] = url
+            self.headers["x-pagination-next-cursor"] = page.next_cursor
+
+        return page
+
     def get_pagination_serializer(self, page):
         return self.get_serializer(page.object_list, many=True)
@@ -5,13 +5,19 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
+from concurrent import futures
+
 from django.conf import settings
+from django.core import mail
+from django.db import connection as db_connection
 
 from djmail import template_mail
 import premailer
 
 import logging
 
+logger = logging.getLogger(__name__)
+
 
 # Hide CSS warnings messages if debug mode is disable
 if not getattr(settings, "DEBUG", False):
@@ -31,3 +37,46 @@ class MagicMailBuilder(template_mail.MagicMailBuilder):
 
 
 mail_builder = MagicMailBuilder(template_mail_cls=InlineCSSTemplateMail)
+
+
+def _send_messages_batch(messages, *, in_thread=False):
+    failures = []
+    connection = mail.get_connection()
+    try:
+        for message in messages:
+            try:
+                # Open the connection only if it is closed, so it is reused
+                # by all the messages of the batch
+                connection.open()
+                connection.send_messages([message])
+            except Exception as e:
+                logger.exception("Error sending the email message to %s", message.to)
+                failures.append((message, e))
+                # The connection can be broken, open a new one
+                connection.close()
+    finally:
+        connection.close()
+        if in_thread:
+            db_connection.close()
+
+    return failures
+
+
+def send_messages_in_batches(messages, *, batch_size=50, max_workers=4):
+    """
+    Send a list of email messages, in batches of `batch_size` messages that
+    reuse the same connection of the email backend. The batches are sent by
+    a pool of `max_workers` threads.
+
+    Return a list of `(message, exception)` with the messages that could not
+    be sent.
+    """
+    batches = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
+    if len(batches) <= 1 or max_workers <= 1:
+        return [failure for batch in batches for failure in _send_messages_batch(batch)]
+
+    failures = []
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch_failures in executor.map(lambda batch: _send_messages_batch(batch, in_thread=True), batches):
+            failures += batch_failures
+    return failures
@@ -14,10 +14,12 @@ CORS_ALLOWED_METHODS = ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEA
 CORS_ALLOWED_HEADERS = ["content-type", "x-requested-with",
                         "authorization", "accept-encoding",
                         "x-disable-pagination", "x-lazy-pagination",
+                        "x-cursor-pagination",
                         "x-host", "x-session-id", "set-orders"]
 CORS_ALLOWED_CREDENTIALS = True
 CORS_EXPOSE_HEADERS = ["x-pagination-count", "x-paginated", "x-paginated-by",
                        "x-pagination-current", "x-pagination-next", "x-pagination-prev",
+                       "x-pagination-next-cursor",
                        "x-site-host", "x-site-register"]
 
 CORS_EXTRA_EXPOSE_HEADERS = getattr(settings, "APP_EXTRA_EXPOSE_HEADERS", [])
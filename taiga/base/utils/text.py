@@ -5,6 +5,8 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
+import csv
+
 
 def strip_lines(text):
     """
@@ -26,3 +28,20 @@ def sanitize_csv_text_value(value):
         if isinstance(value, str) and value.startswith(("=", "+", "-", "@"))
         else value
     )
+
+
+class _Echo:
+    """File-like object that returns the written value instead of storing it."""
+    def write(self, value):
+        return value
+
+
+def iter_csv_lines(fieldnames, rows):
+    """
+    Write a CSV with the header and a line per dict of `rows`, yielding every
+    line as it's written, so it can be streamed without keeping it in memory.
+    """
+    writer = csv.DictWriter(_Echo(), fieldnames=fieldnames)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
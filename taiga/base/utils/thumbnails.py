@@ -8,11 +8,17 @@
 import os
 
 from psd_tools import PSDImage
+from django.core.cache import cache
+from django.core.files.base import ContentFile
 from django.db.models.fields.files import FieldFile
 
 from taiga.base.utils.urls import get_absolute_url
 
+from easy_thumbnails import engine
+from easy_thumbnails.alias import aliases
 from easy_thumbnails.files import get_thumbnailer
+from easy_thumbnails.files import ThumbnailFile
+from easy_thumbnails.exceptions import EasyThumbnailsError
 from easy_thumbnails.exceptions import InvalidImageFormatError
 from PIL import Image
 from PIL.PngImagePlugin import PngImageFile
@@ -60,14 +66,25 @@ def psd_image_factory(data, *args):
 Image.register_open("PSD", psd_image_factory)
 
 
-def get_thumbnail(file_obj, thumbnailer_size):
-    # Ugly hack to temporary ignore tiff files
+# Supported formats
+THUMBNAIL_EXTENSIONS = ('png', 'svg', 'gif', 'bmp', 'jpeg', 'jpg', 'psd')
+
+# Formats that can have transparency, their thumbnails are always saved
+# with the transparency extension (when their name is known in advance)
+TRANSPARENT_EXTENSIONS = ('png', 'svg', 'gif', 'psd')
+
+
+def _get_source_extension(file_obj):
     relative_name = file_obj
     if isinstance(file_obj, FieldFile):
         relative_name = file_obj.name
 
-    source_extension = os.path.splitext(relative_name)[1][1:]
-    if source_extension.lower() not in ('png', 'svg', 'gif', 'bmp', 'jpeg', 'jpg', 'psd'):
+    return os.path.splitext(relative_name)[1][1:].lower()
+
+
+def get_thumbnail(file_obj, thumbnailer_size):
+    # Ugly hack to temporary ignore tiff files
+    if _get_source_extension(file_obj) not in THUMBNAIL_EXTENSIONS:
         return None
 
     try:
@@ -77,6 +94,83 @@ def get_thumbnail(file_obj, thumbnailer_size):
         return None
 
 
+def _get_thumbnail_options(thumbnailer, thumbnailer_size):
+    options = aliases.get(thumbnailer_size, target=thumbnailer.alias_target)
+    options['ALIAS'] = thumbnailer_size
+    return thumbnailer.get_options(options)
+
+
+def get_thumbnail_name(file_obj, thumbnailer_size):
+    """
+    Get the name of the thumbnail of a file without generating it. Unlike
+    easy_thumbnails, the name only depends on the source file, so it can be
+    known before the thumbnail is generated (see `generate_thumbnail`).
+    """
+    source_extension = _get_source_extension(file_obj)
+    if source_extension not in THUMBNAIL_EXTENSIONS:
+        return None
+
+    thumbnailer = get_thumbnailer(file_obj)
+    options = _get_thumbnail_options(thumbnailer, thumbnailer_size)
+    return thumbnailer.get_thumbnail_name(options, transparent=source_extension in TRANSPARENT_EXTENSIONS)
+
+
+def _get_content_cache_key(thumbnailer_size, content_hash):
+    return "thumbnail-content:{}:{}".format(thumbnailer_size, content_hash)
+
+
+def generate_thumbnail(file_obj, thumbnailer_size, content_hash=None):
+    """
+    Generate, if it doesn't exist yet, the thumbnail of a file with the name
+    returned by `get_thumbnail_name`. Return that name, or None if the file
+    is not a valid image.
+
+    If `content_hash` (the hash of the content of the file) is given, the
+    thumbnail generated for other file with the same content is reused.
+    """
+    name = get_thumbnail_name(file_obj, thumbnailer_size)
+    if name is None:
+        return None
+
+    thumbnailer = get_thumbnailer(file_obj)
+    if thumbnailer.thumbnail_exists(name):
+        return name
+
+    storage = thumbnailer.thumbnail_storage
+    options = _get_thumbnail_options(thumbnailer, thumbnailer_size)
+    content_cache_key = _get_content_cache_key(thumbnailer_size, content_hash) if content_hash else None
+
+    data = None
+    if content_cache_key:
+        cached_name = cache.get(content_cache_key)
+        if (cached_name and os.path.splitext(cached_name)[1] == os.path.splitext(name)[1] and
+                storage.exists(cached_name)):
+            with storage.open(cached_name) as cached_file:
+                data = cached_file.read()
+
+    if data is None:
+        try:
+            thumbnail = thumbnailer.generate_thumbnail(options, silent_template_exception=True)
+        except EasyThumbnailsError:
+            return None
+
+        if thumbnail.name == name:
+            data = thumbnail.file.read()
+        else:
+            # Saved in the format of the expected name
+            data = engine.save_pil_image(thumbnail.image, filename=name,
+                                         quality=options['quality'],
+                                         subsampling=options['subsampling']).read()
+
+    thumbnailer.save_thumbnail(ThumbnailFile(name, file=ContentFile(data), storage=storage,
+                                             thumbnail_options=options))
+
+    if content_cache_key:
+        cache.set(content_cache_key, name, timeout=None)
+
+    return name
+
+
 def get_thumbnail_url(file_obj, thumbnailer_size):
     thumbnail = get_thumbnail(file_obj, thumbnailer_size)
 
@@ -31,6 +31,24 @@ if settings.ENABLE_TELEMETRY:
         'args': (),
     }
 
+app.conf.beat_schedule['compact-projects-totals-buckets'] = {
+    'task': 'taiga.projects.services.totals.compact_projects_totals_buckets_task',
+    'schedule': crontab(minute=0),
+    'args': (),
+}
+
+if settings.WEBHOOKS_ENABLED:
+    app.conf.beat_schedule['retry-webhooks'] = {
+        'task': 'taiga.webhooks.tasks.retry_webhooks',
+        'schedule': settings.WEBHOOKS_RETRY_PERIODICITY,
+        'args': (),
+    }
+    app.conf.beat_schedule['remove-leftover-webhooklogs'] = {
+        'task': 'taiga.webhooks.tasks.remove_leftover_webhooklogs',
+        'schedule': crontab(minute='*/10'),
+        'args': (),
+    }
+
 if settings.SEND_BULK_EMAILS_WITH_CELERY and settings.CHANGE_NOTIFICATIONS_MIN_INTERVAL > 0:
     app.conf.beat_schedule['send-bulk-emails'] = {
         'task': 'taiga.projects.notifications.tasks.send_bulk_email',
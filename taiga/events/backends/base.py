@@ -17,6 +17,15 @@ class BaseEventsPushBackend(object, metaclass=abc.ABCMeta):
     def emit_event(self, message:str, *, routing_key:str, channel:str="events"):
         pass
 
+    def emit_events(self, events:list):
+        """
+        Emit a list of events (dicts with `message`, `routing_key` and
+        `channel` keys). Backends that can send several messages in
+        one round should override it.
+        """
+        for event in events:
+            self.emit_event(event["message"], routing_key=event["routing_key"], channel=event["channel"])
+
 
 def load_class(path):
     """
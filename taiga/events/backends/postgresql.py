@@ -5,19 +5,80 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
+import uuid
+
 from django.db import transaction
 from django.db import connection
 
+from taiga.base.utils import json
+
 from . import base
 
+# NOTIFY payloads must be shorter than 8000 bytes
+MAX_PAYLOAD_SIZE = 7999
+
+# Size of the pieces of a chunked message. Small enough to fit in a payload
+# even if every character needs to be escaped in the chunk envelope.
+CHUNK_SIZE = 3900
+
+
+def _get_channel_name(channel, routing_key):
+    routing_key = routing_key.replace(".", "__")
+    channel = "{channel}_{routing_key}".format(channel=channel,
+                                               routing_key=routing_key)
+    # Same name that postgresql uses for an unquoted NOTIFY identifier
+    return channel.lower()[:63]
+
+
+def split_message(message:str):
+    """
+    Split a message too long for a NOTIFY payload in a list of chunk
+    messages with the format:
+
+        {"chunk": {"id": <uuid>, "index": <0..total-1>, "total": <total>},
+         "data": <piece of the original message>}
+
+    Consumers have to concatenate the `data` of all the chunks of an
+    `id` to rebuild the original message.
+    """
+    if len(message.encode("utf-8")) <= MAX_PAYLOAD_SIZE:
+        return [message]
+
+    chunk_id = uuid.uuid4().hex
+    pieces = [message[i:i + CHUNK_SIZE] for i in range(0, len(message), CHUNK_SIZE)]
+    return [json.dumps({"chunk": {"id": chunk_id, "index": index, "total": len(pieces)},
+                        "data": piece})
+            for index, piece in enumerate(pieces)]
+
+
+def get_notifications(events:list):
+    """
+    Get the list of `(channel, payload)` notifications of a list of events.
+    """
+    notifications = []
+    for event in events:
+        channel = _get_channel_name(event["channel"], event["routing_key"])
+        for payload in split_message(event["message"]):
+            notifications.append((channel, payload))
+    return notifications
+
 
 class EventsPushBackend(base.BaseEventsPushBackend):
-    @transaction.atomic
     def emit_event(self, message:str, *, routing_key:str, channel:str="events"):
-        routing_key = routing_key.replace(".", "__")
-        channel = "{channel}_{routing_key}".format(channel=channel,
-                                                   routing_key=routing_key)
-        sql = "NOTIFY {channel}, %s".format(channel=channel)
-        cursor = connection.cursor()
-        cursor.execute(sql, [message])
-        cursor.close()
+        self.emit_events([{"message": message, "routing_key": routing_key, "channel": channel}])
+
+    @transaction.atomic
+    def emit_events(self, events:list):
+        notifications = get_notifications(events)
+        if not notifications:
+            return
+
+        channels = [channel for channel, payload in notifications]
+        payloads = [payload for channel, payload in notifications]
+
+        sql = """
+        SELECT pg_notify(notification.channel, notification.payload)
+          FROM unnest(%s::text[], %s::text[]) AS notification (channel, payload)
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [channels, payloads])
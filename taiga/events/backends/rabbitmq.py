@@ -5,11 +5,14 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
-import json
 import logging
+import os
+import threading
 
 from amqp import Connection as AmqpConnection
 from amqp.exceptions import AccessRefused
+from amqp.exceptions import AMQPError
+from amqp.exceptions import MessageNacked
 from amqp.basic_message import Message as AmqpMessage
 from urllib.parse import urlparse
 
@@ -18,7 +21,7 @@ from . import base
 log = logging.getLogger("tagia.events")
 
 
-def _make_rabbitmq_connection(url):
+def _make_rabbitmq_connection(url, **kwargs):
     parse_result = urlparse(url)
 
     # Parse host & user/password
@@ -34,17 +37,158 @@ def _make_rabbitmq_connection(url):
 
     vhost = parse_result.path
     return AmqpConnection(host=host, userid=user,
-                          password=password, virtual_host=vhost[1:])
+                          password=password, virtual_host=vhost[1:],
+                          **kwargs)
+
+
+class AmqpPublisher(object):
+    """
+    Long lived AMQP connection/channel used to publish events.
+
+    The connection is opened lazily on the first publish and reused
+    by every following one; if the broker drops it, it is reopened
+    on the next publish. Exchanges are declared only once per channel.
+    """
+
+    def __init__(self, url, *, confirm_publish=True, connect_timeout=None, confirm_timeout=None):
+        self.url = url
+        self.confirm_publish = confirm_publish
+        self.connect_timeout = connect_timeout
+        self.confirm_timeout = confirm_timeout
+        self.lock = threading.RLock()
+
+        self._connection = None
+        self._channel = None
+        self._declared_exchanges = set()
+        self._delivery_tag = 0
+        self._confirmed_tag = 0
+        self._nacked = False
+
+    def _open_channel(self):
+        if self._channel is not None and self._connection.connected:
+            return self._channel
+
+        self.close()
+
+        connection = _make_rabbitmq_connection(self.url, connect_timeout=self.connect_timeout)
+        connection.connect()
+        channel = connection.channel()
+
+        if self.confirm_publish:
+            channel.events["basic_ack"].add(self._on_ack)
+            channel.events["basic_nack"].add(self._on_nack)
+            channel.confirm_select()
+
+        self._connection = connection
+        self._channel = channel
+        return channel
+
+    def _on_ack(self, delivery_tag, multiple):
+        self._confirmed_tag = max(self._confirmed_tag, delivery_tag)
+
+    def _on_nack(self, delivery_tag, multiple):
+        self._confirmed_tag = max(self._confirmed_tag, delivery_tag)
+        self._nacked = True
+
+    def _wait_for_confirms(self):
+        while self._confirmed_tag < self._delivery_tag:
+            self._connection.drain_events(timeout=self.confirm_timeout)
+
+        if self._nacked:
+            self._nacked = False
+            raise MessageNacked()
+
+    def _publish(self, events):
+        channel = self._open_channel()
+
+        for event in events:
+            exchange = event["channel"]
+            if exchange not in self._declared_exchanges:
+                channel.exchange_declare(exchange=exchange, type="topic", auto_delete=True)
+                self._declared_exchanges.add(exchange)
+
+            channel.basic_publish(AmqpMessage(event["message"]),
+                                  routing_key=event["routing_key"],
+                                  exchange=exchange)
+            self._delivery_tag += 1
+
+        if self.confirm_publish:
+            self._wait_for_confirms()
+
+    def publish(self, events):
+        """
+        Publish a list of events (dicts with `message`, `routing_key`
+        and `channel` keys) in a single round. If the connection is
+        broken, or the broker nacks some event, it is reopened and the
+        whole round is retried once.
+        """
+        with self.lock:
+            try:
+                self._publish(events)
+            except (AMQPError, MessageNacked, OSError):
+                self.close()
+                self._publish(events)
+
+    def close(self):
+        connection = self._connection
+
+        self._connection = None
+        self._channel = None
+        self._declared_exchanges = set()
+        self._delivery_tag = 0
+        self._confirmed_tag = 0
+        self._nacked = False
+
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                connection.collect()
+
+
+_publishers = {}
+_publishers_pid = None
+_publishers_lock = threading.Lock()
+
+
+def get_publisher(url, **options):
+    """
+    Get the publisher shared by the current process for an url.
+
+    Publishers inherited from a parent process (after a fork) are
+    discarded without closing them, because the parent still owns
+    their sockets.
+    """
+    global _publishers_pid
+
+    with _publishers_lock:
+        pid = os.getpid()
+        if _publishers_pid != pid:
+            _publishers.clear()
+            _publishers_pid = pid
+
+        key = (url, tuple(sorted(options.items())))
+        publisher = _publishers.get(key, None)
+        if publisher is None:
+            publisher = _publishers[key] = AmqpPublisher(url, **options)
+
+        return publisher
 
 
 class EventsPushBackend(base.BaseEventsPushBackend):
-    def __init__(self, url):
+    def __init__(self, url, confirm_publish=True, connect_timeout=5, confirm_timeout=5):
         self.url = url
+        self.publisher = get_publisher(url,
+                                       confirm_publish=confirm_publish,
+                                       connect_timeout=connect_timeout,
+                                       confirm_timeout=confirm_timeout)
 
     def emit_event(self, message:str, *, routing_key:str, channel:str="events"):
-        connection = _make_rabbitmq_connection(self.url)
+        self.emit_events([{"message": message, "routing_key": routing_key, "channel": channel}])
+
+    def emit_events(self, events:list):
         try:
-            connection.connect()
+            self.publisher.publish(events)
         except ConnectionRefusedError:
             err_msg = "EventsPushBackend: Unable to connect with RabbitMQ (connection refused) at {}".format(
                                                                                                      self.url)
@@ -53,15 +197,6 @@ class EventsPushBackend(base.BaseEventsPushBackend):
             err_msg = "EventsPushBackend: Unable to connect with RabbitMQ (access refused) at {}".format(
                                                                                                  self.url)
             log.error(err_msg, exc_info=True)
-        else:
-            try:
-                message = AmqpMessage(message)
-                rchannel = connection.channel()
-
-                rchannel.exchange_declare(exchange=channel, type="topic", auto_delete=True)
-                rchannel.basic_publish(message, routing_key=routing_key, exchange=channel)
-                rchannel.close()
-            except Exception:
-                log.error("EventsPushBackend: Unhandled exception", exc_info=True)
-            finally:
-                connection.close()
+        except Exception:
+            log.error("EventsPushBackend: Unhandled exception", exc_info=True)
+            self.publisher.close()
@@ -20,24 +20,134 @@ from taiga.front.templatetags.functions import resolve
 from taiga.projects.history.choices import HistoryType
 
 
+class EventsBatch(object):
+    """
+    `on_commit` callback that emits, in one backend round, all the events
+    queued in the same transaction.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.events = []
+
+    def __call__(self):
+        if self.events:
+            events = coalesce_events(self.events,
+                                     merge=getattr(settings, "EVENTS_COALESCE_CHANGES", False))
+            self.backend.emit_events([_serialize_event(event) for event in events])
+
+
+def _serialize_event(event):
+    return {"message": json.dumps(event["payload"]),
+            "routing_key": event["routing_key"],
+            "channel": event["channel"]}
+
+
+def _is_change_event(data):
+    return isinstance(data, dict) and set(data.keys()) == {"type", "matches", "pk"}
+
+
+def coalesce_events(events, *, merge:bool=False, max_pks:int=None):
+    """
+    Remove the repeated model change events of a list of queued events.
+
+    If `merge` is True, the change events of the same type that share
+    routing key (project and content type) are merged in one message
+    with the list of affected pks and the flag `"coalesced": true`, so
+    only the consumers that understand that format should enable it
+    (with the `EVENTS_COALESCE_CHANGES` setting). A merged message has
+    at most `max_pks` pks (`EVENTS_MAX_IDS_PER_MESSAGE` by default).
+    """
+    if max_pks is None:
+        max_pks = settings.EVENTS_MAX_IDS_PER_MESSAGE
+
+    result = []
+    seen = set()
+    merged = {}
+
+    for event in events:
+        payload = event["payload"]
+        data = payload["data"]
+
+        if not _is_change_event(data):
+            result.append(event)
+            continue
+
+        key = (event["channel"], event["routing_key"], payload["session_id"],
+               data["type"], data["matches"])
+        pks = list(data["pk"]) if isinstance(data["pk"], (list, tuple)) else [data["pk"]]
+
+        if not merge:
+            pk_key = tuple(pks) if isinstance(data["pk"], (list, tuple)) else data["pk"]
+            if (key, pk_key) not in seen:
+                seen.add((key, pk_key))
+                result.append(event)
+            continue
+
+        for pk in pks:
+            if (key, pk) in seen:
+                continue
+            seen.add((key, pk))
+
+            if key not in merged or len(merged[key]["pk"]) >= max_pks:
+                merged[key] = {"type": data["type"],
+                               "matches": data["matches"],
+                               "pk": [],
+                               "coalesced": True}
+                result.append({"payload": {"session_id": payload["session_id"],
+                                           "data": merged[key]},
+                               "routing_key": event["routing_key"],
+                               "channel": event["channel"]})
+
+            merged[key]["pk"].append(pk)
+
+    return result
+
+
+def _get_events_batch(backend):
+    # Commit hooks registered inside a savepoint are discarded by django
+    # when it is rolled back, so a batch is only reused for events queued
+    # under the same savepoints. Only the last registered batch is checked
+    # to keep the events in order.
+    savepoint_ids = set(connection.savepoint_ids)
+    for hook in reversed(connection.run_on_commit):
+        sids, func = hook[0], hook[1]
+        if isinstance(func, EventsBatch):
+            if sids == savepoint_ids and type(func.backend) == type(backend):
+                return func
+            break
+
+    batch = EventsBatch(backend)
+    connection.on_commit(batch)
+    return batch
+
+
 def emit_event(data:dict, routing_key:str, *,
                sessionid:str=None, channel:str="events",
                on_commit:bool=True):
     if not sessionid:
         sessionid = mw.get_current_session_id()
 
-    data = {"session_id": sessionid,
-            "data": data}
-
     backend = backends.get_events_backend()
+    event = {"payload": {"session_id": sessionid,
+                         "data": data},
+             "routing_key": routing_key,
+             "channel": channel}
 
-    def backend_emit_event():
-        backend.emit_event(message=json.dumps(data), routing_key=routing_key, channel=channel)
-
-    if on_commit:
-        connection.on_commit(backend_emit_event)
+    if on_commit and connection.in_atomic_block:
+        _get_events_batch(backend).events.append(event)
     else:
-        backend_emit_event()
+        backend.emit_events([_serialize_event(event)])
+
+
+def _get_routing_key_for_changes(projectid:int, content_type:str):
+    app_name, model_name = content_type.split(".", 1)
+    routing_key = "changes.project.{0}.{1}".format(projectid, app_name)
+
+    if app_name in settings.INSTALLED_APPS:
+        routing_key = "%s.%s" % (routing_key, model_name)
+
+    return routing_key
 
 
 def emit_event_for_model(obj, *, type:str="change", channel:str="events",
@@ -63,12 +173,7 @@ def emit_event_for_model(obj, *, type:str="change", channel:str="events",
     projectid = getattr(obj, "project_id")
     pk = getattr(obj, "pk", None)
 
-    app_name, model_name = content_type.split(".", 1)
-    routing_key = "changes.project.{0}.{1}".format(projectid, app_name)
-
-    if app_name in settings.INSTALLED_APPS:
-        routing_key = "%s.%s" % (routing_key, model_name)
-
+    routing_key = _get_routing_key_for_changes(projectid, content_type)
     data = {"type": type,
             "matches": content_type,
             "pk": pk}
@@ -174,20 +279,36 @@ def emit_live_notification_for_model(obj, user, history, *, type:str="change", c
         sessionid=sessionid
     )
 
+
 def emit_event_for_ids(ids, content_type:str, projectid:int, *,
                        type:str="change", channel:str="events", sessionid:str=None):
+    """
+    Sends a change event for several objects of the same project and
+    content type.
+
+    All the ids are sent in one message (or in messages of at most
+    `EVENTS_MAX_IDS_PER_MESSAGE` ids for very large lists).
+
+        type: create | change | delete
+    """
     assert type in set(["create", "change", "delete"])
     assert isinstance(ids, collections.abc.Iterable)
     assert content_type, "'content_type' parameter is mandatory"
 
-    app_name, model_name = content_type.split(".", 1)
-    routing_key = "changes.project.{0}.{1}".format(projectid, app_name)
+    # Remove duplicates keeping the order
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return None
 
-    data = {"type": type,
-            "matches": content_type,
-            "pk": ids}
+    routing_key = _get_routing_key_for_changes(projectid, content_type)
+    chunk_size = settings.EVENTS_MAX_IDS_PER_MESSAGE
 
-    return emit_event(routing_key=routing_key,
-                      channel=channel,
-                      sessionid=sessionid,
-                      data=data)
+    for i in range(0, len(ids), chunk_size):
+        data = {"type": type,
+                "matches": content_type,
+                "pk": ids[i:i + chunk_size]}
+
+        emit_event(routing_key=routing_key,
+                   channel=channel,
+                   sessionid=sessionid,
+                   data=data)
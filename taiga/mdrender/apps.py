@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2021-present Kaleidos INC
+
+from django.apps import AppConfig
+from django.apps import apps
+from django.db.models import signals
+
+
+ITEM_MODELS = ["epics.Epic", "userstories.UserStory", "tasks.Task", "issues.Issue"]
+
+
+def connect_mdrender_signals():
+    from . import signals as handlers
+
+    # Versions of the cached rendered texts of the projects
+    signals.post_save.connect(handlers.bump_project_version_on_project_save,
+                              sender=apps.get_model("projects", "Project"),
+                              dispatch_uid="mdrender_project_save")
+    signals.post_save.connect(handlers.bump_project_version_on_project_data_change,
+                              sender=apps.get_model("projects", "Membership"),
+                              dispatch_uid="mdrender_membership_save")
+    signals.post_delete.connect(handlers.bump_project_version_on_project_data_change,
+                                sender=apps.get_model("projects", "Membership"),
+                                dispatch_uid="mdrender_membership_delete")
+    signals.post_save.connect(handlers.bump_project_version_on_project_data_change,
+                              sender=apps.get_model("references", "Reference"),
+                              dispatch_uid="mdrender_reference_save")
+
+    for model_name in ITEM_MODELS:
+        signals.post_save.connect(handlers.bump_project_version_on_item_save,
+                                  sender=apps.get_model(model_name),
+                                  dispatch_uid="mdrender_{}_save".format(model_name))
+        signals.post_delete.connect(handlers.bump_project_version_on_project_data_change,
+                                    sender=apps.get_model(model_name),
+                                    dispatch_uid="mdrender_{}_delete".format(model_name))
+
+
+def disconnect_mdrender_signals():
+    signals.post_save.disconnect(sender=apps.get_model("projects", "Project"),
+                                 dispatch_uid="mdrender_project_save")
+    signals.post_save.disconnect(sender=apps.get_model("projects", "Membership"),
+                                 dispatch_uid="mdrender_membership_save")
+    signals.post_delete.disconnect(sender=apps.get_model("projects", "Membership"),
+                                   dispatch_uid="mdrender_membership_delete")
+    signals.post_save.disconnect(sender=apps.get_model("references", "Reference"),
+                                 dispatch_uid="mdrender_reference_save")
+
+    for model_name in ITEM_MODELS:
+        signals.post_save.disconnect(sender=apps.get_model(model_name),
+                                     dispatch_uid="mdrender_{}_save".format(model_name))
+        signals.post_delete.disconnect(sender=apps.get_model(model_name),
+                                       dispatch_uid="mdrender_{}_delete".format(model_name))
+
+
+class MdrenderAppConfig(AppConfig):
+    name = "taiga.mdrender"
+    verbose_name = "Markdown render"
+
+    def ready(self):
+        connect_mdrender_signals()
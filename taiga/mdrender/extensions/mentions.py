@@ -30,8 +30,11 @@
 # THE SOFTWARE.
 from django.contrib.auth import get_user_model
 
+import re
+
 from markdown.extensions import Extension
 from markdown.inlinepatterns import Pattern
+from markdown.preprocessors import Preprocessor
 from markdown.util import AtomicString
 from xml.etree import ElementTree as etree
 from taiga.front.templatetags.functions import resolve
@@ -49,6 +52,38 @@ class MentionsExtension(Extension):
         mentionsPattern = MentionsPattern(MENTION_RE, project=self.project)
         mentionsPattern.md = md
         md.inlinePatterns.register(mentionsPattern, "mentions", 80)
+        md.preprocessors.register(MentionsPreprocessor(md, mentionsPattern), "mentions-prescan", 0)
+        self.mentions_pattern = mentionsPattern
+
+    def set_project(self, project):
+        self.project = project
+        self.mentions_pattern.project = project
+
+
+PRESCAN_MENTION_RE = re.compile(r"\B@([\w.-]+)\b")
+
+
+class MentionsPreprocessor(Preprocessor):
+    """
+    Resolve all the mentioned users of the document at once, before the
+    inline patterns need them.
+    """
+    def __init__(self, md, pattern):
+        self.pattern = pattern
+        super().__init__(md)
+
+    def run(self, lines):
+        usernames = set(PRESCAN_MENTION_RE.findall("\n".join(lines)))
+        if not usernames:
+            self.pattern.users = {}
+            return lines
+
+        kwargs = {"username__in": usernames}
+        if self.pattern.project is not None:
+            kwargs["memberships__project_id"] = self.pattern.project.id
+
+        self.pattern.users = {user.username: user for user in get_user_model().objects.filter(**kwargs)}
+        return lines
 
 
 class MentionsPattern(Pattern):
@@ -56,16 +91,13 @@ class MentionsPattern(Pattern):
 
     def __init__(self, pattern, md=None, project=None):
         self.project = project
+        self.users = {}
         super().__init__(pattern, md)
 
     def handleMatch(self, m):
         username = m.group(3)
-        kwargs = {"username": username}
-        if self.project is not None:
-            kwargs["memberships__project_id"]=self.project.id
-        try:
-            user = get_user_model().objects.get(**kwargs)
-        except get_user_model().DoesNotExist:
+        user = self.users.get(username, None)
+        if user is None:
             return "@{}".format(username)
 
         url = resolve("user", username)
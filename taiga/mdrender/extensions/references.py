@@ -31,11 +31,20 @@
 
 from markdown.extensions import Extension
 from markdown.inlinepatterns import Pattern
+from markdown.preprocessors import Preprocessor
 from xml.etree import ElementTree as etree
 
-from taiga.projects.references.services import get_instance_by_ref
+from taiga.projects.references.services import get_instances_by_refs
 from taiga.front.templatetags.functions import resolve
 
+import re
+
+# Looser than the inline pattern (it matches every reference the inline
+# pattern matches, whatever precedes or follows it): fetching some reference
+# that is not rendered is cheap, missing one is not. The 18 digits keep the
+# refs in the range of the database integers.
+PRESCAN_REFERENCE_RE = re.compile(r"#(\d{1,18})")
+
 
 class TaigaReferencesExtension(Extension):
     def __init__(self, project, *args, **kwargs):
@@ -47,17 +56,43 @@ class TaigaReferencesExtension(Extension):
         referencesPattern = TaigaReferencesPattern(TAIGA_REFERENCE_RE, self.project)
         referencesPattern.md = md
         md.inlinePatterns.register(referencesPattern, 'taiga-references', 65)
+        md.preprocessors.register(TaigaReferencesPreprocessor(md, referencesPattern),
+                                  'taiga-references-prescan', 0)
+        self.references_pattern = referencesPattern
+
+    def set_project(self, project):
+        self.project = project
+        self.references_pattern.project = project
+
+
+class TaigaReferencesPreprocessor(Preprocessor):
+    """
+    Resolve all the references of the document at once, before the inline
+    patterns need them.
+    """
+    def __init__(self, md, pattern):
+        self.pattern = pattern
+        super().__init__(md)
+
+    def run(self, lines):
+        refs = {int(ref) for ref in PRESCAN_REFERENCE_RE.findall("\n".join(lines))}
+        if refs and self.pattern.project is not None:
+            self.pattern.instances = get_instances_by_refs(self.pattern.project.id, refs)
+        else:
+            self.pattern.instances = {}
+        return lines
 
 
 class TaigaReferencesPattern(Pattern):
     def __init__(self, pattern, project):
         self.project = project
+        self.instances = {}
         super().__init__(pattern)
 
     def handleMatch(self, m):
         obj_ref = m.group(2)
 
-        instance = get_instance_by_ref(self.project.id, obj_ref)
+        instance = self.instances.get(int(obj_ref), None)
         if instance is None or instance.content_object is None:
             return "#{}".format(obj_ref)
 
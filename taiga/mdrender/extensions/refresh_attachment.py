@@ -21,10 +21,15 @@ class RefreshAttachmentExtension(markdown.Extension):
         super().__init__(*args, **kwargs)
 
     def extendMarkdown(self, md):
-        md.treeprocessors.register(RefreshAttachmentTreeprocessor(md, project=self.project),
+        self.refresh_attachment_processor = RefreshAttachmentTreeprocessor(md, project=self.project)
+        md.treeprocessors.register(self.refresh_attachment_processor,
                                    "refresh_attachment",
                                    20)
 
+    def set_project(self, project):
+        self.project = project
+        self.refresh_attachment_processor.project = project
+
 
 class RefreshAttachmentTreeprocessor(Treeprocessor):
     def __init__(self, *args, **kwargs):
@@ -23,13 +23,20 @@ class WikiLinkExtension(Extension):
 
     def extendMarkdown(self, md):
         WIKILINK_RE = r"\[\[([\w0-9_ -]+)(\|[^\]]+)?\]\]"
-        md.inlinePatterns.register(WikiLinksPattern(md, WIKILINK_RE, self.project),
+        self.wikilinks_pattern = WikiLinksPattern(md, WIKILINK_RE, self.project)
+        md.inlinePatterns.register(self.wikilinks_pattern,
                                    "wikilinks",
                                    20)
-        md.treeprocessors.register(RelativeLinksTreeprocessor(md, self.project),
+        self.relative_links_processor = RelativeLinksTreeprocessor(md, self.project)
+        md.treeprocessors.register(self.relative_links_processor,
                                    "relative_to_absolute_links",
                                    20)
 
+    def set_project(self, project):
+        self.project = project
+        self.wikilinks_pattern.project = project
+        self.relative_links_processor.project = project
+
 
 class WikiLinksPattern(Pattern):
     def __init__(self, md, pattern, project):
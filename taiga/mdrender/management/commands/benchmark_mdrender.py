@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2021-present Kaleidos INC
+
+# Examples:
+# python manage.py benchmark_mdrender 42
+# python manage.py benchmark_mdrender 42 --renders 5000
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.test.utils import override_settings
+
+from taiga.mdrender import service
+from taiga.projects.models import Project
+
+
+TEXTS = [
+    "Looks good to me",
+    "**Done**, see the [release notes](release-notes) and https://example.com/",
+    ("## Steps to reproduce\n\n"
+     "1. Open the backlog\n"
+     "2. Drag a *user story* to the sprint\n\n"
+     "- [x] Tested on _Firefox_\n"
+     "- [ ] Tested on ~~Internet Explorer~~ :smile:\n\n"
+     "```python\n"
+     "def main():\n"
+     "    return 42\n"
+     "```\n\n"
+     "| Browser | Result |\n"
+     "|---------|--------|\n"
+     "| Firefox | ok     |\n"),
+]
+
+
+class Command(BaseCommand):
+    help = "Measure the render throughput of mdrender with and without the pool of Markdown instances"
+
+    def add_arguments(self, parser):
+        parser.add_argument("project_id", type=int,
+                            help="Id of the project used to render the texts")
+        parser.add_argument("--renders", type=int, default=2000,
+                            help="Number of measured renders")
+
+    def _measure(self, project, renders):
+        start = time.perf_counter()
+        for i in range(renders):
+            service.render(project, TEXTS[i % len(TEXTS)])
+        return renders / (time.perf_counter() - start)
+
+    @override_settings(DEBUG=False, MDRENDER_CACHE_ENABLE=False)
+    def handle(self, *args, **options):
+        try:
+            project = Project.objects.get(id=options["project_id"])
+        except Project.DoesNotExist:
+            raise CommandError("There is no project with the id '{}'".format(options["project_id"]))
+
+        with override_settings(MDRENDER_POOL_SIZE=0):
+            without_pool = self._measure(project, options["renders"])
+
+        with override_settings(MDRENDER_POOL_SIZE=max(settings.MDRENDER_POOL_SIZE, 1)):
+            # Warm up the pool
+            service.render(project, TEXTS[0])
+            with_pool = self._measure(project, options["renders"])
+
+        self.stdout.write("Without pool: {:.0f} renders/s".format(without_pool))
+        self.stdout.write("With pool: {:.0f} renders/s".format(with_pool))
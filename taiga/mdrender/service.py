@@ -7,8 +7,13 @@
 
 from django.conf import settings
 
+import collections
 import hashlib
 import functools
+import sys
+import threading
+import time
+import uuid
 import bleach
 
 # BEGIN PATCH
@@ -29,6 +34,7 @@ bleach._serialize = _serialize
 # END PATCH
 
 from django.core.cache import cache
+from django.db import connection
 from django.utils.encoding import force_bytes
 
 from markdown import Markdown
@@ -92,6 +98,116 @@ def _make_extension_configs():
 import diff_match_patch
 
 
+class LRUCache(object):
+    """
+    Thread safe in-process LRU cache bounded by the total size (in bytes)
+    of the cached values.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return self._data[key][0]
+
+    def set(self, key, value):
+        size = sys.getsizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.size -= self._data.pop(key)[1]
+
+            if size > self.max_size:
+                return
+
+            self._data[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self._data), "size": self.size}
+
+
+_local_cache = None
+
+
+def get_local_cache():
+    global _local_cache
+
+    if _local_cache is None or _local_cache.max_size != settings.MDRENDER_LOCAL_CACHE_SIZE:
+        _local_cache = LRUCache(settings.MDRENDER_LOCAL_CACHE_SIZE)
+    return _local_cache
+
+
+def _get_project_version_key(project_id):
+    return "mdrender-version/{}".format(project_id)
+
+
+# {project_id: (version, expiration)}, to avoid asking the shared cache
+# for the version on every render.
+_local_versions = {}
+
+
+def get_project_version(project_id):
+    """
+    Get the version of the rendered texts of a project (it is part of the
+    keys of the cache).
+    """
+    now = time.monotonic()
+    version, expiration = _local_versions.get(project_id, (None, 0))
+    if expiration > now:
+        return version
+
+    key = _get_project_version_key(project_id)
+    version = cache.get(key)
+    if version is None:
+        # Unknown (or evicted) version, start a new one so the texts cached
+        # with the previous one are never used again
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key) or uuid.uuid4().hex
+
+    _local_versions[project_id] = (version, now + settings.MDRENDER_VERSION_LOCAL_TIMEOUT)
+    return version
+
+
+def bump_project_version(project_id):
+    """
+    Invalidate the cached rendered texts of a project. The other processes
+    see the new version after MDRENDER_VERSION_LOCAL_TIMEOUT seconds.
+
+    The version is bumped again on commit, because a text rendered with the
+    new version before the commit can be using the old data.
+    """
+    def _bump():
+        version = uuid.uuid4().hex
+        cache.set(_get_project_version_key(project_id), version, timeout=None)
+        _local_versions[project_id] = (version, time.monotonic() + settings.MDRENDER_VERSION_LOCAL_TIMEOUT)
+
+    _bump()
+    connection.on_commit(_bump)
+
+
 def cache_by_sha(func):
     @functools.wraps(func)
     def _decorator(project, text):
@@ -103,38 +219,105 @@ def cache_by_sha(func):
             return func(project, text)
 
         sha1_hash = hashlib.sha1(force_bytes(text)).hexdigest()
-        key = "mdrender/{}-{}".format(sha1_hash, project.id)
+        key = "mdrender/{}-{}-{}".format(sha1_hash, project.id, get_project_version(project.id))
+
+        # Try to get it from the cache of this process and then from the
+        # shared cache
+        local_cache = get_local_cache()
+        cached = local_cache.get(key)
+        if cached is not None:
+            return cached
 
-        # Try to get it from the cache
         cached = cache.get(key)
         if cached is not None:
+            local_cache.set(key, cached)
             return cached
 
         returned_value = func(project, text)
         cache.set(key, returned_value, timeout=settings.MDRENDER_CACHE_TIMEOUT)
+        local_cache.set(key, returned_value)
         return returned_value
 
     return _decorator
 
 
-def _get_markdown(project):
+def _make_markdown(project):
     extensions = _make_extensions_list(project=project)
     extension_configs = _make_extension_configs()
     md = Markdown(extensions=extensions, extension_configs=extension_configs)
-    md.extracted_data = {"mentions": [], "references": []}
+    md.project_extensions = [ext for ext in extensions if hasattr(ext, "set_project")]
     return md
 
 
+class MarkdownPool(object):
+    """
+    Bounded pool of Markdown instances of a thread, keyed by project.
+
+    Building a Markdown instance (and its extensions) costs much more than
+    rendering a usual text, so the instances are reused: they are `reset()`
+    and their project extensions are bound to the current project object
+    before every use. An instance is taken out of the pool while it is in
+    use, so a nested render never shares it.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.instances = {}
+
+    def acquire(self, project):
+        key = getattr(project, "id", None)
+        md = self.instances.pop(key, None)
+        if md is None:
+            return _make_markdown(project)
+
+        md.reset()
+        for extension in md.project_extensions:
+            extension.set_project(project)
+        return md
+
+    def release(self, project, md):
+        key = getattr(project, "id", None)
+        if self.size <= 0 or key in self.instances:
+            return
+
+        # Dicts keep the insertion order, so the first key is the least
+        # recently released instance.
+        if len(self.instances) >= self.size:
+            del self.instances[next(iter(self.instances))]
+
+        self.instances[key] = md
+
+
+_pools = threading.local()
+
+
+def _get_markdown_pool():
+    pool = getattr(_pools, "pool", None)
+    if pool is None or pool.size != settings.MDRENDER_POOL_SIZE:
+        pool = _pools.pool = MarkdownPool(settings.MDRENDER_POOL_SIZE)
+    return pool
+
+
+def _convert(project, text):
+    pool = _get_markdown_pool()
+    md = pool.acquire(project)
+    md.extracted_data = {"mentions": [], "references": []}
+    try:
+        result = bleach.clean(md.convert(text), protocols=ALLOWED_PROTOCOLS)
+        return (result, md.extracted_data)
+    finally:
+        md.extracted_data = None
+        pool.release(project, md)
+
+
 @cache_by_sha
 def render(project, text):
-    md = _get_markdown(project)
-    return bleach.clean(md.convert(text), protocols=ALLOWED_PROTOCOLS)
+    result, _ = _convert(project, text)
+    return result
 
 
 def render_and_extract(project, text):
-    md = _get_markdown(project)
-    result = bleach.clean(md.convert(text), protocols=ALLOWED_PROTOCOLS)
-    return (result, md.extracted_data)
+    return _convert(project, text)
 
 
 class DiffMatchPatch(diff_match_patch.diff_match_patch):
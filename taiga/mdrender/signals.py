@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2021-present Kaleidos INC
+
+from . import service
+
+
+def bump_project_version_on_project_save(sender, instance, update_fields=None, **kwargs):
+    # The slug of the project is in the links of the rendered texts
+    if update_fields is not None and "slug" not in update_fields:
+        return
+
+    service.bump_project_version(instance.id)
+
+
+def bump_project_version_on_project_data_change(sender, instance, **kwargs):
+    # The references, items and members of a project decide which `#ref` and
+    # `@mentions` are rendered as links
+    service.bump_project_version(instance.project_id)
+
+
+def bump_project_version_on_item_save(sender, instance, created, **kwargs):
+    # New items are rendered as links when their reference is created
+    if created:
+        return
+
+    prev_project = getattr(instance, "prev_project", None)
+    if prev_project is not None and prev_project.id != instance.project_id:
+        service.bump_project_version(prev_project.id)
+        service.bump_project_version(instance.project_id)
+
+    # The subject of the item is the title of the links to it
+    elif getattr(instance, "prev_subject", instance.subject) != instance.subject:
+        service.bump_project_version(instance.project_id)
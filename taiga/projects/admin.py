@@ -217,12 +217,15 @@ class ProjectAdmin(admin.ModelAdmin):
                                                 disconnect_all_issues_signals)
         from taiga.projects.apps import (connect_memberships_signals,
                                          disconnect_memberships_signals)
+        from taiga.mdrender.apps import (connect_mdrender_signals,
+                                         disconnect_mdrender_signals)
 
         disconnect_events_signals()
         disconnect_all_issues_signals()
         disconnect_all_tasks_signals()
         disconnect_all_userstories_signals()
         disconnect_memberships_signals()
+        disconnect_mdrender_signals()
 
         try:
             super().delete_queryset(request, queryset)
@@ -232,6 +235,7 @@ class ProjectAdmin(admin.ModelAdmin):
             connect_all_tasks_signals()
             connect_all_userstories_signals()
             connect_memberships_signals()
+            connect_mdrender_signals()
 
 # User Stories common admins
 class PointsAdmin(admin.ModelAdmin):
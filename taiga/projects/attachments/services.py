@@ -10,12 +10,15 @@ from typing import List, Optional, Union
 from urllib.parse import parse_qs, urldefrag
 
 from django.apps import apps
+from django.core.cache import cache
 from django.db import connection
 from django.conf import settings
 
 from psycopg2.extras import execute_values
 
 from taiga.base.utils.thumbnails import get_thumbnail_url, get_thumbnail
+from taiga.base.utils.thumbnails import get_thumbnail_name, generate_thumbnail
+from taiga.celery import app
 
 from . import models
 
@@ -71,13 +74,58 @@ def url_is_an_attachment(url: str, base=None) -> "Union[str, None]":
 
 # Thumbnail services
 
+def _get_generated_thumbnail_cache_key(thumbnail_name):
+    return "thumbnail-generated:{}".format(thumbnail_name)
+
+
+def _get_failed_thumbnail_cache_key(attachment, thumbnailer_size):
+    # By content, so it's tried again if the file of the attachment changes
+    content_key = attachment.sha1 or "attachment-{}".format(attachment.id)
+    return "thumbnail-failed:{}:{}".format(thumbnailer_size, content_key)
+
+
 def get_timeline_image_thumbnail_name(attachment):
+    """
+    Get the name of the timeline thumbnail of an attachment. The thumbnail
+    is generated asynchronously (in the `thumbnails` celery queue) if it
+    doesn't exist yet. Return None if it can't be generated (the file is
+    not a valid image).
+    """
     if attachment.attached_file:
-        thumbnail = get_thumbnail(attachment.attached_file, settings.THN_ATTACHMENT_TIMELINE)
-        return thumbnail.name if thumbnail else None
+        thumbnailer_size = settings.THN_ATTACHMENT_TIMELINE
+        if cache.get(_get_failed_thumbnail_cache_key(attachment, thumbnailer_size)):
+            return None
+
+        thumbnail_name = get_thumbnail_name(attachment.attached_file, thumbnailer_size)
+        if thumbnail_name and not cache.get(_get_generated_thumbnail_cache_key(thumbnail_name)):
+            if settings.CELERY_ENABLED:
+                connection.on_commit(lambda: generate_attachment_thumbnail.delay(attachment.id,
+                                                                                 thumbnailer_size))
+            else:
+                thumbnail_name = generate_attachment_thumbnail(attachment.id, thumbnailer_size)
+        return thumbnail_name
     return None
 
 
+@app.task(queue="thumbnails", routing_key="thumbnails.generate")
+def generate_attachment_thumbnail(attachment_id, thumbnailer_size):
+    model_cls = apps.get_model("attachments", "Attachment")
+    attachment = model_cls.objects.filter(id=attachment_id).first()
+    if attachment is None or not attachment.attached_file:
+        return None
+
+    thumbnail_name = generate_thumbnail(attachment.attached_file, thumbnailer_size,
+                                        content_hash=attachment.sha1 or None)
+    if thumbnail_name:
+        cache.set(_get_generated_thumbnail_cache_key(thumbnail_name), True,
+                  timeout=settings.THUMBNAILS_GENERATED_CACHE_TIMEOUT)
+    else:
+        # Not generated (or scheduled) again while the content is the same
+        cache.set(_get_failed_thumbnail_cache_key(attachment, thumbnailer_size), True,
+                  timeout=settings.THUMBNAILS_GENERATED_CACHE_TIMEOUT)
+    return thumbnail_name
+
+
 def get_card_image_thumbnail_url(attachment):
     if attachment.attached_file:
         return get_thumbnail_url(attachment.attached_file, settings.THN_ATTACHMENT_CARD)
@@ -5,7 +5,6 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
-from django.http import HttpResponse
 from django.utils.translation import gettext as _
 
 from taiga.base.api.utils import get_object_or_error
@@ -22,6 +21,7 @@ from taiga.projects.mixins.by_ref import ByRefMixin
 from taiga.projects.models import Project, EpicStatus
 from taiga.projects.notifications.mixins import WatchedResourceMixin, WatchersViewSetMixin
 from taiga.projects.occ import OCCResourceMixin
+from taiga.projects.services import csv_exports
 from taiga.projects.tagging.api import TaggedResourceMixin
 from taiga.projects.votes.mixins.viewsets import VotedResourceMixin, VotersViewSetMixin
 
@@ -170,11 +170,7 @@ class EpicViewSet(OCCResourceMixin, VotedResourceMixin, HistoryResourceMixin, Wa
             return response.NotFound()
 
         project = get_object_or_error(Project, request.user, epics_csv_uuid=uuid)
-        queryset = project.epics.all().order_by('ref')
-        data = services.epics_to_csv(project, queryset)
-        csv_response = HttpResponse(data.getvalue(), content_type='application/csv; charset=utf-8')
-        csv_response['Content-Disposition'] = 'attachment; filename="epics.csv"'
-        return csv_response
+        return csv_exports.get_csv_response(request, project, "epics")
 
     @list_route(methods=["POST"])
     def bulk_create(self, request, **kwargs):
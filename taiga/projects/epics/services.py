@@ -5,19 +5,20 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
-import csv
 import io
 from collections import OrderedDict
-from operator import itemgetter
-from contextlib import closing
 
-from django.db import connection
-from django.utils.translation import gettext as _
+from django.conf import settings
 
 from taiga.base.utils import db, text
+from taiga.projects.attachments.utils import attach_total_attachments
 from taiga.projects.epics.apps import connect_epics_signals
 from taiga.projects.epics.apps import disconnect_epics_signals
+from taiga.projects.epics.utils import attach_related_user_stories_refs
 from taiga.projects.services import apply_order_updates
+from taiga.projects.services.filters import Facet, get_facets_counts
+from taiga.projects.services.filters import get_choices_filter_data, get_project_users
+from taiga.projects.services.filters import get_tags_filter_data, get_users_filter_data
 from taiga.projects.userstories.apps import connect_userstories_signals
 from taiga.projects.userstories.apps import disconnect_userstories_signals
 from taiga.projects.userstories.services import get_userstories_from_bulk
@@ -165,6 +166,16 @@ def update_epic_related_userstories_order_in_bulk(bulk_data: list, epic: object)
 
 def epics_to_csv(project, queryset):
     csv_data = io.StringIO()
+    csv_data.writelines(iter_epics_csv(project, queryset))
+    return csv_data
+
+
+def iter_epics_csv(project, queryset):
+    """
+    Return an iterator over the lines of the CSV of the epics of the
+    queryset. They are read in chunks, with their related data attached by
+    the query, so the CSV can be streamed in constant memory.
+    """
     fieldnames = [
         "id",
         "ref",
@@ -187,67 +198,69 @@ def epics_to_csv(project, queryset):
         "related_user_stories",
     ]
 
-    custom_attrs = project.epiccustomattributes.all()
+    custom_attrs = list(project.epiccustomattributes.all())
     for custom_attr in custom_attrs:
         fieldnames.append(custom_attr.name)
 
-    queryset = queryset.prefetch_related(
-        "attachments", "custom_attributes_values", "user_stories__project"
+    queryset = queryset.select_related(
+        "owner",
+        "assigned_to",
+        "status",
+        "project",
+        "custom_attributes_values",
     )
-    queryset = queryset.select_related("owner", "assigned_to", "status", "project")
 
+    queryset = attach_total_attachments(queryset)
+    queryset = attach_related_user_stories_refs(queryset)
     queryset = attach_total_voters_to_queryset(queryset)
     queryset = attach_watchers_to_queryset(queryset)
 
-    writer = csv.DictWriter(csv_data, fieldnames=fieldnames)
-    writer.writeheader()
-    for epic in queryset:
-        epic_data = {
-            "id": epic.id,
-            "ref": epic.ref,
-            "subject": text.sanitize_csv_text_value(epic.subject),
-            "description": text.sanitize_csv_text_value(epic.description),
-            "owner": epic.owner.username if epic.owner else None,
-            "owner_full_name": (
-                text.sanitize_csv_text_value(epic.owner.get_full_name())
-                if epic.owner
-                else None
-            ),
-            "assigned_to": epic.assigned_to.username if epic.assigned_to else None,
-            "assigned_to_full_name": (
-                text.sanitize_csv_text_value(epic.assigned_to.get_full_name())
-                if epic.assigned_to
-                else None
-            ),
-            "status": epic.status.name if epic.status else None,
-            "epics_order": epic.epics_order,
-            "client_requirement": epic.client_requirement,
-            "team_requirement": epic.team_requirement,
-            "attachments": epic.attachments.count(),
-            "tags": ",".join(epic.tags or []),
-            "watchers": epic.watchers,
-            "voters": epic.total_voters,
-            "created_date": epic.created_date,
-            "modified_date": epic.modified_date,
-            "related_user_stories": ",".join(
-                [
-                    "{}#{}".format(us.project.slug, us.ref)
-                    for us in epic.user_stories.all()
-                ]
-            ),
-        }
-
-        for custom_attr in custom_attrs:
-            if not hasattr(epic, "custom_attributes_values"):
-                continue
-            value = epic.custom_attributes_values.attributes_values.get(
-                str(custom_attr.id), None
-            )
-            epic_data[custom_attr.name] = text.sanitize_csv_text_value(value)
-
-        writer.writerow(epic_data)
+    rows = (
+        _get_epic_csv_row(epic, custom_attrs)
+        for epic in queryset.iterator(chunk_size=settings.CSV_EXPORT_CHUNK_SIZE)
+    )
+    return text.iter_csv_lines(fieldnames, rows)
+
+
+def _get_epic_csv_row(epic, custom_attrs):
+    epic_data = {
+        "id": epic.id,
+        "ref": epic.ref,
+        "subject": text.sanitize_csv_text_value(epic.subject),
+        "description": text.sanitize_csv_text_value(epic.description),
+        "owner": epic.owner.username if epic.owner else None,
+        "owner_full_name": (
+            text.sanitize_csv_text_value(epic.owner.get_full_name())
+            if epic.owner
+            else None
+        ),
+        "assigned_to": epic.assigned_to.username if epic.assigned_to else None,
+        "assigned_to_full_name": (
+            text.sanitize_csv_text_value(epic.assigned_to.get_full_name())
+            if epic.assigned_to
+            else None
+        ),
+        "status": epic.status.name if epic.status else None,
+        "epics_order": epic.epics_order,
+        "client_requirement": epic.client_requirement,
+        "team_requirement": epic.team_requirement,
+        "attachments": epic.total_attachments,
+        "tags": ",".join(epic.tags or []),
+        "watchers": epic.watchers,
+        "voters": epic.total_voters,
+        "created_date": epic.created_date,
+        "modified_date": epic.modified_date,
+        "related_user_stories": ",".join(epic.related_user_stories_refs_attr or []),
+    }
 
-    return csv_data
+    for custom_attr in custom_attrs:
+        if not hasattr(epic, "custom_attributes_values"):
+            continue
+        value = epic.custom_attributes_values.attributes_values.get(
+            str(custom_attr.id), None
+        )
+        epic_data[custom_attr.name] = text.sanitize_csv_text_value(value)
+    return epic_data
 
 
 #####################################################
@@ -255,238 +268,41 @@ def epics_to_csv(project, queryset):
 #####################################################
 
 
-def _get_epics_statuses(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-      SELECT "projects_epicstatus"."id",
-             "projects_epicstatus"."name",
-             "projects_epicstatus"."color",
-             "projects_epicstatus"."order",
-             (SELECT count(*)
-                FROM "epics_epic"
-                     INNER JOIN "projects_project" ON
-                                ("epics_epic"."project_id" = "projects_project"."id")
-               WHERE {where} AND "epics_epic"."status_id" = "projects_epicstatus"."id")
-        FROM "projects_epicstatus"
-       WHERE "projects_epicstatus"."project_id" = %s
-    ORDER BY "projects_epicstatus"."order";
-    """.format(
-        where=where
-    )
-
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id])
-        rows = cursor.fetchall()
-
-    result = []
-    for id, name, color, order, count in rows:
-        result.append(
-            {
-                "id": id,
-                "name": _(name),
-                "color": color,
-                "order": order,
-                "count": count,
-            }
-        )
-    return sorted(result, key=itemgetter("order"))
-
-
-def _get_epics_assigned_to(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-        WITH counters AS (
-                SELECT assigned_to_id,  count(assigned_to_id) count
-                  FROM "epics_epic"
-            INNER JOIN "projects_project" ON ("epics_epic"."project_id" = "projects_project"."id")
-                 WHERE {where} AND "epics_epic"."assigned_to_id" IS NOT NULL
-              GROUP BY assigned_to_id
-        )
-
-                 SELECT "projects_membership"."user_id" user_id,
-                        "users_user"."full_name",
-                        "users_user"."username",
-                        COALESCE("counters".count, 0) count
-                   FROM projects_membership
-        LEFT OUTER JOIN counters ON ("projects_membership"."user_id" = "counters"."assigned_to_id")
-             INNER JOIN "users_user" ON ("projects_membership"."user_id" = "users_user"."id")
-                  WHERE "projects_membership"."project_id" = %s
-                    AND "projects_membership"."user_id" IS NOT NULL
-
-        -- unassigned epics
-        UNION
-
-                 SELECT NULL user_id, NULL, NULL, count(coalesce(assigned_to_id, -1)) count
-                   FROM "epics_epic"
-             INNER JOIN "projects_project" ON ("epics_epic"."project_id" = "projects_project"."id")
-                  WHERE {where} AND "epics_epic"."assigned_to_id" IS NULL
-               GROUP BY assigned_to_id
-    """.format(
-        where=where
-    )
-
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id] + where_params)
-        rows = cursor.fetchall()
-
-    result = []
-    none_valued_added = False
-    for id, full_name, username, count in rows:
-        result.append(
-            {
-                "id": id,
-                "full_name": full_name or username or "",
-                "count": count,
-            }
-        )
-
-        if id is None:
-            none_valued_added = True
-
-    # If there was no epic with null assigned_to we manually add it
-    if not none_valued_added:
-        result.append(
-            {
-                "id": None,
-                "full_name": "",
-                "count": 0,
-            }
-        )
-
-    return sorted(result, key=itemgetter("full_name"))
-
-
-def _get_epics_owners(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-        WITH counters AS (
-                SELECT "epics_epic"."owner_id" owner_id,
-                       count(coalesce("epics_epic"."owner_id", -1)) count
-                  FROM "epics_epic"
-            INNER JOIN "projects_project" ON ("epics_epic"."project_id" = "projects_project"."id")
-                 WHERE {where}
-              GROUP BY "epics_epic"."owner_id"
-        )
-
-                 SELECT "projects_membership"."user_id" id,
-                        "users_user"."full_name",
-                        "users_user"."username",
-                        COALESCE("counters".count, 0) count
-                   FROM projects_membership
-        LEFT OUTER JOIN counters ON ("projects_membership"."user_id" = "counters"."owner_id")
-             INNER JOIN "users_user" ON ("projects_membership"."user_id" = "users_user"."id")
-                  WHERE "projects_membership"."project_id" = %s
-                    AND "projects_membership"."user_id" IS NOT NULL
-
-        -- System users
-        UNION
-
-                 SELECT "users_user"."id" user_id,
-                        "users_user"."full_name" full_name,
-                        "users_user"."username" username,
-                        COALESCE("counters".count, 0) count
-                   FROM users_user
-        LEFT OUTER JOIN counters ON ("users_user"."id" = "counters"."owner_id")
-                  WHERE ("users_user"."is_system" IS TRUE)
-    """.format(
-        where=where
-    )
-
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id])
-        rows = cursor.fetchall()
-
-    result = []
-    for id, full_name, username, count in rows:
-        if count > 0:
-            result.append(
-                {
-                    "id": id,
-                    "full_name": full_name or username or "",
-                    "count": count,
-                }
-            )
-    return sorted(result, key=itemgetter("full_name"))
-
-
-def _get_epics_tags(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-        WITH epics_tags AS (
-                    SELECT tag,
-                           COUNT(tag) counter FROM (
-                                SELECT UNNEST(epics_epic.tags) tag
-                                  FROM epics_epic
-                            INNER JOIN projects_project
-                                        ON (epics_epic.project_id = projects_project.id)
-                                 WHERE {where}) tags
-                  GROUP BY tag),
-             project_tags AS (
-                    SELECT reduce_dim(tags_colors) tag_color
-                      FROM projects_project
-                     WHERE id=%s)
-
-      SELECT tag_color[1] tag,
-             tag_color[2] color,
-             COALESCE(epics_tags.counter, 0) counter
-        FROM project_tags
-   LEFT JOIN epics_tags ON project_tags.tag_color[1] = epics_tags.tag
-    ORDER BY tag
-    """.format(
-        where=where
-    )
-
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id])
-        rows = cursor.fetchall()
-
-    result = []
-    for name, color, count in rows:
-        result.append(
-            {
-                "name": name,
-                "color": color,
-                "count": count,
-            }
-        )
-    return sorted(result, key=itemgetter("name"))
-
-
 def get_epics_filters_data(project, querysets):
     """
     Given a project and an epics queryset, return a simple data structure
     of all possible filters for the epics in the queryset.
     """
+    counts = get_facets_counts(
+        project,
+        querysets,
+        table="epics_epic",
+        joins=[
+            """INNER JOIN "projects_project"
+                       ON ("epics_epic"."project_id" = "projects_project"."id")""",
+        ],
+        columns={
+            "status_id": '"epics_epic"."status_id"',
+            "assigned_to_id": '"epics_epic"."assigned_to_id"',
+            "owner_id": '"epics_epic"."owner_id"',
+            "tags": '"epics_epic"."tags"',
+        },
+        facets={
+            "statuses": Facet("status_id"),
+            "assigned_to": Facet("assigned_to_id"),
+            "owners": Facet("owner_id"),
+            "tags": Facet("tags", many=True, type=str),
+        }
+    )
+
     data = OrderedDict(
         [
-            ("statuses", _get_epics_statuses(project, querysets["statuses"])),
-            ("assigned_to", _get_epics_assigned_to(project, querysets["assigned_to"])),
-            ("owners", _get_epics_owners(project, querysets["owners"])),
-            ("tags", _get_epics_tags(project, querysets["tags"])),
+            ("statuses", get_choices_filter_data(project.epic_statuses.all(), counts["statuses"])),
+            ("assigned_to", get_users_filter_data(get_project_users(project), counts["assigned_to"],
+                                                  include_unassigned=True)),
+            ("owners", get_users_filter_data(get_project_users(project, include_system_users=True),
+                                             counts["owners"], only_used=True)),
+            ("tags", get_tags_filter_data(project, counts["tags"])),
         ]
     )
 
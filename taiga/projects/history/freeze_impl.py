@@ -5,12 +5,12 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
+from collections import defaultdict
 from contextlib import suppress
 
 from functools import partial
 from django.apps import apps
 from django.contrib.auth import get_user_model
-from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 
 from taiga.base.utils.iterators import as_tuple
@@ -27,21 +27,17 @@ import os
 
 
 @as_dict
-def _get_generic_values(ids: tuple, *, typename=None, attr: str="name") -> tuple:
-    app_label, model_name = typename.split(".", 1)
-    content_type = ContentType.objects.get(app_label=app_label, model=model_name)
-    model_cls = content_type.model_class()
+def _load_generic_values(ids: tuple, *, typename=None, attr: str="name") -> tuple:
+    model_cls = apps.get_model(typename)
 
-    ids = filter(lambda x: x is not None, ids)
     qs = model_cls.objects.filter(pk__in=ids)
     for instance in qs:
         yield str(instance.pk), getattr(instance, attr)
 
 
 @as_dict
-def _get_users_values(ids: set) -> dict:
+def _load_users_values(ids: set) -> dict:
     user_model = get_user_model()
-    ids = filter(lambda x: x is not None, ids)
     qs = user_model.objects.filter(pk__in=tuple(ids))
 
     for user in qs:
@@ -49,29 +45,83 @@ def _get_users_values(ids: set) -> dict:
 
 
 @as_dict
-def _get_user_story_values(ids: set) -> dict:
+def _load_user_story_values(ids: set) -> dict:
     userstory_model = apps.get_model("userstories", "UserStory")
-    ids = filter(lambda x: x is not None, ids)
     qs = userstory_model.objects.filter(pk__in=tuple(ids))
 
     for userstory in qs:
         yield str(userstory.pk), "#{} {}".format(userstory.ref, userstory.subject)
 
 
-_get_us_status_values = partial(_get_generic_values, typename="projects.userstorystatus")
-_get_swimlane_values = partial(_get_generic_values, typename="projects.swimlane")
-_get_task_status_values = partial(_get_generic_values, typename="projects.taskstatus")
-_get_epic_status_values = partial(_get_generic_values, typename="projects.epicstatus")
-_get_issue_status_values = partial(_get_generic_values, typename="projects.issuestatus")
-_get_issue_type_values = partial(_get_generic_values, typename="projects.issuetype")
-_get_role_values = partial(_get_generic_values, typename="users.role")
-_get_points_values = partial(_get_generic_values, typename="projects.points")
-_get_priority_values = partial(_get_generic_values, typename="projects.priority")
-_get_severity_values = partial(_get_generic_values, typename="projects.severity")
-_get_milestone_values = partial(_get_generic_values, typename="milestones.milestone")
+_values_loaders = {
+    "users.user": _load_users_values,
+    "userstories.userstory": _load_user_story_values,
+}
 
 
-def _common_users_values(diff):
+class ValuesResolver(object):
+    """
+    Resolve the values (names) of the ids used in the diffs of some
+    history entries with one query per model.
+
+    The values implementations are called twice with the resolver: first
+    while it's collecting, just to record the ids they need (they get
+    empty dicts), and then, after `resolve()`, to build the values. The
+    loaded values are kept, so a resolver can be reused for several
+    groups of diffs and the catalogs of a project (statuses, points,
+    roles...) are only loaded once.
+    """
+
+    def __init__(self):
+        self.collecting = True
+        self._pending = defaultdict(set)
+        self._values = defaultdict(dict)
+
+    def collect(self):
+        self.collecting = True
+
+    def get_values(self, typename: str, ids) -> dict:
+        ids = {str(id) for id in ids if id is not None}
+
+        if self.collecting:
+            self._pending[typename].update(ids - self._values[typename].keys())
+            return {}
+
+        values = self._values[typename]
+        return {id: values[id] for id in ids if id in values}
+
+    def resolve(self):
+        for typename, ids in self._pending.items():
+            if not ids:
+                continue
+
+            loader = _values_loaders.get(typename, partial(_load_generic_values, typename=typename))
+            self._values[typename].update(loader(ids))
+
+        self._pending.clear()
+        self.collecting = False
+
+
+def _get_values(resolver: ValuesResolver, ids, *, typename: str) -> dict:
+    return resolver.get_values(typename, ids)
+
+
+_get_users_values = partial(_get_values, typename="users.user")
+_get_user_story_values = partial(_get_values, typename="userstories.userstory")
+_get_us_status_values = partial(_get_values, typename="projects.userstorystatus")
+_get_swimlane_values = partial(_get_values, typename="projects.swimlane")
+_get_task_status_values = partial(_get_values, typename="projects.taskstatus")
+_get_epic_status_values = partial(_get_values, typename="projects.epicstatus")
+_get_issue_status_values = partial(_get_values, typename="projects.issuestatus")
+_get_issue_type_values = partial(_get_values, typename="projects.issuetype")
+_get_role_values = partial(_get_values, typename="users.role")
+_get_points_values = partial(_get_values, typename="projects.points")
+_get_priority_values = partial(_get_values, typename="projects.priority")
+_get_severity_values = partial(_get_values, typename="projects.severity")
+_get_milestone_values = partial(_get_values, typename="milestones.milestone")
+
+
+def _common_users_values(diff, resolver):
     """
     Groups common values resolver logic of userstories,
     issues and tasks.
@@ -88,44 +138,44 @@ def _common_users_values(diff):
          usrs_ids]
 
     user_ids = [user_id for user_id in users if isinstance(user_id, int)]
-    values["users"] = _get_users_values(set(user_ids)) if users else {}
+    values["users"] = _get_users_values(resolver, set(user_ids)) if users else {}
 
     return values
 
 
-def project_values(diff):
-    values = _common_users_values(diff)
+def project_values(diff, resolver):
+    values = _common_users_values(diff, resolver)
     return values
 
 
-def milestone_values(diff):
-    values = _common_users_values(diff)
+def milestone_values(diff, resolver):
+    values = _common_users_values(diff, resolver)
     return values
 
 
-def epic_values(diff):
-    values = _common_users_values(diff)
+def epic_values(diff, resolver):
+    values = _common_users_values(diff, resolver)
 
     if "status" in diff:
-        values["status"] = _get_epic_status_values(diff["status"])
+        values["status"] = _get_epic_status_values(resolver, diff["status"])
 
     return values
 
 
-def epic_related_userstory_values(diff):
-    values = _common_users_values(diff)
+def epic_related_userstory_values(diff, resolver):
+    values = _common_users_values(diff, resolver)
     return values
 
 
-def userstory_values(diff):
-    values = _common_users_values(diff)
+def userstory_values(diff, resolver):
+    values = _common_users_values(diff, resolver)
 
     if "status" in diff:
-        values["status"] = _get_us_status_values(diff["status"])
+        values["status"] = _get_us_status_values(resolver, diff["status"])
     if "swimlane" in diff:
-        values["swimlane"] = _get_swimlane_values(diff["swimlane"])
+        values["swimlane"] = _get_swimlane_values(resolver, diff["swimlane"])
     if "milestone" in diff:
-        values["milestone"] = _get_milestone_values(diff["milestone"])
+        values["milestone"] = _get_milestone_values(resolver, diff["milestone"])
     if "points" in diff:
         points, roles = set(), set()
 
@@ -137,44 +187,44 @@ def userstory_values(diff):
                 points.add(point_id)
                 roles.add(role_id)
 
-        values["roles"] = _get_role_values(roles)
-        values["points"] = _get_points_values(points)
+        values["roles"] = _get_role_values(resolver, roles)
+        values["points"] = _get_points_values(resolver, points)
 
     return values
 
 
-def issue_values(diff):
-    values = _common_users_values(diff)
+def issue_values(diff, resolver):
+    values = _common_users_values(diff, resolver)
 
     if "status" in diff:
-        values["status"] = _get_issue_status_values(diff["status"])
+        values["status"] = _get_issue_status_values(resolver, diff["status"])
     if "milestone" in diff:
-        values["milestone"] = _get_milestone_values(diff["milestone"])
+        values["milestone"] = _get_milestone_values(resolver, diff["milestone"])
     if "priority" in diff:
-        values["priority"] = _get_priority_values(diff["priority"])
+        values["priority"] = _get_priority_values(resolver, diff["priority"])
     if "severity" in diff:
-        values["severity"] = _get_severity_values(diff["severity"])
+        values["severity"] = _get_severity_values(resolver, diff["severity"])
     if "type" in diff:
-        values["type"] = _get_issue_type_values(diff["type"])
+        values["type"] = _get_issue_type_values(resolver, diff["type"])
 
     return values
 
 
-def task_values(diff):
-    values = _common_users_values(diff)
+def task_values(diff, resolver):
+    values = _common_users_values(diff, resolver)
 
     if "status" in diff:
-        values["status"] = _get_task_status_values(diff["status"])
+        values["status"] = _get_task_status_values(resolver, diff["status"])
     if "milestone" in diff:
-        values["milestone"] = _get_milestone_values(diff["milestone"])
+        values["milestone"] = _get_milestone_values(resolver, diff["milestone"])
     if "user_story" in diff:
-        values["user_story"] = _get_user_story_values(diff["user_story"])
+        values["user_story"] = _get_user_story_values(resolver, diff["user_story"])
 
     return values
 
 
-def wikipage_values(diff):
-    values = _common_users_values(diff)
+def wikipage_values(diff, resolver):
+    values = _common_users_values(diff, resolver)
     return values
 
 
@@ -325,11 +375,8 @@ def epic_related_userstory_freezer(related_us) -> dict:
 
 
 def userstory_freezer(us) -> dict:
-    rp_cls = apps.get_model("userstories", "RolePoints")
-    rpqsd = rp_cls.objects.filter(user_story=us)
-
     points = {}
-    for rp in rpqsd:
+    for rp in us.role_points.all():
         points[str(rp.role_id)] = rp.points_id
 
     assigned_users = [u.id for u in us.assigned_users.all()]
@@ -373,7 +420,7 @@ def userstory_freezer(us) -> dict:
 
 
 def issue_freezer(issue) -> dict:
-    promoted_to = list(issue.generated_user_stories.values_list("id", flat=True))
+    promoted_to = [us.id for us in issue.generated_user_stories.all()]
 
     snapshot = {
         "ref": issue.ref,
@@ -401,7 +448,7 @@ def issue_freezer(issue) -> dict:
 
 
 def task_freezer(task) -> dict:
-    promoted_to = list(task.generated_user_stories.values_list("id", flat=True))
+    promoted_to = [us.id for us in task.generated_user_stories.all()]
 
     snapshot = {
         "ref": task.ref,
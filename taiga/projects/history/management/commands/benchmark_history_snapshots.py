@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2021-present Kaleidos INC
+
+# Examples:
+# python manage.py benchmark_history_snapshots 42
+# python manage.py benchmark_history_snapshots 42 --history 500 --edits 100
+#
+# All the changes are rolled back at the end.
+
+import itertools
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from taiga.projects.history import services
+from taiga.projects.userstories.models import UserStory
+
+
+class Command(BaseCommand):
+    help = "Compare the latency of take_snapshot with and without the snapshot cache for a user story with a long history"
+
+    def add_arguments(self, parser):
+        parser.add_argument("userstory_id", type=int,
+                            help="Id of the user story used for the benchmark")
+        parser.add_argument("--history", type=int, default=200,
+                            help="Number of history entries created before measuring")
+        parser.add_argument("--edits", type=int, default=50,
+                            help="Number of measured edits")
+
+    def _edit(self, us, counter):
+        us.subject = "benchmark {}".format(counter)
+        us.save()
+        start = time.perf_counter()
+        services.take_snapshot(us, user=us.owner)
+        return (time.perf_counter() - start) * 1000
+
+    def _report(self, title, timings):
+        timings = sorted(timings)
+        self.stdout.write("{}: mean {:.2f} ms, median {:.2f} ms, p95 {:.2f} ms".format(
+            title,
+            statistics.mean(timings),
+            statistics.median(timings),
+            timings[int(len(timings) * 0.95) - 1]))
+
+    @override_settings(DEBUG=False)
+    def handle(self, *args, **options):
+        try:
+            us = UserStory.objects.get(id=options["userstory_id"])
+        except UserStory.DoesNotExist:
+            raise CommandError("There is no user story with the id '{}'".format(options["userstory_id"]))
+
+        counter = itertools.count()
+        with transaction.atomic():
+            with override_settings(HISTORY_SNAPSHOT_CACHE_ENABLE=False):
+                for i in range(options["history"]):
+                    self._edit(us, next(counter))
+
+                without_cache = [self._edit(us, next(counter)) for i in range(options["edits"])]
+
+            with override_settings(HISTORY_SNAPSHOT_CACHE_ENABLE=True):
+                # Warm up the cache
+                self._edit(us, next(counter))
+                with_cache = [self._edit(us, next(counter)) for i in range(options["edits"])]
+
+            transaction.set_rollback(True)
+
+        self._report("Without cache", without_cache)
+        self._report("With cache", with_cache)
@@ -18,16 +18,26 @@ This is possible example:
           # Do something...
           history.persist_history(object, user=request.user)
 """
+import inspect
+import json
 import logging
 from collections import namedtuple
 from copy import deepcopy
+from contextlib import ExitStack
 from functools import partial
 from functools import wraps
+from itertools import groupby
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.apps import apps
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import transaction as tx
+from django.db.models import OuterRef
+from django.db.models import Subquery
+from django.db.models import prefetch_related_objects
+from django.db.models import signals
 from django_pglocks import advisory_lock
 
 from taiga.mdrender.service import render as mdrender
@@ -56,6 +66,8 @@ from .freeze_impl import issue_values
 from .freeze_impl import task_values
 from .freeze_impl import wikipage_values
 
+from .freeze_impl import ValuesResolver
+
 # Type that represents a freezed object
 FrozenObj = namedtuple("FrozenObj", ["key", "snapshot"])
 FrozenDiff = namedtuple("FrozenDiff", ["key", "diff", "snapshot"])
@@ -75,12 +87,29 @@ _not_important_fields = {
     "tasks.task": frozenset(["us_order", "taskboard_order"]),
 }
 
+# Relations used by the freeze implementations, prefetched when
+# the snapshots of several objects are taken at once.
+_freeze_prefetches = {
+    "epics.epic": ("project__epiccustomattributes", "status", "attachments",
+                   "custom_attributes_values"),
+    "userstories.userstory": ("project__userstorycustomattributes", "status", "swimlane",
+                              "attachments", "assigned_users", "role_points",
+                              "custom_attributes_values"),
+    "tasks.task": ("project__taskcustomattributes", "status", "attachments",
+                   "generated_user_stories", "custom_attributes_values"),
+    "issues.issue": ("project__issuecustomattributes", "status", "attachments",
+                     "generated_user_stories", "custom_attributes_values"),
+}
+
 _deprecated_fields = {
     "userstories.userstory": frozenset(["assigned_to"]),
 }
 
 log = logging.getLogger("taiga.history")
 
+# Version of the format of the snapshots stored in the cache
+SNAPSHOT_CACHE_VERSION = 1
+
 
 def make_key_from_model_object(obj: object) -> str:
     """
@@ -124,6 +153,10 @@ def register_values_implementation(typename: str, fn=None):
     """
     Register values implementation for specified typename.
     This function can be used as decorator.
+
+    The implementations are called with the diff and a `ValuesResolver`.
+    Implementations that only accept the diff are still supported: they
+    are called once, with the diff, and resolve their own values.
     """
 
     assert isinstance(typename, str), "typename must be specied"
@@ -131,10 +164,22 @@ def register_values_implementation(typename: str, fn=None):
     if fn is None:
         return partial(register_values_implementation, typename)
 
-    @wraps(fn)
-    def _wrapper(*args, **kwargs):
-        return fn(*args, **kwargs)
-
+    try:
+        inspect.signature(fn).bind(None, None)
+        takes_resolver = True
+    except TypeError:
+        takes_resolver = False
+
+    if takes_resolver:
+        @wraps(fn)
+        def _wrapper(*args, **kwargs):
+            return fn(*args, **kwargs)
+    else:
+        @wraps(fn)
+        def _wrapper(diff, resolver=None):
+            return fn(diff)
+
+    _wrapper.takes_resolver = takes_resolver
     _values_impl_map[typename] = _wrapper
     return _wrapper
 
@@ -289,20 +334,42 @@ def _make_diff_in_attachments(first_snapshot, second_snapshot):
     return None
 
 
-def make_diff_values(typename: str, fdiff: FrozenDiff) -> dict:
+def make_diffs_values(diffs, resolver: ValuesResolver=None) -> list:
+    """
+    Given a list of `(typename, diff)`, build a values dict for each one,
+    resolving the ids used by all of them with one query per model.
+    If no implementation found for a typename, warnig is raised in
+    logging and its values are an empty dict.
+    """
+    if resolver is None:
+        resolver = ValuesResolver()
+
+    impl_fns = []
+    for typename, fdiff in diffs:
+        impl_fn = _values_impl_map.get(typename, None)
+        if impl_fn is None:
+            log.warning(
+                "No implementation found of '{}' for values.".format(typename))
+        impl_fns.append(impl_fn)
+
+    # Collect the ids used by the diffs and load their values
+    resolver.collect()
+    for impl_fn, (typename, fdiff) in zip(impl_fns, diffs):
+        if impl_fn is not None and impl_fn.takes_resolver:
+            impl_fn(fdiff.diff, resolver)
+    resolver.resolve()
+
+    return [impl_fn(fdiff.diff, resolver) if impl_fn is not None else {}
+            for impl_fn, (typename, fdiff) in zip(impl_fns, diffs)]
+
+
+def make_diff_values(typename: str, fdiff: FrozenDiff, resolver: ValuesResolver=None) -> dict:
     """
     Given a typename and diff, build a values dict for it.
     If no implementation found for typename, warnig is raised in
     logging and returns empty dict.
     """
-
-    if typename not in _values_impl_map:
-        log.warning(
-            "No implementation found of '{}' for values.".format(typename))
-        return {}
-
-    impl_fn = _values_impl_map[typename]
-    return impl_fn(fdiff.diff)
+    return make_diffs_values([(typename, fdiff)], resolver=resolver)[0]
 
 
 def _rebuild_snapshot_from_diffs(keysnapshot, partials):
@@ -315,31 +382,104 @@ def _rebuild_snapshot_from_diffs(keysnapshot, partials):
     return result
 
 
-def get_last_snapshot_for_key(key: str) -> FrozenObj:
+def _get_snapshot_cache_key(key: str) -> str:
+    return "history-snapshot:{}".format(key)
+
+
+def _set_cached_snapshot(key: str, last_entry_id: str, snapshot: dict, partials: int):
+    if not settings.HISTORY_SNAPSHOT_CACHE_ENABLE:
+        return
+
+    cached = {"entry_id": last_entry_id, "snapshot": snapshot, "partials": partials}
+    cache.set(_get_snapshot_cache_key(key), cached,
+              timeout=settings.HISTORY_SNAPSHOT_CACHE_TIMEOUT,
+              version=SNAPSHOT_CACHE_VERSION)
+
+
+def _to_stored_snapshot(snapshot: dict) -> dict:
+    # The same values that the JSON fields of the history entries return
+    return json.loads(json.dumps(snapshot, cls=DjangoJSONEncoder))
+
+
+def _get_last_snapshots_for_keys(keys) -> dict:
+    """
+    Rebuild the last snapshot of some keys. Return a dict with the
+    snapshot of every key and the number of partial diffs applied to its
+    last full snapshot.
+    """
     entry_model = apps.get_model("history", "HistoryEntry")
 
-    # Search last snapshot
-    qs = (entry_model.objects
-          .filter(key=key, is_snapshot=True)
-          .order_by("-created_at"))
+    keys = set(keys)
+    result = {key: (None, 0) for key in keys}
+    pending_keys = keys
+    last_entry_ids = {}
+
+    if settings.HISTORY_SNAPSHOT_CACHE_ENABLE:
+        last_entry_ids = dict(entry_model.objects
+                              .filter(key__in=keys)
+                              .order_by("key", "-created_at")
+                              .distinct("key")
+                              .values_list("key", "id"))
+
+        cache_keys = {_get_snapshot_cache_key(key): key for key in last_entry_ids}
+        cached_snapshots = cache.get_many(cache_keys.keys(), version=SNAPSHOT_CACHE_VERSION)
+
+        pending_keys = set(last_entry_ids.keys())
+        for cache_key, cached in cached_snapshots.items():
+            key = cache_keys[cache_key]
+            if cached["entry_id"] == last_entry_ids[key]:
+                result[key] = (FrozenObj(key, cached["snapshot"]), cached["partials"])
+                pending_keys.discard(key)
+
+    if not pending_keys:
+        return result
+
+    # Search last snapshots and all the partial snapshots after them
+    last_snapshot_dates = (entry_model.objects
+                           .filter(key=OuterRef("key"), is_snapshot=True)
+                           .order_by("-created_at")
+                           .values("created_at")[:1])
+    entries = (entry_model.objects
+               .filter(key__in=pending_keys)
+               .filter(created_at__gte=Subquery(last_snapshot_dates))
+               .order_by("key", "created_at"))
+
+    for key, key_entries in groupby(entries, key=lambda entry: entry.key):
+        keysnapshot = None
+        partials = []
+        for entry in key_entries:
+            if entry.is_snapshot:
+                keysnapshot = entry
+            else:
+                partials.append(entry)
+
+        snapshot = _rebuild_snapshot_from_diffs(keysnapshot.snapshot, partials)
+        _set_cached_snapshot(key, last_entry_ids.get(key, None), snapshot, len(partials))
+
+        result[key] = (FrozenObj(key, snapshot), len(partials))
+
+    return result
 
-    keysnapshot = qs.first()
-    if keysnapshot is None:
-        return None, True
 
-    # Get all partial snapshots
-    entries = tuple(entry_model.objects
-                    .filter(key=key, is_snapshot=False)
-                    .filter(created_at__gte=keysnapshot.created_at)
-                    .order_by("created_at"))
+def _get_last_snapshot_for_key(key: str):
+    return _get_last_snapshots_for_keys([key])[key]
 
-    snapshot = _rebuild_snapshot_from_diffs(keysnapshot.snapshot, entries)
-    max_partial_diffs = getattr(settings, "MAX_PARTIAL_DIFFS", 60)
 
-    if len(entries) >= max_partial_diffs:
-        return FrozenObj(keysnapshot.key, snapshot), True
+def get_last_snapshot_for_key(key: str) -> FrozenObj:
+    """
+    Get the last snapshot of a key and if the next history entry should
+    store a full snapshot.
+
+    The rebuilt snapshots are cached (tagged with the id of the last entry
+    of the key) so consecutive snapshots of an object don't need to apply
+    all its partial diffs again.
+    """
+    fobj, partials = _get_last_snapshot_for_key(key)
+    if fobj is None:
+        return None, True
 
-    return FrozenObj(keysnapshot.key, snapshot), False
+    max_partial_diffs = getattr(settings, "MAX_PARTIAL_DIFFS", 60)
+    return fobj, partials >= max_partial_diffs
 
 
 # Public api
@@ -364,6 +504,92 @@ def get_modified_fields(obj: object, last_modifications):
     return modified_fields
 
 
+def _make_history_entry(obj: object, key: str, last_snapshot: tuple, *, comment: str="",
+                        user=None, delete: bool=False, comment_html: str=None):
+    """
+    Build (without saving it) the history entry of an object given its
+    last snapshot, as returned by `_get_last_snapshots_for_keys`. The
+    values of the entry are left to the caller (see `make_diffs_values`).
+
+    Return the entry and its diff, or `(None, None)` if there is
+    nothing to store.
+    """
+    typename = get_typename_for_model_class(obj.__class__)
+
+    new_fobj = freeze_model_instance(obj)
+    old_fobj, partials = last_snapshot
+    need_real_snapshot = (old_fobj is None or
+                          partials >= getattr(settings, "MAX_PARTIAL_DIFFS", 60))
+
+    # migrate diff to latest schema
+    if old_fobj:
+        old_fobj = migrate_to_last_version(typename, old_fobj)
+
+    entry_model = apps.get_model("history", "HistoryEntry")
+    user_id = None if user is None else user.id
+    user_name = "" if user is None else user.get_full_name()
+
+    # Determine history type
+    if delete:
+        entry_type = HistoryType.delete
+        need_real_snapshot = True
+    elif new_fobj and not old_fobj:
+        entry_type = HistoryType.create
+    elif new_fobj and old_fobj:
+        entry_type = HistoryType.change
+    else:
+        raise RuntimeError("Unexpected condition")
+
+    excluded_fields = get_excluded_fields(typename)
+
+    fdiff = make_diff(old_fobj, new_fobj, excluded_fields)
+
+    # If diff and comment are empty, do
+    # not create empty history entry
+    if (not fdiff.diff and
+            not comment and old_fobj is not None and
+            entry_type != HistoryType.delete):
+        return None, None
+
+    if len(comment) > 0:
+        is_hidden = False
+    else:
+        is_hidden = is_hidden_snapshot(fdiff)
+
+    if comment_html is None:
+        comment_html = mdrender(obj.project, comment)
+
+    entry = entry_model(
+        user={"pk": user_id, "name": user_name},
+        project_id=getattr(obj, 'project_id', getattr(obj, 'id', None)),
+        key=key,
+        type=entry_type,
+        snapshot=fdiff.snapshot if need_real_snapshot else None,
+        diff=fdiff.diff,
+        comment=comment,
+        comment_html=comment_html,
+        is_hidden=is_hidden,
+        is_snapshot=need_real_snapshot,
+    )
+    return entry, fdiff
+
+
+def _update_cached_snapshot(entry: object, last_snapshot: tuple, fdiff: FrozenDiff):
+    """
+    Keep the cached snapshot of a key in sync with its new entry, so
+    the next snapshot of the object only needs to apply this diff.
+    """
+    if not settings.HISTORY_SNAPSHOT_CACHE_ENABLE:
+        return
+
+    if entry.is_snapshot:
+        _set_cached_snapshot(entry.key, entry.id, _to_stored_snapshot(fdiff.snapshot), 0)
+    else:
+        old_fobj, partials = last_snapshot
+        snapshot = _rebuild_snapshot_from_diffs(old_fobj.snapshot, [fdiff])
+        _set_cached_snapshot(entry.key, entry.id, _to_stored_snapshot(snapshot), partials + 1)
+
+
 @tx.atomic
 def take_snapshot(obj: object, *, comment: str="", user=None,
                   delete: bool=False):
@@ -377,63 +603,94 @@ def take_snapshot(obj: object, *, comment: str="", user=None,
 
     key = make_key_from_model_object(obj)
     with advisory_lock("history-"+key):
+        last_snapshot = _get_last_snapshot_for_key(key)
+        entry, fdiff = _make_history_entry(obj, key, last_snapshot, comment=comment,
+                                           user=user, delete=delete)
+        if entry is None:
+            return None
+
+        entry.values = make_diff_values(get_typename_for_model_class(obj.__class__), fdiff)
+        # Before saving it, because the post_save signal handlers can
+        # modify the diff of the entry (values_diff)
+        _update_cached_snapshot(entry, last_snapshot, fdiff)
+        entry.save(force_insert=True)
+
+        return entry
+
+
+@tx.atomic
+def take_snapshots_in_bulk(objs, *, comment: str="", user=None):
+    """
+    Same as `take_snapshot` for a list of objects, but sharing the work
+    between all of them: the relations used to freeze them are prefetched
+    at once, the comment is rendered once per project, and the objects are
+    locked, their last snapshots fetched and their history entries inserted
+    in chunks of `HISTORY_BULK_SNAPSHOTS_CHUNK_SIZE` objects.
+
+    Return the list of created history entries.
+    """
+    # Only the last version of every object
+    objs = list({make_key_from_model_object(obj): obj for obj in objs}.items())
+    if not objs:
+        return []
+
+    objs_by_typename = {}
+    for key, obj in objs:
         typename = get_typename_for_model_class(obj.__class__)
+        objs_by_typename.setdefault(typename, []).append(obj)
 
-        new_fobj = freeze_model_instance(obj)
-        old_fobj, need_real_snapshot = get_last_snapshot_for_key(key)
-
-        # migrate diff to latest schema
-        if old_fobj:
-            old_fobj = migrate_to_last_version(typename, old_fobj)
-
-        entry_model = apps.get_model("history", "HistoryEntry")
-        user_id = None if user is None else user.id
-        user_name = "" if user is None else user.get_full_name()
-
-        # Determine history type
-        if delete:
-            entry_type = HistoryType.delete
-            need_real_snapshot = True
-        elif new_fobj and not old_fobj:
-            entry_type = HistoryType.create
-        elif new_fobj and old_fobj:
-            entry_type = HistoryType.change
-        else:
-            raise RuntimeError("Unexpected condition")
-
-        excluded_fields = get_excluded_fields(typename)
-
-        fdiff = make_diff(old_fobj, new_fobj, excluded_fields)
-
-        # If diff and comment are empty, do
-        # not create empty history entry
-        if (not fdiff.diff and
-                not comment and old_fobj is not None and
-                entry_type != HistoryType.delete):
-            return None
+    for typename, typename_objs in objs_by_typename.items():
+        prefetch_related_objects(typename_objs, *_freeze_prefetches.get(typename, ()))
+
+    comments_html = {}
+    entry_model = apps.get_model("history", "HistoryEntry")
+    entries = []
+
+    # Sorted to avoid deadlocks with other bulk snapshots, and in chunks to
+    # not hold too many locks at once
+    sorted_objs = sorted(objs, key=lambda item: item[0])
+    chunk_size = settings.HISTORY_BULK_SNAPSHOTS_CHUNK_SIZE
+    for chunk_start in range(0, len(sorted_objs), chunk_size):
+        chunk = sorted_objs[chunk_start:chunk_start + chunk_size]
+        chunk_entries = []
+
+        with ExitStack() as locks:
+            for key, obj in chunk:
+                locks.enter_context(advisory_lock("history-"+key))
+
+            last_snapshots = _get_last_snapshots_for_keys(key for key, obj in chunk)
+
+            for key, obj in chunk:
+                project_id = getattr(obj, "project_id", None)
+                if project_id not in comments_html:
+                    comments_html[project_id] = mdrender(obj.project, comment)
+
+                entry, fdiff = _make_history_entry(obj, key, last_snapshots[key], comment=comment,
+                                                   user=user, comment_html=comments_html[project_id])
+                if entry is not None:
+                    chunk_entries.append((entry, fdiff))
+
+            values = make_diffs_values([(entry.key.split(":", 1)[0], fdiff) for entry, fdiff in chunk_entries])
+            for (entry, fdiff), entry_values in zip(chunk_entries, values):
+                entry.values = entry_values
+
+            entry_model.objects.bulk_create([entry for entry, fdiff in chunk_entries])
+
+            for entry, fdiff in chunk_entries:
+                _update_cached_snapshot(entry, last_snapshots[entry.key], fdiff)
+
+        entries.extend(chunk_entries)
+
+    # In the order of the objects
+    positions = {key: position for position, (key, obj) in enumerate(objs)}
+    entries.sort(key=lambda item: positions[item[0].key])
+
+    # bulk_create doesn't send the post_save signals (timeline, webhooks...)
+    for entry, fdiff in entries:
+        signals.post_save.send(sender=entry_model, instance=entry, created=True,
+                               update_fields=None, raw=False, using=entry._state.db)
 
-        fvals = make_diff_values(typename, fdiff)
-
-        if len(comment) > 0:
-            is_hidden = False
-        else:
-            is_hidden = is_hidden_snapshot(fdiff)
-
-        kwargs = {
-            "user": {"pk": user_id, "name": user_name},
-            "project_id": getattr(obj, 'project_id', getattr(obj, 'id', None)),
-            "key": key,
-            "type": entry_type,
-            "snapshot": fdiff.snapshot if need_real_snapshot else None,
-            "diff": fdiff.diff,
-            "values": fvals,
-            "comment": comment,
-            "comment_html": mdrender(obj.project, comment),
-            "is_hidden": is_hidden,
-            "is_snapshot": need_real_snapshot,
-        }
-
-        return entry_model.objects.create(**kwargs)
+    return [entry for entry, fdiff in entries]
 
 
 # High level query api
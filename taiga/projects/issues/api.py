@@ -7,7 +7,6 @@
 
 #
 from django.utils.translation import gettext as _
-from django.http import HttpResponse
 
 from taiga.base import filters
 from taiga.base import exceptions as exc
@@ -26,6 +25,7 @@ from taiga.projects.notifications.mixins import AssignedToSignalMixin
 from taiga.projects.notifications.mixins import WatchedResourceMixin
 from taiga.projects.notifications.mixins import WatchersViewSetMixin
 from taiga.projects.occ import OCCResourceMixin
+from taiga.projects.services import csv_exports
 from taiga.projects.tagging.api import TaggedResourceMixin
 from taiga.projects.votes.mixins.viewsets import VotedResourceMixin, VotersViewSetMixin
 
@@ -214,11 +214,7 @@ class IssueViewSet(AssignedToSignalMixin, OCCResourceMixin, VotedResourceMixin,
             return response.NotFound()
 
         project = get_object_or_error(Project, request.user, issues_csv_uuid=uuid)
-        queryset = project.issues.all().order_by('ref')
-        data = services.issues_to_csv(project, queryset)
-        csv_response = HttpResponse(data.getvalue(), content_type='application/csv; charset=utf-8')
-        csv_response['Content-Disposition'] = 'attachment; filename="issues.csv"'
-        return csv_response
+        return csv_exports.get_csv_response(request, project, "issues")
 
     @list_route(methods=["POST"])
     def bulk_create(self, request, **kwargs):
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2021-present Kaleidos INC
+
+from django.db import migrations
+
+
+# NOTE: This column and index are needed by taiga.searches.services. The column
+#       is generated by PostgreSQL, so it's filled for the existing rows when
+#       it's added and kept up to date on every write.
+ADD_SEARCH_VECTOR = """
+    ALTER TABLE issues_issue
+     ADD COLUMN search_vector tsvector
+      GENERATED ALWAYS AS (
+          setweight(to_tsvector('simple',
+                                coalesce(issues_issue.subject, '') || ' ' ||
+                                coalesce(issues_issue.ref::text, '')), 'A') ||
+          setweight(to_tsvector('simple', coalesce(inmutable_array_to_string(issues_issue.tags), '')), 'B') ||
+          setweight(to_tsvector('simple', coalesce(issues_issue.description, '')), 'C')
+      ) STORED;
+"""
+
+
+CREATE_INDEX = """
+    CREATE INDEX issues_issue_search_vector_idx
+              ON issues_issue
+           USING gin(search_vector);
+"""
+
+
+DROP_SEARCH_VECTOR = """
+    ALTER TABLE issues_issue DROP COLUMN IF EXISTS search_vector;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0033_text_search_indexes'),
+        ('issues', '0009_auto_20200615_0811'),
+    ]
+
+    operations = [
+        migrations.RunSQL([ADD_SEARCH_VECTOR, CREATE_INDEX],
+                          [DROP_SEARCH_VECTOR]),
+    ]
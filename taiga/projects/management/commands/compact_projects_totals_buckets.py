@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2021-present Kaleidos INC
+
+# Examples:
+# python manage.py compact_projects_totals_buckets
+#
+# Installations without celery should run it periodically (every hour, i.e. from cron).
+
+from django.core.management.base import BaseCommand
+
+from taiga.projects.services import compact_projects_totals_buckets
+
+
+class Command(BaseCommand):
+    help = "Compact the daily buckets of the projects activity and fans totals"
+
+    def handle(self, *args, **options):
+        compact_projects_totals_buckets()
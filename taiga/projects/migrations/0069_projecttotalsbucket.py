@@ -0,0 +1,200 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0068_project_archived_code'),
+        ('timeline', '0008_auto_20190606_1528'),
+        ('likes', '0002_auto_20151130_2230'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectTotalsBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('activity', models.IntegerField(default=0, verbose_name='activity')),
+                ('fans', models.IntegerField(default=0, verbose_name='fans')),
+                ('project', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='totals_buckets', to='projects.project', verbose_name='project')),
+            ],
+            options={
+                'verbose_name': 'project totals bucket',
+                'verbose_name_plural': 'project totals buckets',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='projecttotalsbucket',
+            index=models.Index(fields=['project', 'date'], name='projects_pr_project_a585fc_idx'),
+        ),
+            migrations.RunSQL(
+            """
+            CREATE OR REPLACE FUNCTION update_project_totals_buckets_activity()
+            RETURNS trigger AS $update_project_totals_buckets_activity$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    INSERT INTO projects_projecttotalsbucket (project_id, date, activity, fans)
+                         SELECT split_part(new_rows.namespace, ':', 2)::integer,
+                                (new_rows.created AT TIME ZONE 'UTC')::date,
+                                count(*),
+                                0
+                           FROM new_rows
+                          WHERE new_rows.namespace LIKE 'project:%'
+                       GROUP BY 1, 2;
+                ELSIF TG_OP = 'DELETE' THEN
+                    INSERT INTO projects_projecttotalsbucket (project_id, date, activity, fans)
+                         SELECT split_part(old_rows.namespace, ':', 2)::integer,
+                                (old_rows.created AT TIME ZONE 'UTC')::date,
+                                -count(*),
+                                0
+                           FROM old_rows
+                          WHERE old_rows.namespace LIKE 'project:%'
+                       GROUP BY 1, 2;
+                ELSE
+                    INSERT INTO projects_projecttotalsbucket (project_id, date, activity, fans)
+                         SELECT split_part(changes.namespace, ':', 2)::integer,
+                                (changes.created AT TIME ZONE 'UTC')::date,
+                                sum(changes.delta),
+                                0
+                           FROM (SELECT old_rows.namespace, old_rows.created, -1 AS delta
+                                   FROM old_rows
+                             INNER JOIN new_rows ON new_rows.id = old_rows.id
+                                  WHERE old_rows.namespace IS DISTINCT FROM new_rows.namespace
+                                     OR old_rows.created IS DISTINCT FROM new_rows.created
+                              UNION ALL
+                                 SELECT new_rows.namespace, new_rows.created, 1 AS delta
+                                   FROM old_rows
+                             INNER JOIN new_rows ON new_rows.id = old_rows.id
+                                  WHERE old_rows.namespace IS DISTINCT FROM new_rows.namespace
+                                     OR old_rows.created IS DISTINCT FROM new_rows.created) AS changes
+                          WHERE changes.namespace LIKE 'project:%'
+                       GROUP BY 1, 2;
+                END IF;
+
+                RETURN NULL;
+            END;
+            $update_project_totals_buckets_activity$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER update_project_totals_buckets_on_timeline_insert
+                AFTER INSERT ON timeline_timeline
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE PROCEDURE update_project_totals_buckets_activity();
+
+            CREATE TRIGGER update_project_totals_buckets_on_timeline_delete
+                AFTER DELETE ON timeline_timeline
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE PROCEDURE update_project_totals_buckets_activity();
+
+            CREATE TRIGGER update_project_totals_buckets_on_timeline_update
+                AFTER UPDATE ON timeline_timeline
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE PROCEDURE update_project_totals_buckets_activity();
+
+            CREATE OR REPLACE FUNCTION update_project_totals_buckets_fans()
+            RETURNS trigger AS $update_project_totals_buckets_fans$
+            DECLARE
+                project_content_type_id integer;
+            BEGIN
+                SELECT id
+                  INTO project_content_type_id
+                  FROM django_content_type
+                 WHERE app_label = 'projects' AND model = 'project';
+
+                IF TG_OP = 'INSERT' THEN
+                    INSERT INTO projects_projecttotalsbucket (project_id, date, activity, fans)
+                         SELECT new_rows.object_id,
+                                (new_rows.created_date AT TIME ZONE 'UTC')::date,
+                                0,
+                                count(*)
+                           FROM new_rows
+                          WHERE new_rows.content_type_id = project_content_type_id
+                       GROUP BY 1, 2;
+                ELSIF TG_OP = 'DELETE' THEN
+                    INSERT INTO projects_projecttotalsbucket (project_id, date, activity, fans)
+                         SELECT old_rows.object_id,
+                                (old_rows.created_date AT TIME ZONE 'UTC')::date,
+                                0,
+                                -count(*)
+                           FROM old_rows
+                          WHERE old_rows.content_type_id = project_content_type_id
+                       GROUP BY 1, 2;
+                ELSE
+                    INSERT INTO projects_projecttotalsbucket (project_id, date, activity, fans)
+                         SELECT changes.object_id,
+                                (changes.created_date AT TIME ZONE 'UTC')::date,
+                                0,
+                                sum(changes.delta)
+                           FROM (SELECT old_rows.content_type_id, old_rows.object_id, old_rows.created_date, -1 AS delta
+                                   FROM old_rows
+                             INNER JOIN new_rows ON new_rows.id = old_rows.id
+                                  WHERE old_rows.content_type_id IS DISTINCT FROM new_rows.content_type_id
+                                     OR old_rows.object_id IS DISTINCT FROM new_rows.object_id
+                                     OR old_rows.created_date IS DISTINCT FROM new_rows.created_date
+                              UNION ALL
+                                 SELECT new_rows.content_type_id, new_rows.object_id, new_rows.created_date, 1 AS delta
+                                   FROM old_rows
+                             INNER JOIN new_rows ON new_rows.id = old_rows.id
+                                  WHERE old_rows.content_type_id IS DISTINCT FROM new_rows.content_type_id
+                                     OR old_rows.object_id IS DISTINCT FROM new_rows.object_id
+                                     OR old_rows.created_date IS DISTINCT FROM new_rows.created_date) AS changes
+                          WHERE changes.content_type_id = project_content_type_id
+                       GROUP BY 1, 2;
+                END IF;
+
+                RETURN NULL;
+            END;
+            $update_project_totals_buckets_fans$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER update_project_totals_buckets_on_like_insert
+                AFTER INSERT ON likes_like
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE PROCEDURE update_project_totals_buckets_fans();
+
+            CREATE TRIGGER update_project_totals_buckets_on_like_delete
+                AFTER DELETE ON likes_like
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE PROCEDURE update_project_totals_buckets_fans();
+
+            CREATE TRIGGER update_project_totals_buckets_on_like_update
+                AFTER UPDATE ON likes_like
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE PROCEDURE update_project_totals_buckets_fans();
+
+            -- Fill the buckets with the current data
+            INSERT INTO projects_projecttotalsbucket (project_id, date, activity, fans)
+                 SELECT split_part(namespace, ':', 2)::integer,
+                        (created AT TIME ZONE 'UTC')::date,
+                        count(*),
+                        0
+                   FROM timeline_timeline
+                  WHERE namespace LIKE 'project:%'
+               GROUP BY 1, 2;
+
+            INSERT INTO projects_projecttotalsbucket (project_id, date, activity, fans)
+                 SELECT likes_like.object_id,
+                        (likes_like.created_date AT TIME ZONE 'UTC')::date,
+                        0,
+                        count(*)
+                   FROM likes_like
+             INNER JOIN django_content_type ct
+                     ON ct.id = likes_like.content_type_id
+                  WHERE ct.app_label = 'projects' AND ct.model = 'project'
+               GROUP BY 1, 2;
+            """,
+            """
+            DROP TRIGGER IF EXISTS update_project_totals_buckets_on_timeline_insert ON timeline_timeline;
+            DROP TRIGGER IF EXISTS update_project_totals_buckets_on_timeline_delete ON timeline_timeline;
+            DROP TRIGGER IF EXISTS update_project_totals_buckets_on_timeline_update ON timeline_timeline;
+            DROP FUNCTION IF EXISTS update_project_totals_buckets_activity();
+            DROP TRIGGER IF EXISTS update_project_totals_buckets_on_like_insert ON likes_like;
+            DROP TRIGGER IF EXISTS update_project_totals_buckets_on_like_delete ON likes_like;
+            DROP TRIGGER IF EXISTS update_project_totals_buckets_on_like_update ON likes_like;
+            DROP FUNCTION IF EXISTS update_project_totals_buckets_fans();
+            """
+        ),
+    ]
@@ -153,7 +153,7 @@ def update_issues_milestone_in_bulk(bulk_data: list, milestone: object):
     issue_ids = issue_milestones.keys()
 
     events.emit_event_for_ids(ids=issue_ids,
-                              content_type="issues.issues",
+                              content_type="issues.issue",
                               projectid=milestone.project.pk)
 
     issues_instance_list = []
@@ -11,6 +11,8 @@ from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models import Q
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
 from django.apps import apps
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
@@ -39,8 +41,6 @@ from taiga.projects.notifications.services import (
     set_notify_policy_level_to_ignore,
     create_notify_policy_if_not_exists)
 
-from taiga.timeline.service import build_project_namespace
-
 from . import choices
 
 from dateutil.relativedelta import relativedelta
@@ -334,38 +334,28 @@ class Project(ProjectDefaults, TaggedMixin, TagsColorsMixin, models.Model):
             super().save(*args, **kwargs)
 
     def refresh_totals(self, save=True):
+        # Totals are computed from the daily buckets of ProjectTotalsBucket,
+        # so the windows have a granularity of one day.
         now = timezone.now()
         self.totals_updated_datetime = now
 
-        Like = apps.get_model("likes", "Like")
-        content_type = apps.get_model("contenttypes", "ContentType").objects.get_for_model(Project)
-        qs = Like.objects.filter(content_type=content_type, object_id=self.id)
-
-        self.total_fans = qs.count()
-
-        qs_week = qs.filter(created_date__gte=now - relativedelta(weeks=1))
-        self.total_fans_last_week = qs_week.count()
-
-        qs_month = qs.filter(created_date__gte=now - relativedelta(months=1))
-        self.total_fans_last_month = qs_month.count()
-
-        qs_year = qs.filter(created_date__gte=now - relativedelta(years=1))
-        self.total_fans_last_year = qs_year.count()
+        last_week = (now - relativedelta(weeks=1)).date()
+        last_month = (now - relativedelta(months=1)).date()
+        last_year = (now - relativedelta(years=1)).date()
 
-        tl_model = apps.get_model("timeline", "Timeline")
-        namespace = build_project_namespace(self)
+        totals = self.totals_buckets.aggregate(
+            total_fans=Coalesce(Sum("fans"), 0),
+            total_fans_last_week=Coalesce(Sum("fans", filter=Q(date__gte=last_week)), 0),
+            total_fans_last_month=Coalesce(Sum("fans", filter=Q(date__gte=last_month)), 0),
+            total_fans_last_year=Coalesce(Sum("fans", filter=Q(date__gte=last_year)), 0),
+            total_activity=Coalesce(Sum("activity"), 0),
+            total_activity_last_week=Coalesce(Sum("activity", filter=Q(date__gte=last_week)), 0),
+            total_activity_last_month=Coalesce(Sum("activity", filter=Q(date__gte=last_month)), 0),
+            total_activity_last_year=Coalesce(Sum("activity", filter=Q(date__gte=last_year)), 0),
+        )
 
-        qs = tl_model.objects.filter(namespace=namespace)
-        self.total_activity = qs.count()
-
-        qs_week = qs.filter(created__gte=now - relativedelta(weeks=1))
-        self.total_activity_last_week = qs_week.count()
-
-        qs_month = qs.filter(created__gte=now - relativedelta(months=1))
-        self.total_activity_last_month = qs_month.count()
-
-        qs_year = qs.filter(created__gte=now - relativedelta(years=1))
-        self.total_activity_last_year = qs_year.count()
+        for attr, value in totals.items():
+            setattr(self, attr, value)
 
         if save:
             self.save(update_fields=[
@@ -517,6 +507,8 @@ class Project(ProjectDefaults, TaggedMixin, TagsColorsMixin, models.Model):
                                                 disconnect_all_issues_signals)
         from taiga.projects.apps import (connect_memberships_signals,
                                          disconnect_memberships_signals)
+        from taiga.mdrender.apps import (connect_mdrender_signals,
+                                         disconnect_mdrender_signals)
 
         disconnect_events_signals()
         disconnect_all_epics_signals()
@@ -524,6 +516,7 @@ class Project(ProjectDefaults, TaggedMixin, TagsColorsMixin, models.Model):
         disconnect_all_tasks_signals()
         disconnect_all_userstories_signals()
         disconnect_memberships_signals()
+        disconnect_mdrender_signals()
 
         try:
             self.epics.all().delete()
@@ -539,6 +532,38 @@ class Project(ProjectDefaults, TaggedMixin, TagsColorsMixin, models.Model):
             connect_all_userstories_signals()
             connect_all_epics_signals()
             connect_memberships_signals()
+            connect_mdrender_signals()
+
+
+class ProjectTotalsBucket(models.Model):
+    """
+    Number of new project timeline entries (activity) and project likes (fans)
+    of a project in a day.
+
+    The rows are inserted by database triggers on timeline_timeline and
+    likes_like (see the migration that creates this model) and are compacted
+    periodically by `taiga.projects.services.totals`.
+    """
+    project = models.ForeignKey(
+        "Project",
+        null=False,
+        blank=False,
+        related_name="totals_buckets",
+        verbose_name=_("project"),
+        db_index=False,
+        db_constraint=False,
+        on_delete=models.DO_NOTHING,
+    )
+    date = models.DateField(null=False, blank=False, verbose_name=_("date"))
+    activity = models.IntegerField(null=False, blank=False, default=0, verbose_name=_("activity"))
+    fans = models.IntegerField(null=False, blank=False, default=0, verbose_name=_("fans"))
+
+    class Meta:
+        verbose_name = "project totals bucket"
+        verbose_name_plural = "project totals buckets"
+        indexes = [
+            models.Index(fields=["project", "date"]),
+        ]
 
 
 class ProjectModulesConfig(models.Model):
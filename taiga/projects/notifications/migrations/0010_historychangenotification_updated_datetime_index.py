@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0009_auto_20200615_0811'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='historychangenotification',
+            index=models.Index(fields=['updated_datetime'], name='notificatio_updated_41d184_idx'),
+        ),
+    ]
@@ -81,6 +81,10 @@ class HistoryChangeNotification(models.Model):
 
     class Meta:
         unique_together = ("key", "owner", "project", "history_type")
+        indexes = [
+            # Used to select the notifications ready to be sent
+            models.Index(fields=["updated_datetime"]),
+        ]
 
 
 class Watched(models.Model):
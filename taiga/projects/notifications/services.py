@@ -5,13 +5,18 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
+import copy
 import datetime
+import html
+import uuid
 
-from functools import partial
+from collections import namedtuple
 import logging
 
 from django.apps import apps
 from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models import FilteredRelation
 from django.db.models import Q
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
@@ -19,9 +24,11 @@ from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.utils.translation import gettext as _
 
+from markupsafe import escape
+
 from taiga.base import exceptions as exc
-from taiga.base.utils.iterators import iter_queryset
 from taiga.base.mails import InlineCSSTemplateMail
+from taiga.base.mails import send_messages_in_batches
 from taiga.front.templatetags.functions import resolve as resolve_front_url
 from taiga.projects.notifications.choices import NotifyLevel
 from taiga.projects.notifications.models import HistoryChangeNotification
@@ -29,11 +36,9 @@ from taiga.projects.history.choices import HistoryType
 from taiga.projects.history.services import (make_key_from_model_object,
                                              get_last_snapshot_for_key,
                                              get_model_from_key)
-from taiga.permissions.services import user_has_perm
+from taiga.celery import app
 from taiga.events import events
 
-from django_pglocks import advisory_lock
-
 from .models import HistoryChangeNotification, Watched
 from .squashing import squash_history_entries
 
@@ -133,7 +138,7 @@ def get_mentions(project: object, text: str):
     return data.get("mentions")
 
 
-def _filter_by_permissions(obj, user):
+def _get_view_permission(obj):
     UserStory = apps.get_model("userstories", "UserStory")
     Issue = apps.get_model("issues", "Issue")
     Task = apps.get_model("tasks", "Task")
@@ -141,69 +146,140 @@ def _filter_by_permissions(obj, user):
     WikiPage = apps.get_model("wiki", "WikiPage")
 
     if isinstance(obj, UserStory):
-        return user_has_perm(user, "view_us", obj, cache="project")
+        return "view_us"
     elif isinstance(obj, Issue):
-        return user_has_perm(user, "view_issues", obj, cache="project")
+        return "view_issues"
     elif isinstance(obj, Task):
-        return user_has_perm(user, "view_tasks", obj, cache="project")
+        return "view_tasks"
     elif isinstance(obj, Epic):
-        return user_has_perm(user, "view_epics", obj, cache="project")
+        return "view_epics"
     elif isinstance(obj, WikiPage):
-        return user_has_perm(user, "view_wiki_pages", obj, cache="project")
-    return False
-
-
-def _filter_notificable(user):
-    return user.is_active and not user.is_system
+        return "view_wiki_pages"
+    return None
 
 
-def get_users_to_notify(obj, *, history=None, discard_users=None, live=False) -> list:
+def _get_involved_user_ids(obj, history=None):
     """
-    Get filtered set of users to notify for specified
-    model instance and changer.
-
-    NOTE: changer at this momment is not used.
-    NOTE: analogouts to obj.get_watchers_to_notify(changer)
+    Get the ids of the users involved in a change of an object: the owner,
+    the assigned user and, if the change is an unassignment, the previous
+    assigned user.
     """
-    project = obj.get_project()
-
-    def _check_level(project: object, user: object, levels: tuple) -> bool:
-        policy = project.cached_notify_policy_for_user(user)
-        if live:
-            return policy.live_notify_level in levels
-        return policy.notify_level in levels
+    user_ids = set()
 
-    _can_notify_hard = partial(_check_level, project,
-                               levels=[NotifyLevel.all])
-    _can_notify_light = partial(_check_level, project,
-                                levels=[NotifyLevel.all, NotifyLevel.involved])
+    if getattr(obj, "owner_id", None):
+        user_ids.add(obj.owner_id)
 
-    candidates = set()
-    candidates.update(filter(_can_notify_hard, project.members.all()))
-    candidates.update(filter(_can_notify_hard, obj.project.get_watchers()))
-    candidates.update(filter(_can_notify_light, obj.get_watchers()))
-    candidates.update(filter(_can_notify_light, obj.get_participants()))
+    if getattr(obj, "assigned_to_id", None):
+        user_ids.add(obj.assigned_to_id)
 
     # If the history is an unassignment change we should notify that user too
-    user_ids = []
     if history and history.type == HistoryType.change and "assigned_to" in history.diff:
-        user_ids = [user_id for user_id in history.diff["assigned_to"] if isinstance(user_id, int)]
+        user_ids.update(user_id for user_id in history.diff["assigned_to"] if isinstance(user_id, int))
 
-    if user_ids:
-        assigned_to_users = get_user_model().objects.filter(id__in=user_ids)
-        candidates.update(filter(_can_notify_light, assigned_to_users))
+    return user_ids
 
-    # Remove the changer from candidates
-    if discard_users:
-        candidates = candidates - set(discard_users)
 
-    # Filter by object permissions
-    candidates = set(filter(partial(_filter_by_permissions, obj), candidates))
+NotificationRecipients = namedtuple("NotificationRecipients", ["email", "live"])
 
-    # Filter disabled and system users
-    candidates = set(filter(partial(_filter_notificable), candidates))
 
-    return frozenset(candidates)
+def get_notification_recipients(obj, *, history=None, discard_users=None) -> NotificationRecipients:
+    """
+    Get the users to notify by email and by live notifications about a change
+    of specified model instance, computed with one query.
+
+    Every candidate is fetched with its notify policy for the project, its
+    membership and whether it watches the object, and then:
+
+    - users with the level "all" are notified of every change (for live
+      notifications, only if they are members or watch the project).
+    - users with the level "involved" (the default if they have no policy)
+      are notified only if they watch the object, own it or are (or were)
+      assigned to it.
+
+    Users without permission to view the object, disabled or system users
+    and `discard_users` are never notified.
+    """
+    project = obj.get_project()
+    view_permission = _get_view_permission(obj)
+    if view_permission is None:
+        return NotificationRecipients(email=frozenset(), live=frozenset())
+
+    involved_ids = _get_involved_user_ids(obj, history=history)
+    content_type = ContentType.objects.get_for_model(obj)
+
+    candidates = (get_user_model().objects
+                  .annotate(project_policy=FilteredRelation("notify_policies",
+                                                            condition=Q(notify_policies__project_id=project.id)),
+                            project_membership=FilteredRelation("memberships",
+                                                                condition=Q(memberships__project_id=project.id)),
+                            object_watched=FilteredRelation("watched",
+                                                            condition=Q(watched__content_type_id=content_type.id,
+                                                                        watched__object_id=obj.id)))
+                  .annotate(notify_policy_id=F("project_policy__id"),
+                            notify_level=F("project_policy__notify_level"),
+                            live_notify_level=F("project_policy__live_notify_level"),
+                            membership_id=F("project_membership__id"),
+                            watched_id=F("object_watched__id"))
+                  .filter(Q(project_policy__notify_level=NotifyLevel.all) |
+                          Q(project_policy__live_notify_level=NotifyLevel.all) |
+                          Q(object_watched__id__isnull=False) |
+                          Q(id__in=involved_ids))
+                  .filter(is_active=True, is_system=False))
+
+    # Filter by object permissions (public permissions are granted to every user)
+    if view_permission not in (project.anon_permissions or []) + (project.public_permissions or []):
+        candidates = candidates.filter(Q(is_superuser=True) |
+                                       Q(project_membership__is_admin=True) |
+                                       Q(project_membership__role__permissions__contains=[view_permission]))
+
+    # Remove the changer from candidates
+    if discard_users:
+        candidates = candidates.exclude(id__in=[user.id for user in discard_users])
+
+    light_levels = (NotifyLevel.all, NotifyLevel.involved)
+    email_users, live_users, without_policy = set(), set(), []
+    for user in candidates:
+        is_involved = user.watched_id is not None or user.id in involved_ids
+
+        if user.notify_policy_id is None:
+            if is_involved:
+                email_users.add(user)
+                live_users.add(user)
+                without_policy.append(user)
+            continue
+
+        if user.notify_level == NotifyLevel.all or (is_involved and user.notify_level in light_levels):
+            email_users.add(user)
+
+        is_project_watcher = user.membership_id is not None or user.notify_level != NotifyLevel.none
+        if ((is_project_watcher and user.live_notify_level == NotifyLevel.all) or
+                (is_involved and user.live_notify_level in light_levels)):
+            live_users.add(user)
+
+    if without_policy:
+        # Involved users get a default notify policy for the project
+        NotifyPolicy = apps.get_model("notifications", "NotifyPolicy")
+        NotifyPolicy.objects.bulk_create([NotifyPolicy(project=project,
+                                                       user=user,
+                                                       notify_level=NotifyLevel.involved,
+                                                       modified_at=timezone.now())
+                                          for user in without_policy],
+                                         ignore_conflicts=True)
+        project.__dict__.pop("cached_notify_policies", None)
+
+    return NotificationRecipients(email=frozenset(email_users), live=frozenset(live_users))
+
+
+def get_users_to_notify(obj, *, history=None, discard_users=None, live=False) -> frozenset:
+    """
+    Get filtered set of users to notify for specified
+    model instance and changer.
+
+    NOTE: use `get_notification_recipients` to get the users
+    to notify by email and live at once.
+    """
+    recipients = get_notification_recipients(obj, history=history, discard_users=discard_users)
+    return recipients.live if live else recipients.email
 
 
 def _resolve_template_name(model: object, *, change_type: int) -> str:
@@ -239,6 +315,58 @@ def _make_template_mail(name: str):
     return cls()
 
 
+class _UserPlaceholder:
+    """
+    Stand-in for the notified user when the emails of a notification are
+    rendered (templates only print the user full name).
+    """
+    def __init__(self):
+        self.token = "taiga-notified-user-{}".format(uuid.uuid4().hex)
+
+    def get_full_name(self):
+        return self.token
+
+    def __str__(self):
+        return self.token
+
+
+def _make_notification_emails(email, context, users, headers):
+    """
+    Make the email messages of a notification for a list of users.
+
+    The templates are rendered only once per language, with a placeholder
+    instead of the user that is replaced by the full name of every user
+    (escaped like the templates do).
+    """
+    placeholder = _UserPlaceholder()
+    prototypes = {}
+    messages = []
+
+    for user in users:
+        lang = user.lang or settings.LANGUAGE_CODE
+        prototype = prototypes.get(lang, None)
+        if prototype is None:
+            prototype_context = dict(context, user=placeholder, lang=lang)
+            prototype = prototypes[lang] = email.make_email_object([], prototype_context, headers=headers)
+
+        full_name = user.get_full_name()
+        escaped_full_name = str(escape(full_name))
+        # The html body is serialized again when the CSS is inlined
+        html_full_name = html.escape(full_name, quote=False)
+
+        message = copy.copy(prototype)
+        message.to = [user.email]
+        message.extra_headers = dict(prototype.extra_headers)
+        message.subject = prototype.subject.replace(placeholder.token, escaped_full_name)
+        message.body = prototype.body.replace(placeholder.token,
+                                              html_full_name if prototype.content_subtype == "html" else escaped_full_name)
+        message.alternatives = [(content.replace(placeholder.token, html_full_name), mimetype)
+                                for content, mimetype in getattr(prototype, "alternatives", [])]
+        messages.append(message)
+
+    return messages
+
+
 @transaction.atomic
 def send_notifications(obj, *, history):
     if history.is_hidden:
@@ -257,15 +385,14 @@ def send_notifications(obj, *, history):
 
     # Get a complete list of notifiable users for current
     # object and send the change notification to them.
-    notify_users = get_users_to_notify(obj, history=history, discard_users=[notification.owner])
-    notification.notify_users.add(*notify_users)
+    recipients = get_notification_recipients(obj, history=history, discard_users=[notification.owner])
+    notification.notify_users.add(*recipients.email)
 
     # If we are the min interval is 0 it just work in a synchronous and spamming way
     if settings.CHANGE_NOTIFICATIONS_MIN_INTERVAL == 0:
         send_sync_notifications(notification.id)
 
-    live_notify_users = get_users_to_notify(obj, history=history, discard_users=[notification.owner], live=True)
-    for user in live_notify_users:
+    for user in recipients.live:
         events.emit_live_notification_for_model(obj, user, history)
 
 
@@ -294,7 +421,7 @@ def send_sync_notifications(notification_id):
     # If the last modification is too recent we ignore it for the time being
     now = timezone.now()
     time_diff = now - notification.updated_datetime
-    if time_diff.seconds < settings.CHANGE_NOTIFICATIONS_MIN_INTERVAL:
+    if time_diff.total_seconds() < settings.CHANGE_NOTIFICATIONS_MIN_INTERVAL:
         return False, []
 
     # Custom Hardcode Filter
@@ -365,24 +492,15 @@ def send_sync_notifications(notification_id):
         "List-Unsubscribe": "<{unsubscribe_url}>".format(**format_args),
     }
 
-    for user in notification.notify_users.distinct():
-        context["user"] = user
-        context["lang"] = user.lang or settings.LANGUAGE_CODE
-        try:
-            email.send(user.email, context, headers=headers)
-        except Exception:
-            """
-            Catch all smtp exceptions:
-
-              - smtplib.SMTPDataError
-              - smtplib.SMTPException
-              - smtplib.SMTPServerDisconnected
-              - ssl.SSLError
-              - OSError
-              - ValueError
-              - ...
-            """
-            logger.exception("Error sending email notifications")
+    users = list(notification.notify_users.distinct())
+    messages = _make_notification_emails(email, context, users, headers)
+
+    # The errors (smtplib.SMTPDataError, smtplib.SMTPServerDisconnected,
+    # ssl.SSLError, OSError...) are logged for every message and don't
+    # stop the delivery of the others
+    send_messages_in_batches(messages,
+                             batch_size=settings.NOTIFICATIONS_EMAIL_BATCH_SIZE,
+                             max_workers=settings.NOTIFICATIONS_EMAIL_MAX_WORKERS)
 
     notification_id = notification.id
     notification.delete()
@@ -574,12 +692,56 @@ def make_ms_thread_index(msg_id, dt):
     return base64.b64encode(thread_bin).decode("utf-8")
 
 
-def send_bulk_email():
-    with advisory_lock("send-notifications-command", wait=False) as acquired:
-        if acquired:
-            qs = HistoryChangeNotification.objects.all().order_by("-id")
-            for change_notification in iter_queryset(qs, itersize=100):
+def _claim_due_notifications(due_datetime, shard, shards, exclude_ids):
+    qs = (HistoryChangeNotification.objects.select_for_update(skip_locked=True)
+                                           .filter(updated_datetime__lte=due_datetime)
+                                           .exclude(id__in=exclude_ids))
+    if shards > 1:
+        qs = qs.annotate(shard=F("id") % shards).filter(shard=shard)
+
+    qs = qs.order_by("updated_datetime").values_list("id", flat=True)
+    return list(qs[:settings.NOTIFICATIONS_DISPATCH_BATCH_SIZE])
+
+
+def send_due_notifications(shard=0, shards=1):
+    """
+    Send the notifications of a shard (with `id % shards == shard`) that
+    have not been updated for CHANGE_NOTIFICATIONS_MIN_INTERVAL seconds.
+
+    The notifications are claimed in batches with SELECT ... FOR UPDATE
+    SKIP LOCKED, so several workers can send them at the same time without
+    waiting for each other or sending a notification twice.
+    """
+    due_datetime = timezone.now() - datetime.timedelta(seconds=settings.CHANGE_NOTIFICATIONS_MIN_INTERVAL)
+    claimed_ids = set()
+
+    while True:
+        with transaction.atomic():
+            notification_ids = _claim_due_notifications(due_datetime, shard, shards, claimed_ids)
+            if not notification_ids:
+                return
+
+            for notification_id in notification_ids:
+                claimed_ids.add(notification_id)
                 try:
-                    send_sync_notifications(change_notification.pk)
-                except HistoryChangeNotification.DoesNotExist:
-                    pass
+                    send_sync_notifications(notification_id)
+                except Exception:
+                    logger.exception("Error sending the notification %s", notification_id)
+
+
+@app.task
+def send_due_notifications_task(shard, shards):
+    send_due_notifications(shard, shards)
+
+
+def send_bulk_email():
+    """
+    Send the due notifications. With celery they are sent in parallel by
+    NOTIFICATIONS_DISPATCH_SHARDS tasks.
+    """
+    if settings.CELERY_ENABLED and settings.SEND_BULK_EMAILS_WITH_CELERY:
+        shards = max(settings.NOTIFICATIONS_DISPATCH_SHARDS, 1)
+        for shard in range(shards):
+            send_due_notifications_task.delay(shard, shards)
+    else:
+        send_due_notifications()
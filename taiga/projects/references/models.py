@@ -94,8 +94,10 @@ def store_previous_project(sender, instance, **kwargs):
     try:
         prev_instance = sender.objects.get(pk=instance.pk)
         instance.prev_project = prev_instance.project
+        instance.prev_subject = prev_instance.subject
     except sender.DoesNotExist:
         instance.prev_project = None
+        instance.prev_subject = None
 
 
 def attach_sequence(sender, instance, created, **kwargs):
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2021-present Kaleidos INC
+
+import gzip
+import hashlib
+import io
+from collections import namedtuple
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+from django.utils.module_loading import import_string
+
+from taiga.celery import app
+
+
+CsvExport = namedtuple("CsvExport", ["model", "custom_attributes_model", "lines"])
+
+CSV_EXPORTS = {
+    "userstories": CsvExport("userstories.UserStory", "custom_attributes.UserStoryCustomAttribute",
+                             "taiga.projects.userstories.services.iter_userstories_csv"),
+    "tasks": CsvExport("tasks.Task", "custom_attributes.TaskCustomAttribute",
+                       "taiga.projects.tasks.services.iter_tasks_csv"),
+    "issues": CsvExport("issues.Issue", "custom_attributes.IssueCustomAttribute",
+                        "taiga.projects.issues.services.iter_issues_csv"),
+    "epics": CsvExport("epics.Epic", "custom_attributes.EpicCustomAttribute",
+                       "taiga.projects.epics.services.iter_epics_csv"),
+}
+
+# The choices of the project shown in the exports (their names, values...)
+CSV_EXPORTS_CHOICES_MODELS = (
+    "projects.EpicStatus",
+    "projects.UserStoryStatus",
+    "projects.TaskStatus",
+    "projects.IssueStatus",
+    "projects.IssueType",
+    "projects.Priority",
+    "projects.Severity",
+    "projects.Points",
+    "projects.Swimlane",
+    "users.Role",
+)
+
+
+def _get_cache_key(project_id, name):
+    return "csv-export/{}/{}".format(name, project_id)
+
+
+def _get_lock_key(project_id, name):
+    return "csv-export-lock/{}/{}".format(name, project_id)
+
+
+def get_csv_watermark(project, name):
+    """
+    Get the watermark of the CSV export `name` of a project: a string that
+    changes when the exported items (their history, votes or watchers), the
+    custom attributes, the sprints or the choices of the project, or the
+    names of its users change.
+    """
+    export = CSV_EXPORTS[name]
+    model = apps.get_model(export.model)
+    table = model._meta.db_table
+    custom_attributes_table = apps.get_model(export.custom_attributes_model)._meta.db_table
+    choices_sql = " UNION ALL ".join(
+        """SELECT '{table}:' || "t"::text AS "choice" FROM "{table}" "t" WHERE "project_id" = %(project_id)s""".format(
+            table=apps.get_model(choices_model)._meta.db_table)
+        for choices_model in CSV_EXPORTS_CHOICES_MODELS
+    )
+
+    sql = """
+        SELECT (SELECT count(*) FROM "{table}" WHERE "project_id" = %(project_id)s),
+               (SELECT max("modified_date") FROM "{table}" WHERE "project_id" = %(project_id)s),
+               (SELECT max("created_at") FROM "history_historyentry" WHERE "project_id" = %(project_id)s),
+               (SELECT count(*) FROM "{custom_attributes_table}" WHERE "project_id" = %(project_id)s),
+               (SELECT max("modified_date") FROM "{custom_attributes_table}" WHERE "project_id" = %(project_id)s),
+               (SELECT count(*) FROM "votes_vote"
+                 WHERE "content_type_id" = %(content_type_id)s
+                   AND "object_id" IN (SELECT "id" FROM "{table}" WHERE "project_id" = %(project_id)s)),
+               (SELECT max("created_date") FROM "votes_vote"
+                 WHERE "content_type_id" = %(content_type_id)s
+                   AND "object_id" IN (SELECT "id" FROM "{table}" WHERE "project_id" = %(project_id)s)),
+               (SELECT count(*) FROM "notifications_watched"
+                 WHERE "project_id" = %(project_id)s AND "content_type_id" = %(content_type_id)s),
+               (SELECT max("created_date") FROM "notifications_watched"
+                 WHERE "project_id" = %(project_id)s AND "content_type_id" = %(content_type_id)s),
+               (SELECT count(*) FROM "milestones_milestone" WHERE "project_id" = %(project_id)s),
+               (SELECT max("modified_date") FROM "milestones_milestone" WHERE "project_id" = %(project_id)s),
+               (SELECT md5(string_agg("choice", ',' ORDER BY "choice")) FROM ({choices_sql}) "choices"),
+               (SELECT md5(string_agg(concat_ws(':', "id", "username", "full_name", "email"), ',' ORDER BY "id"))
+                  FROM "users_user"
+                 WHERE "id" IN (SELECT "user_id" FROM "projects_membership" WHERE "project_id" = %(project_id)s)
+                    OR "id" IN (SELECT "owner_id" FROM "{table}" WHERE "project_id" = %(project_id)s)
+                    OR "id" IN (SELECT "assigned_to_id" FROM "{table}" WHERE "project_id" = %(project_id)s))
+    """.format(table=table, custom_attributes_table=custom_attributes_table, choices_sql=choices_sql)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {"project_id": project.id,
+                             "content_type_id": ContentType.objects.get_for_model(model).id})
+        row = cursor.fetchone()
+
+    return ":".join(str(value) for value in row)
+
+
+def _get_etag(project, name, watermark, gzipped=False):
+    value = "{}:{}:{}:{}".format(name, project.id, project.modified_date, watermark)
+    etag = hashlib.sha1(value.encode("utf-8")).hexdigest()
+    # Each encoding of the export is a different representation
+    if gzipped:
+        etag = "{}-gzip".format(etag)
+    return quote_etag(etag)
+
+
+def _accepts_gzip(request):
+    return "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+
+
+def _get_csv_queryset(project, name):
+    model = apps.get_model(CSV_EXPORTS[name].model)
+    return model.objects.filter(project=project).order_by("ref")
+
+
+def _iter_csv(project, name):
+    iter_csv_lines = import_string(CSV_EXPORTS[name].lines)
+    return iter_csv_lines(project, _get_csv_queryset(project, name))
+
+
+def update_csv_export_cache(project, name):
+    """
+    Generate the CSV export `name` of a project and save it in the cache,
+    gzip-compressed if CSV_EXPORT_CACHE_COMPRESS. Return the cached value.
+    """
+    # The watermark is read before the export so, if the items change in the
+    # meantime, the cached export is considered stale on the next request.
+    watermark = get_csv_watermark(project, name)
+
+    data = io.BytesIO()
+    if settings.CSV_EXPORT_CACHE_COMPRESS:
+        with gzip.GzipFile(fileobj=data, mode="wb") as compressed_data:
+            for line in _iter_csv(project, name):
+                compressed_data.write(line.encode("utf-8"))
+    else:
+        for line in _iter_csv(project, name):
+            data.write(line.encode("utf-8"))
+
+    cached = {
+        "watermark": watermark,
+        "compressed": settings.CSV_EXPORT_CACHE_COMPRESS,
+        "data": data.getvalue(),
+    }
+    cache.set(_get_cache_key(project.id, name), cached, settings.CSV_EXPORT_CACHE_TIMEOUT)
+    return cached
+
+
+@app.task
+def update_csv_export_cache_task(project_id, name):
+    Project = apps.get_model("projects", "Project")
+    try:
+        project = Project.objects.get(id=project_id)
+        update_csv_export_cache(project, name)
+    except Project.DoesNotExist:
+        pass
+    finally:
+        cache.delete(_get_lock_key(project_id, name))
+
+
+def _schedule_csv_export_cache_update(project, name):
+    # Only one regeneration of the same export at a time
+    if not cache.add(_get_lock_key(project.id, name), True, settings.CSV_EXPORT_CACHE_LOCK_TIMEOUT):
+        return
+
+    connection.on_commit(lambda: update_csv_export_cache_task.delay(project.id, name))
+
+
+def _get_cached_response(request, cached):
+    if not cached["compressed"]:
+        return HttpResponse(cached["data"])
+
+    if _accepts_gzip(request):
+        response = HttpResponse(cached["data"])
+        response["Content-Encoding"] = "gzip"
+        return response
+    return HttpResponse(gzip.decompress(cached["data"]))
+
+
+def get_csv_response(request, project, name):
+    """
+    Get the response with the CSV export `name` of a project.
+
+    Requests with an `If-None-Match` header matching the current watermark
+    get a 304. There is no `Last-Modified`: some changes (deleted votes or
+    custom attributes, renamed choices or users) don't move any date. If CSV_EXPORT_CACHE_ENABLED, the export
+    is served from the cache while it's fresh; otherwise it's streamed and
+    the cache is regenerated in background or, without celery, regenerated
+    and served right away.
+    """
+    watermark = get_csv_watermark(project, name)
+    # The etag of the representation this request would usually get
+    gzipped = (settings.CSV_EXPORT_CACHE_ENABLED and settings.CSV_EXPORT_CACHE_COMPRESS and
+               _accepts_gzip(request))
+    etag = _get_etag(project, name, watermark, gzipped=gzipped)
+
+    response = get_conditional_response(request, etag=etag)
+
+    if response is None and settings.CSV_EXPORT_CACHE_ENABLED:
+        cached = cache.get(_get_cache_key(project.id, name))
+        if cached is None or cached["watermark"] != watermark:
+            if settings.CELERY_ENABLED:
+                _schedule_csv_export_cache_update(project, name)
+                cached = None
+            else:
+                # Build the export once, for the cache and for this response
+                cached = update_csv_export_cache(project, name)
+
+        if cached is not None:
+            response = _get_cached_response(request, cached)
+
+    if response is None:
+        response = StreamingHttpResponse(_iter_csv(project, name))
+
+    if response.status_code == 200:
+        response["Content-Type"] = "application/csv; charset=utf-8"
+        response["Content-Disposition"] = 'attachment; filename="{}.csv"'.format(name)
+        etag = _get_etag(project, name, watermark, gzipped=response.get("Content-Encoding") == "gzip")
+    patch_vary_headers(response, ("Accept-Encoding",))
+    response["ETag"] = etag
+    return response
@@ -5,8 +5,17 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
+from collections import namedtuple
 from contextlib import closing
+from operator import itemgetter
+
+from django.apps import apps
+from django.core.exceptions import EmptyResultSet
 from django.db import connection
+from django.utils.translation import gettext as _
+
+from taiga.users.gravatar import get_gravatar_id
+from taiga.users.services import get_big_photo_url, get_photo_url
 
 
 def _get_project_tags(project):
@@ -54,3 +63,176 @@ def get_all_tags(project):
     result.update(_get_stories_tags(project))
     result.update(_get_tasks_tags(project))
     return sorted(result)
+
+
+# Filters data
+
+Facet = namedtuple("Facet", ["column", "many", "type"])
+Facet.__new__.__defaults__ = (False, int)
+
+
+def _get_where_sql(queryset):
+    compiler = connection.ops.compiler(queryset.query.compiler)(
+        queryset.query, connection, None
+    )
+    try:
+        where, where_params = queryset.query.where.as_sql(compiler, connection)
+    except EmptyResultSet:
+        return "FALSE", []
+    return where or "TRUE", list(where_params)
+
+
+def get_facets_counts(project, querysets, *, table, joins=(), columns, facets):
+    """
+    Count the items of a project for every value of every facet (status,
+    owner, tags...) in one query.
+
+    Every facet is counted over its own queryset (usually filtered by all the
+    filters except the one of the facet) and all the querysets are evaluated
+    at once: the base CTE has one row per item of the project, with the
+    `columns` (sql expressions, that can aggregate the rows of the `joins`)
+    and a boolean per facet telling if the item is in the facet queryset.
+    The facets count them with `FILTER` aggregates.
+
+    The `facets` are `Facet(column, many, type)`, where `column` is one of
+    the `columns` (an array if `many`, with a value per element) and `type`
+    converts the values.
+
+    Return a dict `{facet_name: {value: count}}`, without the zero counts.
+    """
+    base_columns = ['"{table}"."id" AS "id"'.format(table=table)]
+    base_columns += ['{} AS "{}"'.format(sql, name) for name, sql in columns.items()]
+
+    params = []
+    facet_names = list(facets.keys())
+    for index, name in enumerate(facet_names):
+        where, where_params = _get_where_sql(querysets[name])
+        base_columns.append('COALESCE(bool_or({}), FALSE) AS "facet_{}"'.format(where, index))
+        params += where_params
+
+    params.append(project.id)
+
+    counters = []
+    for index, name in enumerate(facet_names):
+        facet = facets[name]
+        if facet.many:
+            counter = """
+                SELECT %s, "value"::text, COUNT(*) FILTER (WHERE "facet_{index}")
+                  FROM "facets_base", UNNEST("facets_base"."{column}") AS "value"
+              GROUP BY "value"
+            """
+        else:
+            counter = """
+                SELECT %s, "{column}"::text, COUNT(*) FILTER (WHERE "facet_{index}")
+                  FROM "facets_base"
+              GROUP BY "{column}"
+            """
+        counters.append(counter.format(index=index, column=facet.column))
+        params.append(name)
+
+    sql = """
+        WITH "facets_base" AS (
+                SELECT {columns}
+                  FROM "{table}"
+                       {joins}
+                 WHERE "{table}"."project_id" = %s
+              GROUP BY "{table}"."id"
+        )
+        {counters}
+    """.format(
+        columns=",\n".join(base_columns),
+        table=table,
+        joins="\n".join(joins),
+        counters="UNION ALL".join(counters),
+    )
+
+    with closing(connection.cursor()) as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    result = {name: {} for name in facet_names}
+    for name, value, count in rows:
+        if count > 0:
+            result[name][facets[name].type(value) if value is not None else None] = count
+    return result
+
+
+def get_choices_filter_data(choices, counts):
+    """
+    Filter data of a facet of project choices (statuses, types, roles...).
+    """
+    result = []
+    for choice in choices:
+        result.append(
+            {
+                "id": choice.id,
+                "name": _(choice.name),
+                "color": getattr(choice, "color", None),
+                "order": choice.order,
+                "count": counts.get(choice.id, 0),
+            }
+        )
+    return sorted(result, key=itemgetter("order"))
+
+
+def get_project_users(project, *, include_system_users=False):
+    """
+    Get the members of a project (and the system users) as tuples
+    `(id, full_name, username, photo, email)`.
+    """
+    users = list(project.memberships.filter(user__isnull=False)
+                                    .values_list("user_id", "user__full_name", "user__username",
+                                                 "user__photo", "user__email"))
+    if include_system_users:
+        member_ids = set(user[0] for user in users)
+        User = apps.get_model("users", "User")
+        users += [(id, full_name, username, None, None)
+                  for id, full_name, username in (User.objects.filter(is_system=True)
+                                                              .values_list("id", "full_name", "username"))
+                  if id not in member_ids]
+    return users
+
+
+def get_users_filter_data(users, counts, *, include_unassigned=False, only_used=False,
+                          include_photos=False):
+    """
+    Filter data of a facet of users (assigned to, owners...).
+    """
+    def _make_entry(id, full_name, count, photo=None, email=None):
+        entry = {
+            "id": id,
+            "full_name": full_name,
+            "count": count,
+        }
+        if include_photos:
+            entry["photo"] = get_photo_url(photo)
+            entry["big_photo"] = get_big_photo_url(photo)
+            entry["gravatar_id"] = get_gravatar_id(email) if email else None
+        return entry
+
+    result = []
+    for id, full_name, username, photo, email in users:
+        count = counts.get(id, 0)
+        if count > 0 or not only_used:
+            result.append(_make_entry(id, full_name or username or "", count, photo, email))
+
+    if include_unassigned:
+        result.append(_make_entry(None, "", counts.get(None, 0)))
+
+    return sorted(result, key=itemgetter("full_name"))
+
+
+def get_tags_filter_data(project, counts):
+    """
+    Filter data of the tags facet (only the tags of the project).
+    """
+    result = []
+    for name, color in project.tags_colors or []:
+        result.append(
+            {
+                "name": name,
+                "color": color,
+                "count": counts.get(name, 0),
+            }
+        )
+    return sorted(result, key=itemgetter("name"))
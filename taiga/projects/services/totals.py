@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2021-present Kaleidos INC
+
+from django.db import connection
+from django.db import transaction
+from django.utils import timezone
+
+from dateutil.relativedelta import relativedelta
+
+from taiga.celery import app
+
+
+@transaction.atomic
+def compact_projects_totals_buckets():
+    """
+    Merge the rows of ProjectTotalsBucket inserted by the database triggers
+    in one row per project and day. The days older than one year (the biggest
+    window of the project totals) are merged in one row per project, and the
+    rows of deleted projects are removed.
+
+    Only the groups of rows that need it (more than one row, rows of a deleted
+    project or rows that add nothing) are deleted and inserted again; the rows
+    already compacted are left untouched.
+
+    It runs every hour from celery beat; without celery it must be scheduled
+    with the `compact_projects_totals_buckets` command.
+    """
+    expiration_date = (timezone.now() - relativedelta(years=1, days=1)).date()
+
+    sql = """
+    WITH groups AS (
+        SELECT projects_projecttotalsbucket.project_id,
+               GREATEST(projects_projecttotalsbucket.date, %(expiration_date)s) AS day
+          FROM projects_projecttotalsbucket
+     LEFT JOIN projects_project
+            ON projects_project.id = projects_projecttotalsbucket.project_id
+      GROUP BY projects_projecttotalsbucket.project_id,
+               GREATEST(projects_projecttotalsbucket.date, %(expiration_date)s)
+        HAVING count(*) > 1
+            OR bool_or(projects_project.id IS NULL)
+            OR (sum(projects_projecttotalsbucket.activity) = 0 AND
+                sum(projects_projecttotalsbucket.fans) = 0)
+    ),
+    deleted_buckets AS (
+        DELETE FROM projects_projecttotalsbucket
+              USING groups
+              WHERE projects_projecttotalsbucket.project_id = groups.project_id
+                AND GREATEST(projects_projecttotalsbucket.date, %(expiration_date)s) = groups.day
+          RETURNING projects_projecttotalsbucket.project_id,
+                    projects_projecttotalsbucket.date,
+                    projects_projecttotalsbucket.activity,
+                    projects_projecttotalsbucket.fans
+    )
+    INSERT INTO projects_projecttotalsbucket (project_id, date, activity, fans)
+         SELECT deleted_buckets.project_id,
+                min(deleted_buckets.date),
+                sum(deleted_buckets.activity),
+                sum(deleted_buckets.fans)
+           FROM deleted_buckets
+     INNER JOIN projects_project
+             ON projects_project.id = deleted_buckets.project_id
+       GROUP BY deleted_buckets.project_id, GREATEST(deleted_buckets.date, %(expiration_date)s)
+         HAVING sum(deleted_buckets.activity) <> 0 OR sum(deleted_buckets.fans) <> 0
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {"expiration_date": expiration_date})
+
+
+@app.task
+def compact_projects_totals_buckets_task():
+    compact_projects_totals_buckets()
@@ -5,21 +5,21 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
-import csv
 import io
 import logging
 
 from collections import OrderedDict
-from operator import itemgetter
-from contextlib import closing
 
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import connection
-from django.utils.translation import gettext as _
 
 from taiga.base.utils import db, text
+from taiga.projects.attachments.utils import attach_total_attachments
 from taiga.projects.history.services import take_snapshot
 from taiga.projects.services import apply_order_updates
+from taiga.projects.services.filters import Facet, get_facets_counts
+from taiga.projects.services.filters import get_choices_filter_data, get_project_users
+from taiga.projects.services.filters import get_tags_filter_data, get_users_filter_data
 from taiga.projects.tasks.apps import connect_tasks_signals
 from taiga.projects.tasks.apps import disconnect_tasks_signals
 from taiga.events import events
@@ -155,6 +155,16 @@ def update_tasks_milestone_in_bulk(bulk_data: list, milestone: object):
 
 def tasks_to_csv(project, queryset):
     csv_data = io.StringIO()
+    csv_data.writelines(iter_tasks_csv(project, queryset))
+    return csv_data
+
+
+def iter_tasks_csv(project, queryset):
+    """
+    Return an iterator over the lines of the CSV of the tasks of the
+    queryset. They are read in chunks, with their related data attached by
+    the query, so the CSV can be streamed in constant memory.
+    """
     fieldnames = [
         "id",
         "ref",
@@ -186,79 +196,86 @@ def tasks_to_csv(project, queryset):
         "due_date_reason",
     ]
 
-    custom_attrs = project.taskcustomattributes.all()
+    custom_attrs = list(project.taskcustomattributes.all())
     for custom_attr in custom_attrs:
         fieldnames.append(custom_attr.name)
 
-    queryset = queryset.prefetch_related(
-        "attachments", "generated_user_stories", "custom_attributes_values"
-    )
     queryset = queryset.select_related(
-        "milestone", "owner", "assigned_to", "status", "project", "user_story"
+        "milestone",
+        "owner",
+        "assigned_to",
+        "status",
+        "project",
+        "user_story",
+        "custom_attributes_values",
     )
 
+    queryset = attach_total_attachments(queryset)
     queryset = attach_total_voters_to_queryset(queryset)
     queryset = attach_watchers_to_queryset(queryset)
 
-    writer = csv.DictWriter(csv_data, fieldnames=fieldnames)
-    writer.writeheader()
-    for task in queryset:
-        task_data = {
-            "id": task.id,
-            "ref": task.ref,
-            "subject": text.sanitize_csv_text_value(task.subject),
-            "description": text.sanitize_csv_text_value(task.description),
-            "user_story": task.user_story.ref if task.user_story else None,
-            "sprint_id": task.milestone.id if task.milestone else None,
-            "sprint": (
-                text.sanitize_csv_text_value(task.milestone.name)
-                if task.milestone
-                else None
-            ),
-            "sprint_estimated_start": (
-                task.milestone.estimated_start if task.milestone else None
-            ),
-            "sprint_estimated_finish": (
-                task.milestone.estimated_finish if task.milestone else None
-            ),
-            "owner": task.owner.username if task.owner else None,
-            "owner_full_name": (
-                text.sanitize_csv_text_value(task.owner.get_full_name())
-                if task.owner
-                else None
-            ),
-            "assigned_to": task.assigned_to.username if task.assigned_to else None,
-            "assigned_to_full_name": (
-                text.sanitize_csv_text_value(task.assigned_to.get_full_name())
-                if task.assigned_to
-                else None
-            ),
-            "status": task.status.name if task.status else None,
-            "is_iocaine": task.is_iocaine,
-            "is_closed": task.status is not None and task.status.is_closed,
-            "us_order": task.us_order,
-            "taskboard_order": task.taskboard_order,
-            "attachments": task.attachments.count(),
-            "external_reference": task.external_reference,
-            "tags": ",".join(task.tags or []),
-            "watchers": task.watchers,
-            "voters": task.total_voters,
-            "created_date": task.created_date,
-            "modified_date": task.modified_date,
-            "finished_date": task.finished_date,
-            "due_date": task.due_date,
-            "due_date_reason": task.due_date_reason,
-        }
-        for custom_attr in custom_attrs:
-            if not hasattr(task, "custom_attributes_values"):
-                continue
-            value = task.custom_attributes_values.attributes_values.get(
-                str(custom_attr.id), None
-            )
-            task_data[custom_attr.name] = text.sanitize_csv_text_value(value)
-        writer.writerow(task_data)
-
-    return csv_data
+    rows = (
+        _get_task_csv_row(task, custom_attrs)
+        for task in queryset.iterator(chunk_size=settings.CSV_EXPORT_CHUNK_SIZE)
+    )
+    return text.iter_csv_lines(fieldnames, rows)
+
+
+def _get_task_csv_row(task, custom_attrs):
+    task_data = {
+        "id": task.id,
+        "ref": task.ref,
+        "subject": text.sanitize_csv_text_value(task.subject),
+        "description": text.sanitize_csv_text_value(task.description),
+        "user_story": task.user_story.ref if task.user_story else None,
+        "sprint_id": task.milestone.id if task.milestone else None,
+        "sprint": (
+            text.sanitize_csv_text_value(task.milestone.name)
+            if task.milestone
+            else None
+        ),
+        "sprint_estimated_start": (
+            task.milestone.estimated_start if task.milestone else None
+        ),
+        "sprint_estimated_finish": (
+            task.milestone.estimated_finish if task.milestone else None
+        ),
+        "owner": task.owner.username if task.owner else None,
+        "owner_full_name": (
+            text.sanitize_csv_text_value(task.owner.get_full_name())
+            if task.owner
+            else None
+        ),
+        "assigned_to": task.assigned_to.username if task.assigned_to else None,
+        "assigned_to_full_name": (
+            text.sanitize_csv_text_value(task.assigned_to.get_full_name())
+            if task.assigned_to
+            else None
+        ),
+        "status": task.status.name if task.status else None,
+        "is_iocaine": task.is_iocaine,
+        "is_closed": task.status is not None and task.status.is_closed,
+        "us_order": task.us_order,
+        "taskboard_order": task.taskboard_order,
+        "attachments": task.total_attachments,
+        "external_reference": task.external_reference,
+        "tags": ",".join(task.tags or []),
+        "watchers": task.watchers,
+        "voters": task.total_voters,
+        "created_date": task.created_date,
+        "modified_date": task.modified_date,
+        "finished_date": task.finished_date,
+        "due_date": task.due_date,
+        "due_date_reason": task.due_date_reason,
+    }
+    for custom_attr in custom_attrs:
+        if not hasattr(task, "custom_attributes_values"):
+            continue
+        value = task.custom_attributes_values.attributes_values.get(
+            str(custom_attr.id), None
+        )
+        task_data[custom_attr.name] = text.sanitize_csv_text_value(value)
+    return task_data
 
 
 #####################################################
@@ -266,295 +283,47 @@ def tasks_to_csv(project, queryset):
 #####################################################
 
 
-def _get_tasks_statuses(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-      SELECT "projects_taskstatus"."id",
-             "projects_taskstatus"."name",
-             "projects_taskstatus"."color",
-             "projects_taskstatus"."order",
-             (SELECT count(*)
-                FROM "tasks_task"
-                     INNER JOIN "projects_project" ON
-                                ("tasks_task"."project_id" = "projects_project"."id")
-               WHERE {where} AND "tasks_task"."status_id" = "projects_taskstatus"."id")
-        FROM "projects_taskstatus"
-       WHERE "projects_taskstatus"."project_id" = %s
-    ORDER BY "projects_taskstatus"."order";
-    """.format(
-        where=where
-    )
-
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id])
-        rows = cursor.fetchall()
-
-    result = []
-    for id, name, color, order, count in rows:
-        result.append(
-            {
-                "id": id,
-                "name": _(name),
-                "color": color,
-                "order": order,
-                "count": count,
-            }
-        )
-    return sorted(result, key=itemgetter("order"))
-
-
-def _get_tasks_assigned_to(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-        WITH counters AS (
-                SELECT assigned_to_id,  count(assigned_to_id) count
-                  FROM "tasks_task"
-            INNER JOIN "projects_project" ON ("tasks_task"."project_id" = "projects_project"."id")
-                 WHERE {where} AND "tasks_task"."assigned_to_id" IS NOT NULL
-              GROUP BY assigned_to_id
-        )
-
-                 SELECT "projects_membership"."user_id" user_id,
-                        "users_user"."full_name",
-                        "users_user"."username",
-                        COALESCE("counters".count, 0) count
-                   FROM projects_membership
-        LEFT OUTER JOIN counters ON ("projects_membership"."user_id" = "counters"."assigned_to_id")
-             INNER JOIN "users_user" ON ("projects_membership"."user_id" = "users_user"."id")
-                  WHERE "projects_membership"."project_id" = %s AND "projects_membership"."user_id" IS NOT NULL
-
-        -- unassigned tasks
-        UNION
-
-                 SELECT NULL user_id, NULL, NULL, count(coalesce(assigned_to_id, -1)) count
-                   FROM "tasks_task"
-             INNER JOIN "projects_project" ON ("tasks_task"."project_id" = "projects_project"."id")
-                  WHERE {where} AND "tasks_task"."assigned_to_id" IS NULL
-               GROUP BY assigned_to_id
-    """.format(
-        where=where
-    )
-
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id] + where_params)
-        rows = cursor.fetchall()
-
-    result = []
-    none_valued_added = False
-    for id, full_name, username, count in rows:
-        result.append(
-            {
-                "id": id,
-                "full_name": full_name or username or "",
-                "count": count,
-            }
-        )
-
-        if id is None:
-            none_valued_added = True
-
-    # If there was no task with null assigned_to we manually add it
-    if not none_valued_added:
-        result.append(
-            {
-                "id": None,
-                "full_name": "",
-                "count": 0,
-            }
-        )
-
-    return sorted(result, key=itemgetter("full_name"))
-
-
-def _get_tasks_roles(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-     WITH "task_counters" AS (
-         SELECT DISTINCT "tasks_task"."status_id" "status_id",
-                         "tasks_task"."id" "us_id",
-                         "projects_membership"."role_id" "role_id"
-                    FROM "tasks_task"
-              INNER JOIN "projects_project"
-                      ON ("tasks_task"."project_id" = "projects_project"."id")
-         LEFT OUTER JOIN "projects_membership"
-                      ON "projects_membership"."user_id" = "tasks_task"."assigned_to_id"
-                   WHERE {where}
-            ),
-             "counters" AS (
-                  SELECT "role_id" as "role_id",
-                         COUNT("role_id") "count"
-                    FROM "task_counters"
-                GROUP BY "role_id"
-            )
-
-                 SELECT "users_role"."id",
-                        "users_role"."name",
-                        "users_role"."order",
-                        COALESCE("counters"."count", 0)
-                   FROM "users_role"
-        LEFT OUTER JOIN "counters"
-                     ON "counters"."role_id" = "users_role"."id"
-                  WHERE "users_role"."project_id" = %s
-               ORDER BY "users_role"."order";
-    """.format(
-        where=where
-    )
-
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id])
-        rows = cursor.fetchall()
-
-    result = []
-    for id, name, order, count in rows:
-        result.append(
-            {
-                "id": id,
-                "name": _(name),
-                "color": None,
-                "order": order,
-                "count": count,
-            }
-        )
-    return sorted(result, key=itemgetter("order"))
-
-
-def _get_tasks_owners(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-        WITH counters AS (
-                SELECT "tasks_task"."owner_id" owner_id,
-                       count(coalesce("tasks_task"."owner_id", -1)) count
-                  FROM "tasks_task"
-            INNER JOIN "projects_project" ON ("tasks_task"."project_id" = "projects_project"."id")
-                 WHERE {where}
-              GROUP BY "tasks_task"."owner_id"
-        )
-
-                 SELECT "projects_membership"."user_id" id,
-                        "users_user"."full_name",
-                        "users_user"."username",
-                        COALESCE("counters".count, 0) count
-                   FROM projects_membership
-        LEFT OUTER JOIN counters ON ("projects_membership"."user_id" = "counters"."owner_id")
-             INNER JOIN "users_user" ON ("projects_membership"."user_id" = "users_user"."id")
-                  WHERE "projects_membership"."project_id" = %s AND "projects_membership"."user_id" IS NOT NULL
-
-        -- System users
-        UNION
-
-                 SELECT "users_user"."id" user_id,
-                        "users_user"."full_name" full_name,
-                        "users_user"."username" username,
-                        COALESCE("counters".count, 0) count
-                   FROM users_user
-        LEFT OUTER JOIN counters ON ("users_user"."id" = "counters"."owner_id")
-                  WHERE ("users_user"."is_system" IS TRUE)
-    """.format(
-        where=where
-    )
-
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id])
-        rows = cursor.fetchall()
-
-    result = []
-    for id, full_name, username, count in rows:
-        if count > 0:
-            result.append(
-                {
-                    "id": id,
-                    "full_name": full_name or username or "",
-                    "count": count,
-                }
-            )
-    return sorted(result, key=itemgetter("full_name"))
-
-
-def _get_tasks_tags(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-        WITH tasks_tags AS (
-                    SELECT tag,
-                           COUNT(tag) counter FROM (
-                                SELECT UNNEST(tasks_task.tags) tag
-                                  FROM tasks_task
-                            INNER JOIN projects_project
-                                        ON (tasks_task.project_id = projects_project.id)
-                                 WHERE {where}) tags
-                  GROUP BY tag),
-             project_tags AS (
-                    SELECT reduce_dim(tags_colors) tag_color
-                      FROM projects_project
-                     WHERE id=%s)
-
-      SELECT tag_color[1] tag,
-             tag_color[2] color,
-             COALESCE(tasks_tags.counter, 0) counter
-        FROM project_tags
-   LEFT JOIN tasks_tags ON project_tags.tag_color[1] = tasks_tags.tag
-    ORDER BY tag
-    """.format(
-        where=where
-    )
-
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id])
-        rows = cursor.fetchall()
-
-    result = []
-    for name, color, count in rows:
-        result.append(
-            {
-                "name": name,
-                "color": color,
-                "count": count,
-            }
-        )
-    return sorted(result, key=itemgetter("name"))
-
-
 def get_tasks_filters_data(project, querysets):
     """
     Given a project and an tasks queryset, return a simple data structure
     of all possible filters for the tasks in the queryset.
     """
+    counts = get_facets_counts(
+        project,
+        querysets,
+        table="tasks_task",
+        joins=[
+            """INNER JOIN "projects_project"
+                       ON ("tasks_task"."project_id" = "projects_project"."id")""",
+        ],
+        columns={
+            "status_id": '"tasks_task"."status_id"',
+            "assigned_to_id": '"tasks_task"."assigned_to_id"',
+            "owner_id": '"tasks_task"."owner_id"',
+            "tags": '"tasks_task"."tags"',
+            "role_ids": """ARRAY(SELECT DISTINCT "projects_membership"."role_id"
+                                   FROM "projects_membership"
+                                  WHERE "projects_membership"."project_id" = "tasks_task"."project_id"
+                                    AND "projects_membership"."user_id" = "tasks_task"."assigned_to_id")""",
+        },
+        facets={
+            "statuses": Facet("status_id"),
+            "assigned_to": Facet("assigned_to_id"),
+            "owners": Facet("owner_id"),
+            "tags": Facet("tags", many=True, type=str),
+            "roles": Facet("role_ids", many=True),
+        }
+    )
+
     data = OrderedDict(
         [
-            ("statuses", _get_tasks_statuses(project, querysets["statuses"])),
-            ("assigned_to", _get_tasks_assigned_to(project, querysets["assigned_to"])),
-            ("owners", _get_tasks_owners(project, querysets["owners"])),
-            ("tags", _get_tasks_tags(project, querysets["tags"])),
-            ("roles", _get_tasks_roles(project, querysets["roles"])),
+            ("statuses", get_choices_filter_data(project.task_statuses.all(), counts["statuses"])),
+            ("assigned_to", get_users_filter_data(get_project_users(project), counts["assigned_to"],
+                                                  include_unassigned=True)),
+            ("owners", get_users_filter_data(get_project_users(project, include_system_users=True),
+                                             counts["owners"], only_used=True)),
+            ("tags", get_tags_filter_data(project, counts["tags"])),
+            ("roles", get_choices_filter_data(project.roles.all(), counts["roles"])),
         ]
     )
 
@@ -10,7 +10,6 @@ from django.db import transaction
 from django.db.models import Max
 
 from django.utils.translation import gettext as _
-from django.http import HttpResponse
 
 from taiga.base import filters as base_filters
 from taiga.base import exceptions as exc
@@ -33,6 +32,7 @@ from taiga.projects.notifications.mixins import AssignedUsersSignalMixin
 from taiga.projects.notifications.mixins import WatchedResourceMixin
 from taiga.projects.notifications.mixins import WatchersViewSetMixin
 from taiga.projects.occ import OCCResourceMixin
+from taiga.projects.services import csv_exports
 from taiga.projects.tagging.api import TaggedResourceMixin
 from taiga.projects.votes.mixins.viewsets import VotedResourceMixin
 from taiga.projects.votes.mixins.viewsets import VotersViewSetMixin
@@ -375,11 +375,7 @@ class UserStoryViewSet(AssignedUsersSignalMixin, OCCResourceMixin,
             return response.NotFound()
 
         project = get_object_or_error(Project, request.user, userstories_csv_uuid=uuid)
-        queryset = project.user_stories.all().order_by('ref')
-        data = services.userstories_to_csv(project, queryset)
-        csv_response = HttpResponse(data.getvalue(), content_type='application/csv; charset=utf-8')
-        csv_response['Content-Disposition'] = 'attachment; filename="userstories.csv"'
-        return csv_response
+        return csv_exports.get_csv_response(request, project, "userstories")
 
     @list_route(methods=["POST"])
     def bulk_create(self, request, **kwargs):
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2021-present Kaleidos INC
+
+from django.db import migrations
+
+
+# NOTE: This column and index are needed by taiga.searches.services. The column
+#       is generated by PostgreSQL, so it's filled for the existing rows when
+#       it's added and kept up to date on every write.
+ADD_SEARCH_VECTOR = """
+    ALTER TABLE userstories_userstory
+     ADD COLUMN search_vector tsvector
+      GENERATED ALWAYS AS (
+          setweight(to_tsvector('simple',
+                                coalesce(userstories_userstory.subject, '') || ' ' ||
+                                coalesce(userstories_userstory.ref::text, '')), 'A') ||
+          setweight(to_tsvector('simple', coalesce(inmutable_array_to_string(userstories_userstory.tags), '')), 'B') ||
+          setweight(to_tsvector('simple', coalesce(userstories_userstory.description, '')), 'C')
+      ) STORED;
+"""
+
+
+CREATE_INDEX = """
+    CREATE INDEX userstories_userstory_search_vector_idx
+              ON userstories_userstory
+           USING gin(search_vector);
+"""
+
+
+DROP_SEARCH_VECTOR = """
+    ALTER TABLE userstories_userstory DROP COLUMN IF EXISTS search_vector;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0033_text_search_indexes'),
+        ('userstories', '0021_auto_20201202_0850'),
+    ]
+
+    operations = [
+        migrations.RunSQL([ADD_SEARCH_VECTOR, CREATE_INDEX],
+                          [DROP_SEARCH_VECTOR]),
+    ]
@@ -7,17 +7,13 @@
 
 from typing import List, Optional
 
-import csv
 import io
 from collections import OrderedDict
-from operator import itemgetter
-from contextlib import closing
 
 from django.conf import settings
 from django.db import connection
 from django.db.models import Q
 from django.utils import timezone
-from django.utils.translation import gettext as _
 
 from psycopg2.extras import execute_values
 
@@ -25,17 +21,23 @@ from taiga.base.utils import db, text
 from taiga.celery import app
 from taiga.events import events
 from taiga.projects.history.services import take_snapshot
+from taiga.projects.history.services import take_snapshots_in_bulk
 from taiga.projects.models import Project, UserStoryStatus, Swimlane
 from taiga.projects.milestones.models import Milestone
+from taiga.projects.attachments.utils import attach_total_attachments
 from taiga.projects.notifications.utils import attach_watchers_to_queryset
 from taiga.projects.services import apply_order_updates
+from taiga.projects.services.filters import Facet, get_facets_counts
+from taiga.projects.services.filters import get_choices_filter_data, get_project_users
+from taiga.projects.services.filters import get_tags_filter_data, get_users_filter_data
 from taiga.projects.tasks.models import Task
 from taiga.projects.userstories.apps import connect_userstories_signals
 from taiga.projects.userstories.apps import disconnect_userstories_signals
+from taiga.projects.userstories.utils import attach_assigned_users_names, attach_epics_refs
+from taiga.projects.userstories.utils import attach_role_points_values, attach_tasks_refs
+from taiga.projects.userstories.utils import attach_total_points
 from taiga.projects.votes.utils import attach_total_voters_to_queryset
 from taiga.users.models import User
-from taiga.users.gravatar import get_gravatar_id
-from taiga.users.services import get_big_photo_url, get_photo_url
 
 from . import models
 
@@ -270,11 +272,9 @@ def _async_tasks_after_backlog_or_sprint_order_change(
         user = None
 
     # Take snapshots for user stories and their taks
-    for userstory in models.UserStory.objects.filter(id__in=userstories_ids):
-        take_snapshot(userstory, user=user)
-
-        for task in userstory.tasks.all():
-            take_snapshot(task, user=user)
+    userstories = models.UserStory.objects.filter(id__in=userstories_ids).prefetch_related("tasks")
+    take_snapshots_in_bulk([obj for userstory in userstories for obj in (userstory, *userstory.tasks.all())],
+                           user=user)
 
     # Check if milestones are open or closed after stories are moved
     for milestone in Milestone.objects.filter(id__in=milestones_ids):
@@ -392,10 +392,12 @@ def _async_tasks_after_kanban_order_change(userstories_ids, user_id):
     except User.DoesNotExist:
         user = None
 
-    for userstory in models.UserStory.objects.filter(id__in=userstories_ids):
+    userstories = list(models.UserStory.objects.filter(id__in=userstories_ids))
+    for userstory in userstories:
         recalculate_is_closed_for_userstory_and_its_milestone(userstory)
-        # Generate the history entity
-        take_snapshot(userstory, user=user)
+
+    # Generate the history entities
+    take_snapshots_in_bulk(userstories, user=user)
 
 
 def update_userstories_milestone_in_bulk(bulk_data: list, milestone: object):
@@ -530,6 +532,16 @@ def _recalculate_is_closed_for_milestone(milestone):
 
 def userstories_to_csv(project, queryset):
     csv_data = io.StringIO()
+    csv_data.writelines(iter_userstories_csv(project, queryset))
+    return csv_data
+
+
+def iter_userstories_csv(project, queryset):
+    """
+    Return an iterator over the lines of the CSV of the user stories of the
+    queryset. They are read in chunks, with their related data attached by
+    the query, so the CSV can be streamed in constant memory.
+    """
     fieldnames = [
         "id",
         "ref",
@@ -550,7 +562,7 @@ def userstories_to_csv(project, queryset):
         "swimlane",
     ]
 
-    roles = project.roles.filter(computable=True).order_by("slug")
+    roles = list(project.roles.filter(computable=True).order_by("slug"))
     for role in roles:
         fieldnames.append("{}-points".format(role.slug))
 
@@ -579,712 +591,217 @@ def userstories_to_csv(project, queryset):
         "epics",
     ]
 
-    custom_attrs = project.userstorycustomattributes.all()
+    custom_attrs = list(project.userstorycustomattributes.all())
     for custom_attr in custom_attrs:
         fieldnames.append(custom_attr.name)
 
-    queryset = queryset.prefetch_related(
-        "role_points",
-        "role_points__points",
-        "role_points__role",
-        "tasks",
-        "epics",
-        "attachments",
-        "custom_attributes_values",
-    )
     queryset = queryset.select_related(
         "milestone",
         "project",
         "status",
+        "swimlane",
         "owner",
         "assigned_to",
         "generated_from_issue",
         "generated_from_task",
+        "custom_attributes_values",
     )
 
+    queryset = attach_total_points(queryset)
+    queryset = attach_role_points_values(queryset)
+    queryset = attach_assigned_users_names(queryset)
+    queryset = attach_tasks_refs(queryset)
+    queryset = attach_epics_refs(queryset)
+    queryset = attach_total_attachments(queryset)
     queryset = attach_total_voters_to_queryset(queryset)
     queryset = attach_watchers_to_queryset(queryset)
 
-    writer = csv.DictWriter(csv_data, fieldnames=fieldnames)
-    writer.writeheader()
-    for us in queryset:
-        row = {
-            "id": us.id,
-            "ref": us.ref,
-            "subject": text.sanitize_csv_text_value(us.subject),
-            "description": text.sanitize_csv_text_value(us.description),
-            "sprint_id": us.milestone.id if us.milestone else None,
-            "sprint": (
-                text.sanitize_csv_text_value(us.milestone.name)
-                if us.milestone
-                else None
-            ),
-            "sprint_estimated_start": (
-                us.milestone.estimated_start if us.milestone else None
-            ),
-            "sprint_estimated_finish": (
-                us.milestone.estimated_finish if us.milestone else None
-            ),
-            "owner": us.owner.username if us.owner else None,
-            "owner_full_name": (
-                text.sanitize_csv_text_value(us.owner.get_full_name())
-                if us.owner
-                else None
-            ),
-            "assigned_to": us.assigned_to.username if us.assigned_to else None,
-            "assigned_to_full_name": (
-                text.sanitize_csv_text_value(us.assigned_to.get_full_name())
-                if us.assigned_to
-                else None
-            ),
-            "assigned_users": ",".join(
-                [assigned_user.username for assigned_user in us.assigned_users.all()]
-            ),
-            "assigned_users_full_name": text.sanitize_csv_text_value(
-                ",".join(
-                    [
-                        assigned_user.get_full_name()
-                        for assigned_user in us.assigned_users.all()
-                    ]
-                )
-            ),
-            "status": us.status.name if us.status else None,
-            "is_closed": us.is_closed,
-            "swimlane": us.swimlane.name if us.swimlane else None,
-            "backlog_order": us.backlog_order,
-            "sprint_order": us.sprint_order,
-            "kanban_order": us.kanban_order,
-            "created_date": us.created_date,
-            "modified_date": us.modified_date,
-            "finish_date": us.finish_date,
-            "client_requirement": us.client_requirement,
-            "team_requirement": us.team_requirement,
-            "attachments": us.attachments.count(),
-            "generated_from_issue": (
-                us.generated_from_issue.ref if us.generated_from_issue else None
-            ),
-            "generated_from_task": (
-                us.generated_from_task.ref if us.generated_from_task else None
-            ),
-            "from_task_ref": us.from_task_ref,
-            "external_reference": us.external_reference,
-            "tasks": ",".join([str(task.ref) for task in us.tasks.all()]),
-            "tags": ",".join(us.tags or []),
-            "watchers": us.watchers,
-            "voters": us.total_voters,
-            "due_date": us.due_date,
-            "due_date_reason": us.due_date_reason,
-            "epics": ",".join([str(epic.ref) for epic in us.epics.all()]),
-        }
-
-        us_role_points_by_role_id = {
-            us_rp.role.id: us_rp.points.value for us_rp in us.role_points.all()
-        }
-        for role in roles:
-            row["{}-points".format(role.slug)] = us_role_points_by_role_id.get(
-                role.id, 0
-            )
-
-        row["total-points"] = us.get_total_points()
-
-        for custom_attr in custom_attrs:
-            if not hasattr(us, "custom_attributes_values"):
-                continue
-            value = us.custom_attributes_values.attributes_values.get(
-                str(custom_attr.id), None
-            )
-            row[custom_attr.name] = text.sanitize_csv_text_value(value)
-
-        writer.writerow(row)
-
-    return csv_data
-
-
-#####################################################
-# Api filter data
-#####################################################
-
-
-def _get_userstories_statuses(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
+    rows = (
+        _get_userstory_csv_row(us, roles, custom_attrs)
+        for us in queryset.iterator(chunk_size=settings.CSV_EXPORT_CHUNK_SIZE)
     )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-     WITH "us_counters" AS (
-         SELECT DISTINCT "userstories_userstory"."status_id" "status_id",
-                         "userstories_userstory"."id" "us_id"
-                    FROM "userstories_userstory"
-              INNER JOIN "projects_project"
-                      ON ("userstories_userstory"."project_id" = "projects_project"."id")
-         LEFT OUTER JOIN "epics_relateduserstory"
-                      ON "userstories_userstory"."id" = "epics_relateduserstory"."user_story_id"
-         LEFT OUTER JOIN "userstories_userstory_assigned_users"
-                      ON "userstories_userstory"."id" = "userstories_userstory_assigned_users"."userstory_id"
-                   WHERE {where}
-            ),
-             "counters" AS (
-                  SELECT "status_id",
-                         COUNT("status_id") "count"
-                    FROM "us_counters"
-                GROUP BY "status_id"
-            )
-
-                 SELECT "projects_userstorystatus"."id",
-                        "projects_userstorystatus"."name",
-                        "projects_userstorystatus"."color",
-                        "projects_userstorystatus"."order",
-                        COALESCE("counters"."count", 0)
-                   FROM "projects_userstorystatus"
-        LEFT OUTER JOIN "counters"
-                     ON "counters"."status_id" = "projects_userstorystatus"."id"
-                  WHERE "projects_userstorystatus"."project_id" = %s
-               ORDER BY "projects_userstorystatus"."order";
-    """.format(
-        where=where
-    )
-
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id])
-        rows = cursor.fetchall()
-
-    result = []
-    for id, name, color, order, count in rows:
-        result.append(
-            {
-                "id": id,
-                "name": _(name),
-                "color": color,
-                "order": order,
-                "count": count,
-            }
-        )
-    return sorted(result, key=itemgetter("order"))
-
-
-def _get_userstories_assigned_to(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-     WITH "us_counters" AS (
-         SELECT DISTINCT "userstories_userstory"."assigned_to_id" "assigned_to_id",
-                         "userstories_userstory"."id" "us_id"
-                    FROM "userstories_userstory"
-              INNER JOIN "projects_project"
-                      ON ("userstories_userstory"."project_id" = "projects_project"."id")
-                INNER JOIN "projects_userstorystatus"
-                    ON ("userstories_userstory"."status_id" = "projects_userstorystatus"."id")
-         LEFT OUTER JOIN "epics_relateduserstory"
-                      ON "userstories_userstory"."id" = "epics_relateduserstory"."user_story_id"
-         LEFT OUTER JOIN "userstories_userstory_assigned_users"
-                      ON "userstories_userstory"."id" = "userstories_userstory_assigned_users"."userstory_id"
-                   WHERE {where}
-            ),
-
-            "counters" AS (
-                 SELECT "assigned_to_id",
-                        COUNT("assigned_to_id")
-                   FROM "us_counters"
-               GROUP BY "assigned_to_id"
-            )
-
-                 SELECT "projects_membership"."user_id" "user_id",
-                        "users_user"."full_name" "full_name",
-                        "users_user"."username" "username",
-                        COALESCE("counters".count, 0) "count"
-                   FROM "projects_membership"
-        LEFT OUTER JOIN "counters"
-                     ON ("projects_membership"."user_id" = "counters"."assigned_to_id")
-             INNER JOIN "users_user"
-                     ON ("projects_membership"."user_id" = "users_user"."id")
-                  WHERE "projects_membership"."project_id" = %s AND "projects_membership"."user_id" IS NOT NULL
-
-        -- unassigned userstories
-        UNION
-
-                 SELECT NULL "user_id",
-                        NULL "full_name",
-                        NULL "username",
-                        count(coalesce("assigned_to_id", -1)) "count"
-                   FROM "userstories_userstory"
-             INNER JOIN "projects_project"
-                     ON ("userstories_userstory"."project_id" = "projects_project"."id")
-             INNER JOIN "projects_userstorystatus"
-                    ON ("userstories_userstory"."status_id" = "projects_userstorystatus"."id")
-        LEFT OUTER JOIN "epics_relateduserstory"
-                     ON ("userstories_userstory"."id" = "epics_relateduserstory"."user_story_id")
-        LEFT OUTER JOIN "userstories_userstory_assigned_users"
-                      ON "userstories_userstory"."id" = "userstories_userstory_assigned_users"."userstory_id"
-                  WHERE {where} AND "userstories_userstory"."assigned_to_id" IS NULL
-               GROUP BY "assigned_to_id"
-    """.format(
-        where=where
-    )
-
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id] + where_params)
-        rows = cursor.fetchall()
-
-    result = []
-    none_valued_added = False
-    for id, full_name, username, count in rows:
-        result.append(
-            {
-                "id": id,
-                "full_name": full_name or username or "",
-                "count": count,
-            }
-        )
-
-        if id is None:
-            none_valued_added = True
-
-    # If there was no userstory with null assigned_to we manually add it
-    if not none_valued_added:
-        result.append(
-            {
-                "id": None,
-                "full_name": "",
-                "count": 0,
-            }
+    return text.iter_csv_lines(fieldnames, rows)
+
+
+def _get_userstory_csv_row(us, roles, custom_attrs):
+    assigned_users = us.assigned_users_names_attr or []
+    row = {
+        "id": us.id,
+        "ref": us.ref,
+        "subject": text.sanitize_csv_text_value(us.subject),
+        "description": text.sanitize_csv_text_value(us.description),
+        "sprint_id": us.milestone.id if us.milestone else None,
+        "sprint": (
+            text.sanitize_csv_text_value(us.milestone.name)
+            if us.milestone
+            else None
+        ),
+        "sprint_estimated_start": (
+            us.milestone.estimated_start if us.milestone else None
+        ),
+        "sprint_estimated_finish": (
+            us.milestone.estimated_finish if us.milestone else None
+        ),
+        "owner": us.owner.username if us.owner else None,
+        "owner_full_name": (
+            text.sanitize_csv_text_value(us.owner.get_full_name())
+            if us.owner
+            else None
+        ),
+        "assigned_to": us.assigned_to.username if us.assigned_to else None,
+        "assigned_to_full_name": (
+            text.sanitize_csv_text_value(us.assigned_to.get_full_name())
+            if us.assigned_to
+            else None
+        ),
+        "assigned_users": ",".join(
+            [username for username, full_name in assigned_users]
+        ),
+        "assigned_users_full_name": text.sanitize_csv_text_value(
+            ",".join([full_name for username, full_name in assigned_users])
+        ),
+        "status": us.status.name if us.status else None,
+        "is_closed": us.is_closed,
+        "swimlane": us.swimlane.name if us.swimlane else None,
+        "backlog_order": us.backlog_order,
+        "sprint_order": us.sprint_order,
+        "kanban_order": us.kanban_order,
+        "created_date": us.created_date,
+        "modified_date": us.modified_date,
+        "finish_date": us.finish_date,
+        "client_requirement": us.client_requirement,
+        "team_requirement": us.team_requirement,
+        "attachments": us.total_attachments,
+        "generated_from_issue": (
+            us.generated_from_issue.ref if us.generated_from_issue else None
+        ),
+        "generated_from_task": (
+            us.generated_from_task.ref if us.generated_from_task else None
+        ),
+        "from_task_ref": us.from_task_ref,
+        "external_reference": us.external_reference,
+        "tasks": ",".join([str(ref) for ref in us.tasks_refs_attr or []]),
+        "tags": ",".join(us.tags or []),
+        "watchers": us.watchers,
+        "voters": us.total_voters,
+        "due_date": us.due_date,
+        "due_date_reason": us.due_date_reason,
+        "epics": ",".join([str(ref) for ref in us.epics_refs_attr or []]),
+    }
+
+    role_points_values = {
+        int(role_id): value for role_id, value in us.role_points_values_attr or []
+    }
+    for role in roles:
+        row["{}-points".format(role.slug)] = role_points_values.get(
+            role.id, 0
         )
 
-    return sorted(result, key=itemgetter("full_name"))
+    row["total-points"] = us.total_points_attr
 
-
-def _get_userstories_assigned_users(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-     WITH "us_counters" AS (
-         SELECT DISTINCT COALESCE("userstories_userstory_assigned_users"."user_id",
-            "userstories_userstory"."assigned_to_id") as "assigned_user_id",
-                "userstories_userstory"."id" "us_id"
-                    FROM "userstories_userstory"
-              LEFT JOIN "userstories_userstory_assigned_users"
-                      ON "userstories_userstory_assigned_users"."userstory_id" = "userstories_userstory"."id"
-              INNER JOIN "projects_project"
-                      ON ("userstories_userstory"."project_id" = "projects_project"."id")
-                INNER JOIN "projects_userstorystatus"
-                    ON ("userstories_userstory"."status_id" = "projects_userstorystatus"."id")
-              LEFT OUTER JOIN "epics_relateduserstory"
-                      ON "userstories_userstory"."id" = "epics_relateduserstory"."user_story_id"
-                   WHERE {where}
-            ),
-
-            "counters" AS (
-                 SELECT "assigned_user_id",
-                        COUNT("assigned_user_id")
-                   FROM "us_counters"
-               GROUP BY "assigned_user_id"
-            )
-
-                 SELECT "projects_membership"."user_id" "user_id",
-                        "users_user"."full_name" "full_name",
-                        "users_user"."username" "username",
-                        COALESCE("counters".count, 0) "count",
-                        "users_user"."photo" "photo",
-                        "users_user"."email" "email"
-                   FROM "projects_membership"
-        LEFT OUTER JOIN "counters"
-                     ON ("projects_membership"."user_id" = "counters"."assigned_user_id")
-             INNER JOIN "users_user"
-                     ON ("projects_membership"."user_id" = "users_user"."id")
-                  WHERE "projects_membership"."project_id" = %s AND "projects_membership"."user_id" IS NOT NULL
-
-        -- unassigned userstories
-        UNION
-
-                 SELECT NULL "user_id",
-                        NULL "full_name",
-                        NULL "username",
-                        count(coalesce("assigned_to_id", -1)) "count",
-                        NULL "photo",
-                        NULL "email"
-                   FROM "userstories_userstory"
-             INNER JOIN "projects_project"
-                     ON ("userstories_userstory"."project_id" = "projects_project"."id")
-            INNER JOIN "projects_userstorystatus"
-                ON ("userstories_userstory"."status_id" = "projects_userstorystatus"."id")
-        LEFT OUTER JOIN "epics_relateduserstory"
-                     ON ("userstories_userstory"."id" = "epics_relateduserstory"."user_story_id")
-                  WHERE {where} AND "userstories_userstory"."id" NOT IN (
-                    SELECT "userstories_userstory_assigned_users"."userstory_id" FROM
-                      "userstories_userstory_assigned_users"
-                      WHERE "userstories_userstory_assigned_users"."userstory_id" = "userstories_userstory"."id"
-                  ) AND "userstories_userstory"."assigned_to_id" IS NULL
-               GROUP BY "username";
-    """.format(
-        where=where
-    )
-
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id] + where_params)
-        rows = cursor.fetchall()
-
-    result = []
-    none_valued_added = False
-    for id, full_name, username, count, photo, email in rows:
-        result.append(
-            {
-                "id": id,
-                "full_name": full_name or username or "",
-                "count": count,
-                "photo": get_photo_url(photo),
-                "big_photo": get_big_photo_url(photo),
-                "gravatar_id": get_gravatar_id(email) if email else None,
-            }
+    for custom_attr in custom_attrs:
+        if not hasattr(us, "custom_attributes_values"):
+            continue
+        value = us.custom_attributes_values.attributes_values.get(
+            str(custom_attr.id), None
         )
+        row[custom_attr.name] = text.sanitize_csv_text_value(value)
 
-        if id is None:
-            none_valued_added = True
+    return row
 
-    # If there was no userstory with null assigned_to we manually add it
-    if not none_valued_added:
-        result.append(
-            {
-                "id": None,
-                "full_name": "",
-                "count": 0,
-                "photo": None,
-                "big_photo": None,
-                "gravatar_id": None,
-            }
-        )
 
-    return sorted(result, key=itemgetter("full_name"))
+#####################################################
+# Api filter data
+#####################################################
 
 
-def _get_userstories_owners(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-     WITH "us_counters" AS(
-         SELECT DISTINCT "userstories_userstory"."owner_id" "owner_id",
-                         "userstories_userstory"."id" "us_id"
-                    FROM "userstories_userstory"
-              INNER JOIN "projects_project"
-                      ON ("userstories_userstory"."project_id" = "projects_project"."id")
-                INNER JOIN "projects_userstorystatus"
-                    ON ("userstories_userstory"."status_id" = "projects_userstorystatus"."id")
-         LEFT OUTER JOIN "epics_relateduserstory"
-                      ON ("userstories_userstory"."id" = "epics_relateduserstory"."user_story_id")
-         LEFT OUTER JOIN "userstories_userstory_assigned_users"
-                      ON "userstories_userstory"."id" = "userstories_userstory_assigned_users"."userstory_id"
-                   WHERE {where}
-            ),
-
-            "counters" AS (
-                 SELECT "owner_id",
-                        COUNT("owner_id")
-                   FROM "us_counters"
-               GROUP BY "owner_id"
-            )
-
-                 SELECT "projects_membership"."user_id" "user_id",
-                        "users_user"."full_name",
-                        "users_user"."username",
-                        COALESCE("counters".count, 0) "count",
-                        "users_user"."photo" "photo",
-                        "users_user"."email" "email"
-                   FROM "projects_membership"
-        LEFT OUTER JOIN "counters"
-                     ON ("projects_membership"."user_id" = "counters"."owner_id")
-             INNER JOIN "users_user"
-                     ON ("projects_membership"."user_id" = "users_user"."id")
-                  WHERE "projects_membership"."project_id" = %s AND "projects_membership"."user_id" IS NOT NULL
-
-        -- System users
-                  UNION
-
-                 SELECT "users_user"."id" "user_id",
-                        "users_user"."full_name" "full_name",
-                        "users_user"."username" "username",
-                        COALESCE("counters"."count", 0) "count",
-                        NULL "photo",
-                        NULL "email"
-                   FROM "users_user"
-        LEFT OUTER JOIN "counters"
-                     ON ("users_user"."id" = "counters"."owner_id")
-                  WHERE ("users_user"."is_system" IS TRUE)
-    """.format(
-        where=where
+def get_userstories_filters_data(project, querysets):
+    """
+    Given a project and an userstories queryset, return a simple data structure
+    of all possible filters for the userstories in the queryset.
+    """
+    counts = get_facets_counts(
+        project,
+        querysets,
+        table="userstories_userstory",
+        joins=[
+            """INNER JOIN "projects_project"
+                       ON ("userstories_userstory"."project_id" = "projects_project"."id")""",
+            """LEFT OUTER JOIN "projects_userstorystatus"
+                            ON ("userstories_userstory"."status_id" = "projects_userstorystatus"."id")""",
+            """LEFT OUTER JOIN "epics_relateduserstory"
+                            ON ("userstories_userstory"."id" = "epics_relateduserstory"."user_story_id")""",
+            """LEFT OUTER JOIN "userstories_userstory_assigned_users"
+                            ON ("userstories_userstory"."id" = "userstories_userstory_assigned_users"."userstory_id")""",
+        ],
+        columns={
+            "status_id": '"userstories_userstory"."status_id"',
+            "assigned_to_id": '"userstories_userstory"."assigned_to_id"',
+            "assigned_user_ids": """array_agg(DISTINCT COALESCE("userstories_userstory_assigned_users"."user_id",
+                                                               "userstories_userstory"."assigned_to_id"))""",
+            "owner_id": '"userstories_userstory"."owner_id"',
+            "tags": '"userstories_userstory"."tags"',
+            "epic_ids": 'array_agg(DISTINCT "epics_relateduserstory"."epic_id")',
+            "role_ids": """ARRAY(SELECT DISTINCT "projects_membership"."role_id"
+                                   FROM "projects_membership"
+                                  WHERE "projects_membership"."project_id" = "userstories_userstory"."project_id"
+                                    AND ("projects_membership"."user_id" = "userstories_userstory"."assigned_to_id"
+                                         OR "projects_membership"."user_id" = ANY(
+                                             array_agg("userstories_userstory_assigned_users"."user_id"))))""",
+        },
+        facets={
+            "statuses": Facet("status_id"),
+            "assigned_to": Facet("assigned_to_id"),
+            "assigned_users": Facet("assigned_user_ids", many=True),
+            "owners": Facet("owner_id"),
+            "tags": Facet("tags", many=True, type=str),
+            "epics": Facet("epic_ids", many=True),
+            "roles": Facet("role_ids", many=True),
+        }
     )
 
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id])
-        rows = cursor.fetchall()
+    users = get_project_users(project)
 
-    result = []
-    for id, full_name, username, count, photo, email in rows:
-        if count > 0:
-            result.append(
-                {
-                    "id": id,
-                    "full_name": full_name or username or "",
-                    "count": count,
-                    "photo": get_photo_url(photo),
-                    "big_photo": get_big_photo_url(photo),
-                    "gravatar_id": get_gravatar_id(email) if email else None,
-                }
-            )
-    return sorted(result, key=itemgetter("full_name"))
-
-
-def _get_userstories_tags(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-           WITH "userstories_tags" AS (
-                   SELECT "tag",
-                          COUNT("tag") "counter"
-                     FROM (
-                      SELECT DISTINCT "userstories_userstory"."id" "us_id",
-                                       UNNEST("userstories_userstory"."tags") "tag"
-                                 FROM "userstories_userstory"
-                        INNER JOIN "projects_project"
-                            ON ("userstories_userstory"."project_id" = "projects_project"."id")
-                        INNER JOIN "projects_userstorystatus"
-                            ON ("userstories_userstory"."status_id" = "projects_userstorystatus"."id")
-                        LEFT OUTER JOIN "epics_relateduserstory"
-                            ON ("userstories_userstory"."id" = "epics_relateduserstory"."user_story_id")
-                        LEFT OUTER JOIN "userstories_userstory_assigned_users"
-                            ON "userstories_userstory"."id" = "userstories_userstory_assigned_users"."userstory_id"
-                                WHERE {where}
-                          ) "tags"
-                    GROUP BY "tag"),
-
-                "project_tags" AS (
-                       SELECT reduce_dim("tags_colors") "tag_color"
-                         FROM "projects_project"
-                        WHERE "id"=%s)
-
-         SELECT "tag_color"[1] "tag",
-                "tag_color"[2] "color",
-                COALESCE("userstories_tags"."counter", 0) "counter"
-           FROM "project_tags"
-LEFT OUTER JOIN "userstories_tags"
-             ON "project_tags"."tag_color"[1] = "userstories_tags"."tag"
-       ORDER BY "tag"
-    """.format(
-        where=where
+    data = OrderedDict(
+        [
+            ("statuses", get_choices_filter_data(project.us_statuses.all(), counts["statuses"])),
+            ("assigned_to", get_users_filter_data(users, counts["assigned_to"], include_unassigned=True)),
+            ("assigned_users", get_users_filter_data(users, counts["assigned_users"],
+                                                     include_unassigned=True, include_photos=True)),
+            ("owners", get_users_filter_data(get_project_users(project, include_system_users=True),
+                                             counts["owners"], only_used=True, include_photos=True)),
+            ("tags", get_tags_filter_data(project, counts["tags"])),
+            ("epics", _get_userstories_epics_filter_data(project, counts["epics"])),
+            ("roles", get_choices_filter_data(project.roles.all(), counts["roles"])),
+        ]
     )
 
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id])
-        rows = cursor.fetchall()
-
-    result = []
-    for name, color, count in rows:
-        result.append(
-            {
-                "name": name,
-                "color": color,
-                "count": count,
-            }
-        )
-    return sorted(result, key=itemgetter("name"))
-
-
-def _get_userstories_epics(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-    extra_sql = """
-       WITH "counters" AS (
-               SELECT "epics_relateduserstory"."epic_id" AS "epic_id",
-                      count("epics_relateduserstory"."id") AS "counter"
-                 FROM "epics_relateduserstory"
-           INNER JOIN "userstories_userstory"
-                   ON ("userstories_userstory"."id" = "epics_relateduserstory"."user_story_id")
-           INNER JOIN "projects_project"
-                   ON ("userstories_userstory"."project_id" = "projects_project"."id")
-            INNER JOIN "projects_userstorystatus"
-                    ON ("userstories_userstory"."status_id" = "projects_userstorystatus"."id")
-            LEFT OUTER JOIN "userstories_userstory_assigned_users"
-                ON "userstories_userstory"."id" = "userstories_userstory_assigned_users"."userstory_id"
-                WHERE {where}
-             GROUP BY "epics_relateduserstory"."epic_id"
-       )
-
-         -- User stories with no epics (return results only if there are userstories)
-               SELECT NULL AS "id",
-                      NULL AS "ref",
-                      NULL AS "subject",
-                      0 AS "order",
-                      count(COALESCE("epics_relateduserstory"."epic_id", -1)) AS "counter"
-                 FROM "userstories_userstory"
-      LEFT OUTER JOIN "epics_relateduserstory"
-                   ON ("epics_relateduserstory"."user_story_id" = "userstories_userstory"."id")
-           INNER JOIN "projects_project"
-                   ON ("userstories_userstory"."project_id" = "projects_project"."id")
-            INNER JOIN "projects_userstorystatus"
-                ON ("userstories_userstory"."status_id" = "projects_userstorystatus"."id")
-         LEFT OUTER JOIN "userstories_userstory_assigned_users"
-                      ON "userstories_userstory"."id" = "userstories_userstory_assigned_users"."userstory_id"
-                WHERE {where} AND "epics_relateduserstory"."epic_id" IS NULL
-             GROUP BY "epics_relateduserstory"."epic_id"
-
-                UNION
-
-               SELECT "epics_epic"."id" AS "id",
-                      "epics_epic"."ref" AS "ref",
-                      "epics_epic"."subject" AS "subject",
-                      "epics_epic"."epics_order" AS "order",
-                      COALESCE("counters"."counter", 0) AS "counter"
-                 FROM "epics_epic"
-      LEFT OUTER JOIN "counters"
-                   ON ("counters"."epic_id" = "epics_epic"."id")
-                WHERE "epics_epic"."project_id" = %s
-        """.format(
-        where=where
-    )
+    return data
 
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + where_params + [project.id])
-        rows = cursor.fetchall()
 
+def _get_userstories_epics_filter_data(project, counts):
     result = []
-    for id, ref, subject, order, count in rows:
+    for id, ref, subject, order in project.epics.values_list("id", "ref", "subject", "epics_order"):
         result.append(
             {
                 "id": id,
                 "ref": ref,
                 "subject": subject,
                 "order": order,
-                "count": count,
-            }
-        )
-
-    result = sorted(result, key=lambda k: (k["order"], k["id"] or 0))
-
-    # Add row when there is no user stories with no epics
-    if result == [] or result[0]["id"] is not None:
-        result.insert(
-            0,
-            {
-                "id": None,
-                "ref": None,
-                "subject": None,
-                "order": 0,
-                "count": 0,
-            },
-        )
-    return result
-
-
-def _get_userstories_roles(project, queryset):
-    compiler = connection.ops.compiler(queryset.query.compiler)(
-        queryset.query, connection, None
-    )
-    queryset_where_tuple = queryset.query.where.as_sql(compiler, connection)
-    where = queryset_where_tuple[0]
-    where_params = queryset_where_tuple[1]
-
-    extra_sql = """
-     WITH "us_counters" AS (
-         SELECT DISTINCT "userstories_userstory"."status_id" "status_id",
-                         "userstories_userstory"."id" "us_id",
-                         "projects_membership"."role_id" "role_id"
-                    FROM "userstories_userstory"
-              INNER JOIN "projects_project"
-                      ON ("userstories_userstory"."project_id" = "projects_project"."id")
-            INNER JOIN "projects_userstorystatus"
-                ON ("userstories_userstory"."status_id" = "projects_userstorystatus"."id")
-         LEFT OUTER JOIN "epics_relateduserstory"
-                      ON "userstories_userstory"."id" = "epics_relateduserstory"."user_story_id"
-         LEFT OUTER JOIN "userstories_userstory_assigned_users"
-                      ON "userstories_userstory_assigned_users"."userstory_id" = "userstories_userstory"."id"
-         LEFT OUTER JOIN "projects_membership"
-                      ON "projects_membership"."user_id" = "userstories_userstory"."assigned_to_id"
-                      OR "projects_membership"."user_id" = "userstories_userstory_assigned_users"."user_id"
-                   WHERE {where}
-            ),
-             "counters" AS (
-                  SELECT "role_id" as "role_id",
-                         COUNT("role_id") "count"
-                    FROM "us_counters"
-                GROUP BY "role_id"
-            )
-
-                 SELECT "users_role"."id",
-                        "users_role"."name",
-                        "users_role"."order",
-                        COALESCE("counters"."count", 0)
-                   FROM "users_role"
-        LEFT OUTER JOIN "counters"
-                     ON "counters"."role_id" = "users_role"."id"
-                  WHERE "users_role"."project_id" = %s
-               ORDER BY "users_role"."order";
-    """.format(
-        where=where
-    )
-
-    with closing(connection.cursor()) as cursor:
-        cursor.execute(extra_sql, where_params + [project.id])
-        rows = cursor.fetchall()
-
-    result = []
-    for id, name, order, count in rows:
-        result.append(
-            {
-                "id": id,
-                "name": _(name),
-                "color": None,
-                "order": order,
-                "count": count,
+                "count": counts.get(id, 0),
             }
         )
-    return sorted(result, key=itemgetter("order"))
-
+    result = sorted(result, key=lambda k: (k["order"], k["id"]))
 
-def get_userstories_filters_data(project, querysets):
-    """
-    Given a project and an userstories queryset, return a simple data structure
-    of all possible filters for the userstories in the queryset.
-    """
-    data = OrderedDict(
-        [
-            ("statuses", _get_userstories_statuses(project, querysets["statuses"])),
-            (
-                "assigned_to",
-                _get_userstories_assigned_to(project, querysets["assigned_to"]),
-            ),
-            (
-                "assigned_users",
-                _get_userstories_assigned_users(project, querysets["assigned_users"]),
-            ),
-            ("owners", _get_userstories_owners(project, querysets["owners"])),
-            ("tags", _get_userstories_tags(project, querysets["tags"])),
-            ("epics", _get_userstories_epics(project, querysets["epics"])),
-            ("roles", _get_userstories_roles(project, querysets["roles"])),
-        ]
+    # User stories with no epics
+    result.insert(
+        0,
+        {
+            "id": None,
+            "ref": None,
+            "subject": None,
+            "order": 0,
+            "count": counts.get(None, 0),
+        },
     )
-
-    return data
+    return result
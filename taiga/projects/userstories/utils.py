@@ -188,3 +188,85 @@ def attach_assigned_users(queryset, as_field="assigned_users_attr"):
     sql = sql.format(tbl=model._meta.db_table)
     queryset = queryset.extra(select={as_field: sql})
     return queryset
+
+
+def attach_role_points_values(queryset, as_field="role_points_values_attr"):
+    """Attach the pairs [role id, points value] as array column to each object of the queryset.
+
+    :param queryset: A Django user stories queryset object.
+    :param as_field: Attach the values as an attribute with this name.
+
+    :return: Queryset object with the additional `as_field` field.
+    """
+    model = queryset.model
+    sql = """SELECT array_agg(ARRAY[userstories_rolepoints.role_id, projects_points.value])
+                    FROM userstories_rolepoints
+                    INNER JOIN projects_points ON userstories_rolepoints.points_id = projects_points.id
+                    WHERE userstories_rolepoints.user_story_id = {tbl}.id"""
+
+    sql = sql.format(tbl=model._meta.db_table)
+    queryset = queryset.extra(select={as_field: sql})
+    return queryset
+
+
+def attach_assigned_users_names(queryset, as_field="assigned_users_names_attr"):
+    """Attach the username and full name of the assigned users as json column to each
+    object of the queryset.
+
+    :param queryset: A Django user stories queryset object.
+    :param as_field: Attach the names as an attribute with this name.
+
+    :return: Queryset object with the additional `as_field` field.
+    """
+    model = queryset.model
+    sql = """SELECT json_agg(json_build_array(users_user.username,
+                                              COALESCE(NULLIF(users_user.full_name, ''),
+                                                       NULLIF(users_user.username, ''),
+                                                       users_user.email))
+                             ORDER BY users_user.username)
+                    FROM userstories_userstory_assigned_users
+                    INNER JOIN users_user ON userstories_userstory_assigned_users.user_id = users_user.id
+                    WHERE userstories_userstory_assigned_users.userstory_id = {tbl}.id"""
+
+    sql = sql.format(tbl=model._meta.db_table)
+    queryset = queryset.extra(select={as_field: sql})
+    return queryset
+
+
+def attach_tasks_refs(queryset, as_field="tasks_refs_attr"):
+    """Attach the refs of the tasks as array column to each object of the queryset.
+
+    :param queryset: A Django user stories queryset object.
+    :param as_field: Attach the refs as an attribute with this name.
+
+    :return: Queryset object with the additional `as_field` field.
+    """
+    model = queryset.model
+    sql = """SELECT array_agg(tasks_task.ref ORDER BY tasks_task.created_date, tasks_task.ref)
+                    FROM tasks_task
+                    WHERE tasks_task.user_story_id = {tbl}.id"""
+
+    sql = sql.format(tbl=model._meta.db_table)
+    queryset = queryset.extra(select={as_field: sql})
+    return queryset
+
+
+def attach_epics_refs(queryset, as_field="epics_refs_attr"):
+    """Attach the refs of the epics as array column to each object of the queryset.
+
+    :param queryset: A Django user stories queryset object.
+    :param as_field: Attach the refs as an attribute with this name.
+
+    :return: Queryset object with the additional `as_field` field.
+    """
+    model = queryset.model
+    sql = """SELECT array_agg(epics_epic.ref ORDER BY projects_project.name, projects_project.id,
+                                                      epics_epic.epics_order, epics_epic.ref)
+                    FROM epics_relateduserstory
+                    INNER JOIN epics_epic ON epics_relateduserstory.epic_id = epics_epic.id
+                    INNER JOIN projects_project ON epics_epic.project_id = projects_project.id
+                    WHERE epics_relateduserstory.user_story_id = {tbl}.id"""
+
+    sql = sql.format(tbl=model._meta.db_table)
+    queryset = queryset.extra(select={as_field: sql})
+    return queryset
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2021-present Kaleidos INC
+
+from django.db import migrations
+
+
+# NOTE: This column and index are needed by taiga.searches.services. The column
+#       is generated by PostgreSQL, so it's filled for the existing rows when
+#       it's added and kept up to date on every write.
+ADD_SEARCH_VECTOR = """
+    ALTER TABLE wiki_wikipage
+     ADD COLUMN search_vector tsvector
+      GENERATED ALWAYS AS (
+          setweight(to_tsvector('simple', coalesce(wiki_wikipage.slug, '')), 'A') ||
+          setweight(to_tsvector('simple', coalesce(wiki_wikipage.content, '')), 'B')
+      ) STORED;
+"""
+
+
+CREATE_INDEX = """
+    CREATE INDEX wiki_wikipage_search_vector_idx
+              ON wiki_wikipage
+           USING gin(search_vector);
+"""
+
+
+DROP_SEARCH_VECTOR = """
+    ALTER TABLE wiki_wikipage DROP COLUMN IF EXISTS search_vector;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wiki', '0005_auto_20161201_1628'),
+    ]
+
+    operations = [
+        migrations.RunSQL([ADD_SEARCH_VECTOR, CREATE_INDEX],
+                          [DROP_SEARCH_VECTOR]),
+    ]
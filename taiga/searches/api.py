@@ -5,10 +5,16 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
+import logging
+from concurrent import futures
+
 from django.apps import apps
+from django.db import connection
+from django.utils.translation import gettext as _
 
 from taiga.base.api import viewsets
 
+from taiga.base import exceptions as exc
 from taiga.base import response
 from taiga.base.api.utils import get_object_or_error
 from taiga.permissions.services import user_has_perm
@@ -17,76 +23,114 @@ from . import services
 from . import serializers
 
 
-from concurrent import futures
+logger = logging.getLogger(__name__)
+
 
 class SearchViewSet(viewsets.ViewSet):
+    # (result key, permission, search method name)
+    searches = (
+        ("epics", "view_epics", "_search_epics"),
+        ("userstories", "view_us", "_search_user_stories"),
+        ("tasks", "view_tasks", "_search_tasks"),
+        ("issues", "view_issues", "_search_issues"),
+        ("wikipages", "view_wiki_pages", "_search_wiki_pages"),
+    )
+
     def list(self, request, **kwargs):
         text = request.QUERY_PARAMS.get('text', "")
         project_id = request.QUERY_PARAMS.get('project', None)
+        types = self._get_types(request.QUERY_PARAMS.get('types', None))
+        limit = self._get_limit(request.QUERY_PARAMS.get('limit', None))
 
         project = self._get_project(project_id)
 
+        searches = [(result_key, getattr(self, method_name))
+                    for result_key, permission, method_name in self.searches
+                    if result_key in types and user_has_perm(request.user, permission, project)]
+
         result = {}
-        with futures.ThreadPoolExecutor(max_workers=4) as executor:
-            futures_list = []
-            if user_has_perm(request.user, "view_epics", project):
-                epics_future = executor.submit(self._search_epics, project, text)
-                epics_future.result_key = "epics"
-                futures_list.append(epics_future)
-            if user_has_perm(request.user, "view_us", project):
-                uss_future = executor.submit(self._search_user_stories, project, text)
-                uss_future.result_key = "userstories"
-                futures_list.append(uss_future)
-            if user_has_perm(request.user, "view_tasks", project):
-                tasks_future = executor.submit(self._search_tasks, project, text)
-                tasks_future.result_key = "tasks"
-                futures_list.append(tasks_future)
-            if user_has_perm(request.user, "view_issues", project):
-                issues_future = executor.submit(self._search_issues, project, text)
-                issues_future.result_key = "issues"
-                futures_list.append(issues_future)
-            if user_has_perm(request.user, "view_wiki_pages", project):
-                wiki_pages_future = executor.submit(self._search_wiki_pages, project, text)
-                wiki_pages_future.result_key = "wikipages"
-                futures_list.append(wiki_pages_future)
-
-            for future in futures.as_completed(futures_list):
-                data = []
-                try:
-                    data = future.result()
-                except Exception as exc:
-                    print('%s generated an exception: %s' % (future.result_key, exc))
-                finally:
-                    result[future.result_key] = data
+        if len(searches) == 1:
+            # Don't pay for a thread (and its db connection) to search a single type
+            result_key, search = searches[0]
+            result[result_key] = self._run_search(result_key, search, project, text, limit)
+        elif searches:
+            with futures.ThreadPoolExecutor(max_workers=len(searches)) as executor:
+                futures_list = []
+                for result_key, search in searches:
+                    future = executor.submit(self._run_search_in_thread, result_key, search, project, text, limit)
+                    future.result_key = result_key
+                    futures_list.append(future)
+
+                for future in futures.as_completed(futures_list):
+                    result[future.result_key] = future.result()
 
         result["count"] = sum(map(lambda x: len(x), result.values()))
         return response.Ok(result)
 
+    def _get_types(self, types):
+        valid_types = [result_key for result_key, permission, method_name in self.searches]
+        if not types:
+            return valid_types
+
+        types = [t.strip() for t in types.split(",") if t.strip()]
+        invalid_types = [t for t in types if t not in valid_types]
+        if invalid_types:
+            raise exc.BadRequest(_("Invalid search types: {}. Valid values are: {}.").format(
+                ", ".join(invalid_types), ", ".join(valid_types)))
+        return types
+
+    def _get_limit(self, limit):
+        if limit is None:
+            return services.MAX_RESULTS
+
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise exc.BadRequest(_("Invalid limit value."))
+
+        if limit < 1:
+            raise exc.BadRequest(_("Invalid limit value."))
+        return min(limit, services.MAX_RESULTS)
+
+    def _run_search(self, result_key, search, project, text, limit):
+        try:
+            return search(project, text, limit)
+        except Exception:
+            logger.exception("Error searching %s", result_key)
+            return []
+
+    def _run_search_in_thread(self, result_key, search, project, text, limit):
+        try:
+            return self._run_search(result_key, search, project, text, limit)
+        finally:
+            # Every thread opens its own db connection; close it instead of leaking it
+            connection.close()
+
     def _get_project(self, project_id):
         project_model = apps.get_model("projects", "Project")
         return get_object_or_error(project_model, self.request.user, pk=project_id)
 
-    def _search_epics(self, project, text):
-        queryset = services.search_epics(project, text)
+    def _search_epics(self, project, text, limit):
+        queryset = services.search_epics(project, text, limit)
         serializer = serializers.EpicSearchResultsSerializer(queryset, many=True)
         return serializer.data
 
-    def _search_user_stories(self, project, text):
-        queryset = services.search_user_stories(project, text)
+    def _search_user_stories(self, project, text, limit):
+        queryset = services.search_user_stories(project, text, limit)
         serializer = serializers.UserStorySearchResultsSerializer(queryset, many=True)
         return serializer.data
 
-    def _search_tasks(self, project, text):
-        queryset = services.search_tasks(project, text)
+    def _search_tasks(self, project, text, limit):
+        queryset = services.search_tasks(project, text, limit)
         serializer = serializers.TaskSearchResultsSerializer(queryset, many=True)
         return serializer.data
 
-    def _search_issues(self, project, text):
-        queryset = services.search_issues(project, text)
+    def _search_issues(self, project, text, limit):
+        queryset = services.search_issues(project, text, limit)
         serializer = serializers.IssueSearchResultsSerializer(queryset, many=True)
         return serializer.data
 
-    def _search_wiki_pages(self, project, text):
-        queryset = services.search_wiki_pages(project, text)
+    def _search_wiki_pages(self, project, text, limit):
+        queryset = services.search_wiki_pages(project, text, limit)
         serializer = serializers.WikiPageSearchResultsSerializer(queryset, many=True)
         return serializer.data
@@ -13,59 +13,51 @@ from taiga.projects.userstories.utils import attach_total_points
 MAX_RESULTS = getattr(settings, "SEARCHES_MAX_RESULTS", 150)
 
 
-def search_epics(project, text):
+def search_epics(project, text, limit=MAX_RESULTS):
     model = apps.get_model("epics", "Epic")
     queryset = model.objects.filter(project_id=project.pk)
     table = "epics_epic"
-    return _search_items(queryset, table, text)
+    return _search_items(queryset, table, text, limit)
 
 
-def search_user_stories(project, text):
+def search_user_stories(project, text, limit=MAX_RESULTS):
     model = apps.get_model("userstories", "UserStory")
-    queryset = model.objects.filter(project_id=project.pk)
+    queryset = model.objects.filter(project_id=project.pk).select_related("milestone")
+    queryset = attach_total_points(queryset)
     table = "userstories_userstory"
-    return _search_items(queryset, table, text)
+    return _search_items(queryset, table, text, limit)
 
 
-def search_tasks(project, text):
+def search_tasks(project, text, limit=MAX_RESULTS):
     model = apps.get_model("tasks", "Task")
     queryset = model.objects.filter(project_id=project.pk)
     table = "tasks_task"
-    return _search_items(queryset, table, text)
+    return _search_items(queryset, table, text, limit)
 
 
-def search_issues(project, text):
+def search_issues(project, text, limit=MAX_RESULTS):
     model = apps.get_model("issues", "Issue")
     queryset = model.objects.filter(project_id=project.pk)
     table = "issues_issue"
-    return _search_items(queryset, table, text)
+    return _search_items(queryset, table, text, limit)
 
 
-def search_wiki_pages(project, text):
+def search_wiki_pages(project, text, limit=MAX_RESULTS):
     model = apps.get_model("wiki", "WikiPage")
     queryset = model.objects.filter(project_id=project.pk)
     tsquery = "to_tsquery('simple', %s)"
-    tsvector = """
-        setweight(to_tsvector('simple', coalesce(wiki_wikipage.slug)), 'A') ||
-        setweight(to_tsvector('simple', coalesce(wiki_wikipage.content)), 'B')
-    """
+    tsvector = "wiki_wikipage.search_vector"
 
-    return _search_by_query(queryset, tsquery, tsvector, text)
+    return _search_by_query(queryset, tsquery, tsvector, text, limit)
 
 
-def _search_items(queryset, table, text):
+def _search_items(queryset, table, text, limit):
     tsquery = "to_tsquery('simple', %s)"
-    tsvector = """
-        setweight(to_tsvector('simple',
-                              coalesce({table}.subject) || ' ' ||
-                              coalesce({table}.ref)), 'A') ||
-        setweight(to_tsvector('simple', coalesce(inmutable_array_to_string({table}.tags))), 'B') ||
-        setweight(to_tsvector('simple', coalesce({table}.description)), 'C')
-    """.format(table=table)
-    return _search_by_query(queryset, tsquery, tsvector, text)
+    tsvector = "{table}.search_vector".format(table=table)
+    return _search_by_query(queryset, tsquery, tsvector, text, limit)
 
 
-def _search_by_query(queryset, tsquery, tsvector, text):
+def _search_by_query(queryset, tsquery, tsvector, text, limit):
     select = {
         "rank": "ts_rank({tsvector},{tsquery})".format(tsquery=tsquery,
                                                        tsvector=tsvector),
@@ -81,5 +73,4 @@ def _search_by_query(queryset, tsquery, tsvector, text):
                                   params=[to_tsquery(text)],
                                   order_by=order_by)
 
-    queryset = attach_total_points(queryset)
-    return queryset[:MAX_RESULTS]
+    return queryset[:limit]
@@ -20,6 +20,7 @@ from . import permissions
 
 class TimelineViewSet(ReadOnlyListViewSet):
     serializer_class = serializers.TimelineSerializer
+    cursor_ordering = ("-created", "-id")
 
     content_type = None
 
@@ -27,3 +27,17 @@ class TimelineAppConfig(AppConfig):
                                    sender=apps.get_model("projects", "Membership"))
         signals.post_save.connect(handlers.create_user_push_to_timeline,
                                   sender=get_user_model())
+
+        # Timeline visibility of the members
+        signals.post_save.connect(handlers.invalidate_membership_timeline_visibility,
+                                  sender=apps.get_model("projects", "Membership"),
+                                  dispatch_uid="invalidate_membership_timeline_visibility_on_save")
+        signals.post_delete.connect(handlers.invalidate_membership_timeline_visibility,
+                                    sender=apps.get_model("projects", "Membership"),
+                                    dispatch_uid="invalidate_membership_timeline_visibility_on_delete")
+        signals.post_save.connect(handlers.invalidate_role_timeline_visibility,
+                                  sender=apps.get_model("users", "Role"),
+                                  dispatch_uid="invalidate_role_timeline_visibility_on_save")
+        signals.pre_delete.connect(handlers.invalidate_role_timeline_visibility,
+                                   sender=apps.get_model("users", "Role"),
+                                   dispatch_uid="invalidate_role_timeline_visibility_on_delete")
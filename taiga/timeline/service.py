@@ -6,8 +6,11 @@
 # Copyright (c) 2021-present Kaleidos INC
 
 from django.apps import apps
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import BooleanField
 from django.db.models import Model
 from django.db.models.expressions import RawSQL
 from django.db.models import Q
@@ -43,9 +46,13 @@ def build_project_namespace(project: object):
     return "{0}:{1}".format("project", project.id)
 
 
-def _add_to_object_timeline(obj: object, instance: object, event_type: str, created_datetime: object,
-                            namespace: str="default", extra_data: dict={}):
-    assert isinstance(obj, Model), "obj must be a instance of Model"
+def _build_timeline_entries(targets, instance: object, event_type: str, created_datetime: object,
+                            extra_data: dict={}):
+    """
+    Build (without saving them) the timeline entries of an event for a list
+    of `(obj, namespace)` pairs. The data of the event is the same for all
+    of them so it is computed only once.
+    """
     assert isinstance(instance, Model), "instance must be a instance of Model"
     from .models import Timeline
     event_type_key = _get_impl_key_from_model(instance.__class__, event_type)
@@ -55,21 +62,39 @@ def _add_to_object_timeline(obj: object, instance: object, event_type: str, crea
     if hasattr(instance, "project"):
         project = instance.project
 
-    Timeline.objects.create(
-        content_object=obj,
-        namespace=namespace,
-        event_type=event_type_key,
-        project=project,
-        data=impl(instance, extra_data=extra_data),
-        data_content_type=ContentType.objects.get_for_model(instance.__class__),
-        created=created_datetime,
-    )
+    data = impl(instance, extra_data=extra_data)
+    data_content_type = ContentType.objects.get_for_model(instance.__class__)
+
+    entries = []
+    for obj, namespace in targets:
+        assert isinstance(obj, Model), "obj must be a instance of Model"
+        entries.append(Timeline(
+            content_object=obj,
+            namespace=namespace,
+            event_type=event_type_key,
+            project=project,
+            data=data,
+            data_content_type=data_content_type,
+            created=created_datetime,
+        ))
+    return entries
+
+
+def _save_timeline_entries(entries):
+    from .models import Timeline
+    Timeline.objects.bulk_create(entries)
+
+
+def _add_to_object_timeline(obj: object, instance: object, event_type: str, created_datetime: object,
+                            namespace: str="default", extra_data: dict={}):
+    _add_to_objects_timeline([obj], instance, event_type, created_datetime, namespace, extra_data)
 
 
 def _add_to_objects_timeline(objects, instance: object, event_type: str, created_datetime: object,
                              namespace: str="default", extra_data: dict={}):
-    for obj in objects:
-        _add_to_object_timeline(obj, instance, event_type, created_datetime, namespace, extra_data)
+    entries = _build_timeline_entries([(obj, namespace) for obj in objects], instance, event_type,
+                                      created_datetime, extra_data)
+    _save_timeline_entries(entries)
 
 
 def _push_to_timeline(objects, instance: object, event_type: str, created_datetime: object,
@@ -107,19 +132,18 @@ def push_to_timelines(project_id, user_id, obj_app_label, obj_model_name, obj_id
             return
 
         # Project timeline
-        _push_to_timeline(project, obj, event_type, created_datetime,
-                          namespace=build_project_namespace(project),
-                          extra_data=extra_data)
-
-        if refresh_totals:
-            project.refresh_totals()
+        targets = [(project, build_project_namespace(project))]
 
+        # Related people timelines
         if hasattr(obj, "get_related_people"):
-            related_people = obj.get_related_people()
+            user_namespace = build_user_namespace(user)
+            targets += [(person, user_namespace) for person in obj.get_related_people()]
+
+        _save_timeline_entries(_build_timeline_entries(targets, obj, event_type, created_datetime,
+                                                       extra_data=extra_data))
 
-            _push_to_timeline(related_people, obj, event_type, created_datetime,
-                              namespace=build_user_namespace(user),
-                              extra_data=extra_data)
+        if refresh_totals:
+            project.refresh_totals()
     else:
         # Actions not related with a project
         # - Me
@@ -140,20 +164,12 @@ def get_timeline(obj, namespace=None):
     else:
         timeline = timeline.filter(object_id=obj.pk)
 
-    timeline = timeline.order_by("-created")
+    timeline = timeline.order_by("-created", "-id")
     return timeline
 
 
-def filter_timeline_for_user(timeline, user, namespace=None):
-    # Superusers can see everything
-    if user.is_superuser:
-        return timeline
-
-    # Filtering entities from public projects or entities without project
-    tl_filter = Q(project__is_private=False) | Q(project=None)
-
-    # Filtering private project with some public parts
-    content_types = {
+def _get_timeline_content_types():
+    return {
         "view_project": ContentType.objects.get_by_natural_key("projects", "project"),
         "view_milestones": ContentType.objects.get_by_natural_key("milestones", "milestone"),
         "view_epics": ContentType.objects.get_by_natural_key("epics", "epic"),
@@ -164,6 +180,80 @@ def filter_timeline_for_user(timeline, user, namespace=None):
         "view_wiki_links": ContentType.objects.get_by_natural_key("wiki", "wikilink"),
     }
 
+
+def _get_timeline_visibility_cache_key(user_id):
+    return "timeline-visibility:{0}".format(user_id)
+
+
+def _build_timeline_visibility(user):
+    """
+    Build the timeline visibility descriptor of a user from the user's memberships:
+
+        {"admin_project_ids": [<projects where the user is admin>],
+         "project_ids": [<project id>, ...],
+         "content_type_ids": [<content type id>, ...]}
+
+    `project_ids` and `content_type_ids` are the columns of the
+    (project, content type) pairs the user can see in the rest of projects.
+    """
+    content_types = _get_timeline_content_types()
+    # There is no specific permission for seeing new memberships
+    membership_content_type = ContentType.objects.get_by_natural_key(app_label="projects", model="membership")
+
+    visibility = {"admin_project_ids": [], "project_ids": [], "content_type_ids": []}
+
+    membership_model = apps.get_model("projects", "Membership")
+    memberships = (membership_model.objects.filter(user_id=user.id)
+                                           .values_list("project_id", "is_admin", "role__permissions"))
+    for project_id, is_admin, permissions in memberships:
+        # Admin roles can see everything in a project
+        if is_admin:
+            visibility["admin_project_ids"].append(project_id)
+            continue
+
+        data_content_types = [content_types[p] for p in permissions or [] if p in content_types]
+        data_content_types.append(membership_content_type)
+        for data_content_type in data_content_types:
+            visibility["project_ids"].append(project_id)
+            visibility["content_type_ids"].append(data_content_type.id)
+
+    return visibility
+
+
+def get_timeline_visibility(user):
+    """
+    Get the (cached) timeline visibility descriptor of a user. The cache is
+    invalidated when the memberships or the roles of the user change.
+    """
+    key = _get_timeline_visibility_cache_key(user.id)
+    visibility = cache.get(key)
+    if visibility is None:
+        visibility = _build_timeline_visibility(user)
+        cache.set(key, visibility, timeout=settings.TIMELINE_VISIBILITY_CACHE_TIMEOUT)
+    return visibility
+
+
+def invalidate_timeline_visibility(user_ids):
+    keys = [_get_timeline_visibility_cache_key(user_id) for user_id in set(user_ids) if user_id is not None]
+    if not keys:
+        return
+
+    cache.delete_many(keys)
+    # Concurrent requests may have cached the data previous to the
+    # current transaction before it is committed.
+    connection.on_commit(lambda: cache.delete_many(keys))
+
+
+def filter_timeline_for_user(timeline, user, namespace=None):
+    # Superusers can see everything
+    if user.is_superuser:
+        return timeline
+
+    # Filtering entities from public projects or entities without project
+    tl_filter = Q(project__is_private=False) | Q(project=None)
+
+    # Filtering private project with some public parts
+    content_types = _get_timeline_content_types()
     for content_type_key, content_type in content_types.items():
         tl_filter |= Q(project__is_private=True,
                        project__anon_permissions__contains=[content_type_key],
@@ -177,15 +267,19 @@ def filter_timeline_for_user(timeline, user, namespace=None):
 
     # Filtering private projects where user is member
     if not user.is_anonymous:
-        for membership in user.cached_memberships:
-            # Admin roles can see everything in a project
-            if membership.is_admin:
-                tl_filter |= Q(project=membership.project)
-            else:
-                data_content_types = list(filter(None, [content_types.get(a, None) for a in
-                                                        membership.role.permissions]))
-                data_content_types.append(membership_content_type)
-                tl_filter |= Q(project=membership.project, data_content_type__in=data_content_types)
+        visibility = get_timeline_visibility(user)
+
+        if visibility["admin_project_ids"]:
+            tl_filter |= Q(project_id__in=visibility["admin_project_ids"])
+
+        if visibility["project_ids"]:
+            sql = """
+            (timeline_timeline.project_id, timeline_timeline.data_content_type_id) IN (
+                SELECT * FROM unnest(%s::integer[], %s::integer[])
+            )
+            """
+            tl_filter |= Q(RawSQL(sql, (visibility["project_ids"], visibility["content_type_ids"]),
+                                  output_field=BooleanField()))
 
     timeline = timeline.filter(tl_filter)
 
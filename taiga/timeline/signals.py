@@ -15,6 +15,7 @@ from django.db import connection
 from taiga.projects.history import services as history_services
 from taiga.projects.history.choices import HistoryType
 from taiga.timeline.service import (push_to_timelines,
+                                    invalidate_timeline_visibility,
                                     build_user_namespace,
                                     build_project_namespace,
                                     extract_user_info)
@@ -122,6 +123,14 @@ def delete_membership_push_to_timeline(sender, instance, **kwargs):
         _push_to_timelines(instance.project, instance.user, instance, "delete", created_datetime)
 
 
+def invalidate_membership_timeline_visibility(sender, instance, **kwargs):
+    invalidate_timeline_visibility([instance.user_id])
+
+
+def invalidate_role_timeline_visibility(sender, instance, **kwargs):
+    invalidate_timeline_visibility(instance.memberships.values_list("user_id", flat=True))
+
+
 def create_user_push_to_timeline(sender, instance, created, **kwargs):
     if created:
         project = None
@@ -28,6 +28,7 @@ from taiga.base.api.viewsets import ModelCrudViewSet
 from taiga.base.api.utils import get_object_or_404
 from taiga.base.filters import MembersFilterBackend
 from taiga.base.mails import mail_builder
+from taiga.timeline.service import invalidate_timeline_visibility
 from taiga.users.services import get_user_by_username_or_email
 from easy_thumbnails.source_generators import pil_image
 
@@ -469,6 +470,7 @@ class RolesViewSet(ArchivedByProjectMixin, BlockedByProjectMixin, ModelCrudViewS
             membership_model = apps.get_model("projects", "Membership")
             role_dest = get_object_or_404(self.model, project=obj.project, id=move_to)
             qs = membership_model.objects.filter(project_id=obj.project.pk, role=obj)
+            invalidate_timeline_visibility(qs.values_list("user_id", flat=True))
             qs.update(role=role_dest)
 
         super().pre_delete(obj)
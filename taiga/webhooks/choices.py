@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2021-present Kaleidos INC
+
+import enum
+from django.utils.translation import gettext_lazy as _
+
+
+class WebhookRetryStatus(enum.IntEnum):
+    pending = 1
+    dead = 2
+
+
+WEBHOOK_RETRY_STATUS_CHOICES = (
+    (WebhookRetryStatus.pending, _("Pending")),
+    (WebhookRetryStatus.dead, _("Dead")),
+)
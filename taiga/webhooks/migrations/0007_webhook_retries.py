@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:12
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+import taiga.base.db.models.fields.json
+import taiga.webhooks.choices
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0006_json_to_jsonb'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhook',
+            name='circuit_open_until',
+            field=models.DateTimeField(blank=True, default=None, null=True, verbose_name='circuit open until'),
+        ),
+        migrations.AddField(
+            model_name='webhook',
+            name='consecutive_failures',
+            field=models.IntegerField(default=0, verbose_name='consecutive failures'),
+        ),
+        migrations.CreateModel(
+            name='WebhookRetry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('request_data', taiga.base.db.models.fields.json.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='request data')),
+                ('attempts', models.IntegerField(default=0, verbose_name='attempts')),
+                ('next_attempt_at', models.DateTimeField(verbose_name='next attempt at')),
+                ('status', models.SmallIntegerField(choices=[(taiga.webhooks.choices.WebhookRetryStatus['pending'], 'Pending'), (taiga.webhooks.choices.WebhookRetryStatus['dead'], 'Dead')], default=taiga.webhooks.choices.WebhookRetryStatus['pending'], verbose_name='status')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('webhook', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retries', to='webhooks.webhook')),
+            ],
+            options={
+                'ordering': ['next_attempt_at', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='webhookretry',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='webhooks_we_status_334fd6_idx'),
+        ),
+    ]
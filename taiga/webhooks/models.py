@@ -10,6 +10,8 @@ from django.utils.translation import gettext_lazy as _
 
 from taiga.base.db.models.fields import JSONField
 
+from .choices import WEBHOOK_RETRY_STATUS_CHOICES, WebhookRetryStatus
+
 
 class Webhook(models.Model):
     project = models.ForeignKey(
@@ -23,6 +25,11 @@ class Webhook(models.Model):
                             verbose_name=_("name"))
     url = models.URLField(null=False, blank=False, verbose_name=_("URL"))
     key = models.TextField(null=False, blank=False, verbose_name=_("secret key"))
+    # Circuit breaker: the requests to the webhook are postponed while it's open
+    consecutive_failures = models.IntegerField(null=False, blank=False, default=0,
+                                               verbose_name=_("consecutive failures"))
+    circuit_open_until = models.DateTimeField(null=True, blank=True, default=None,
+                                              verbose_name=_("circuit open until"))
 
     class Meta:
         ordering = ['name', '-id']
@@ -47,3 +54,26 @@ class WebhookLog(models.Model):
 
     class Meta:
         ordering = ['-created', '-id']
+
+
+class WebhookRetry(models.Model):
+    webhook = models.ForeignKey(
+        Webhook,
+        null=False,
+        blank=False,
+        related_name="retries",
+        on_delete=models.CASCADE,
+    )
+    request_data = JSONField(null=False, blank=False, verbose_name=_("request data"))
+    attempts = models.IntegerField(null=False, blank=False, default=0, verbose_name=_("attempts"))
+    next_attempt_at = models.DateTimeField(null=False, blank=False, verbose_name=_("next attempt at"))
+    status = models.SmallIntegerField(choices=WEBHOOK_RETRY_STATUS_CHOICES, default=WebhookRetryStatus.pending,
+                                      verbose_name=_("status"))
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        indexes = [
+            # Used to select the retries ready to be sent
+            models.Index(fields=["status", "next_attempt_at"]),
+        ]
@@ -16,14 +16,7 @@ from . import tasks
 
 
 def _get_project_webhooks(project):
-    webhooks = []
-    for webhook in project.webhooks.all():
-        webhooks.append({
-            "id": webhook.pk,
-            "url": webhook.url,
-            "key": webhook.key,
-        })
-    return webhooks
+    return [(webhook.pk, webhook.url, webhook.key) for webhook in project.webhooks.all()]
 
 
 def on_new_history_entry(sender, instance, created, **kwargs):
@@ -42,32 +35,29 @@ def on_new_history_entry(sender, instance, created, **kwargs):
         return None
 
     webhooks = _get_project_webhooks(obj.project)
+    if not webhooks:
+        return None
 
     if instance.type == HistoryType.create:
-        task = tasks.create_webhook
-        extra_args = []
+        action = "create"
+        change = None
     elif instance.type == HistoryType.change:
-        task = tasks.change_webhook
-        extra_args = [instance]
+        action = "change"
+        change = instance
     elif instance.type == HistoryType.delete:
-        task = tasks.delete_webhook
-        extra_args = []
+        action = "delete"
+        change = None
 
     by = instance.owner
     date = timezone.now()
 
-    webhooks_args = []
-    for webhook in webhooks:
-        args = [webhook["id"], webhook["url"], webhook["key"], by, date, obj] + extra_args
-        webhooks_args.append(args)
-
-    connection.on_commit(lambda: _execute_task(task, webhooks_args))
-
+    # One task for all the webhooks, so the object is serialized only once
+    args = [webhooks, action, by, date, obj, change]
+    connection.on_commit(lambda: _execute_task(tasks.send_webhooks, args))
 
-def _execute_task(task, webhooks_args):
-    for webhook_args in webhooks_args:
 
-        if settings.CELERY_ENABLED:
-            task.delay(*webhook_args)
-        else:
-            task(*webhook_args)
+def _execute_task(task, args):
+    if settings.CELERY_ENABLED:
+        task.delay(*args)
+    else:
+        task(*args)
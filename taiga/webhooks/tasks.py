@@ -5,12 +5,25 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
+import datetime
 import hmac
 import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent import futures
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
 
 from taiga.base.api.renderers import UnicodeJSONRenderer
 from taiga.base.utils import json, urls
@@ -22,7 +35,13 @@ from .serializers import (EpicSerializer, EpicRelatedUserStorySerializer,
                           WikiPageSerializer, MilestoneSerializer,
                           HistoryEntrySerializer, UserSerializer)
 
-from .models import WebhookLog
+from .choices import WebhookRetryStatus
+from .models import Webhook, WebhookLog, WebhookRetry
+
+logger = logging.getLogger(__name__)
+
+# Only the last webhook logs traces of every webhook are required
+MAX_WEBHOOK_LOGS = 10
 
 
 def _serialize(obj):
@@ -55,13 +74,83 @@ def _generate_signature(data, key):
     return mac.hexdigest()
 
 
-def _remove_leftover_webhooklogs(webhook_id):
-    # Only the last ten webhook logs traces are required
-    # so remove the leftover
+_sessions = OrderedDict()
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+
+def _make_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@contextmanager
+def _get_session(url):
+    """
+    Get a session of the worker process for the host of an url, so the
+    connections (and TLS sessions) are kept alive between deliveries.
+
+    A session is only used by one thread at a time: every host keeps up to
+    `WEBHOOKS_MAX_WORKERS` idle sessions, and only the sessions of the last
+    `WEBHOOKS_SESSIONS_MAX_HOSTS` hosts used are kept (the others are
+    closed). The sessions inherited from a parent process (after a fork)
+    are discarded without closing them.
+    """
+    global _sessions_pid
+
+    parts = urlsplit(url)
+    session_key = (parts.scheme, parts.netloc)
+
+    with _sessions_lock:
+        pid = os.getpid()
+        if _sessions_pid != pid:
+            _sessions.clear()
+            _sessions_pid = pid
+
+        idle_sessions = _sessions.get(session_key, None)
+        session = idle_sessions.pop() if idle_sessions else None
+
+    if session is None:
+        session = _make_session()
+
+    try:
+        yield session
+    finally:
+        _release_session(session_key, session)
+
+
+def _release_session(session_key, session):
+    closed_sessions = []
+
+    with _sessions_lock:
+        idle_sessions = _sessions.setdefault(session_key, [])
+        _sessions.move_to_end(session_key)
+        if len(idle_sessions) < settings.WEBHOOKS_MAX_WORKERS:
+            idle_sessions.append(session)
+        else:
+            closed_sessions.append(session)
+
+        while len(_sessions) > settings.WEBHOOKS_SESSIONS_MAX_HOSTS:
+            _, evicted_sessions = _sessions.popitem(last=False)
+            closed_sessions.extend(evicted_sessions)
+
+    for closed_session in closed_sessions:
+        closed_session.close()
+
+
+def _prune_webhooklogs_without_celery(webhook_id):
+    # With celery the leftover logs are removed by the remove_leftover_webhooklogs
+    # beat task; without it, by every request
+    if settings.CELERY_ENABLED:
+        return
+
     ids = (WebhookLog.objects.filter(webhook_id=webhook_id)
-               .order_by("-id")
-               .values_list('id', flat=True)[10:])
-    WebhookLog.objects.filter(id__in=ids).delete()
+                             .order_by("-id")
+                             .values_list("id", flat=True)[MAX_WEBHOOK_LOGS:])
+    WebhookLog.objects.filter(id__in=list(ids)).delete()
 
 
 def _send_request(webhook_id, url, key, data):
@@ -86,83 +175,269 @@ def _send_request(webhook_id, url, key, data):
                                                     response_data="error-in-request: {}".format(str(e)),
                                                     response_headers={},
                                                     duration=0)
-            _remove_leftover_webhooklogs(webhook_id)
-
+            # Not sent, so it must be neither retried nor counted by the circuit breaker
+            webhook_log.invalid_url = True
+            _prune_webhooklogs_without_celery(webhook_id)
             return webhook_log
 
     request = requests.Request('POST', url, data=serialized_data, headers=headers)
     prepared_request = request.prepare()
 
-    with requests.Session() as session:
-        response = None
-        try:
-            response = session.send(prepared_request, allow_redirects=settings.WEBHOOKS_ALLOW_REDIRECTS)
+    response = None
+    try:
+        with _get_session(url) as session:
+            response = session.send(prepared_request,
+                                    allow_redirects=settings.WEBHOOKS_ALLOW_REDIRECTS,
+                                    timeout=(settings.WEBHOOKS_CONNECT_TIMEOUT, settings.WEBHOOKS_READ_TIMEOUT))
+
+        if not settings.WEBHOOKS_ALLOW_REDIRECTS and response.status_code in [301, 302, 303, 307, 308]:
+            raise RequestException("Redirects are not allowed")
+
+    except RequestException as e:
+        # Error sending the webhook
+        webhook_log = WebhookLog.objects.create(webhook_id=webhook_id,
+                                                url=url,
+                                                status=response.status_code if response else 0,
+                                                request_data=data,
+                                                request_headers=dict(prepared_request.headers),
+                                                response_data="error-in-request: {}".format(str(e)),
+                                                response_headers={},
+                                                duration=0)
+    else:
+        # Webhook was sent successfully
+
+        # response.content can be a not valid json so we encapsulate it
+        response_data = json.dumps({"content": response.text})
+        webhook_log = WebhookLog.objects.create(webhook_id=webhook_id, url=url,
+                                                status=response.status_code,
+                                                request_data=data,
+                                                request_headers=dict(prepared_request.headers),
+                                                response_data=response_data,
+                                                response_headers=dict(response.headers),
+                                                duration=response.elapsed.total_seconds())
+
+    _prune_webhooklogs_without_celery(webhook_id)
+    return webhook_log
 
-            if not settings.WEBHOOKS_ALLOW_REDIRECTS and response.status_code in [301, 302, 303, 307, 308]:
-                raise RequestException("Redirects are not allowed")
 
-        except RequestException as e:
-            # Error sending the webhook
-            webhook_log = WebhookLog.objects.create(webhook_id=webhook_id,
-                                                    url=url,
-                                                    status=response.status_code if response else 0,
-                                                    request_data=data,
-                                                    request_headers=dict(prepared_request.headers),
-                                                    response_data="error-in-request: {}".format(str(e)),
-                                                    response_headers={},
-                                                    duration=0)
+def _make_payload(action, by, date, obj, change=None):
+    data = {}
+    data['action'] = action
+    data['type'] = _get_type(obj)
+    data['by'] = UserSerializer(by).data
+    data['date'] = date
+    data['data'] = _serialize(obj)
+    if change is not None:
+        data['change'] = _serialize(change)
+    return data
+
+
+def _is_invalid_url(webhook_log):
+    # The requests to a private address or an invalid url are logged with
+    # status 0 too, but they would never succeed
+    return getattr(webhook_log, "invalid_url", False) is True
+
+
+def _is_retryable(status):
+    # Connection errors, rate limits and server errors
+    return status == 0 or status == 429 or status in range(500, 600)
+
+
+def _retries_enabled():
+    # The retries are only sent by the retry_webhooks celery beat task
+    return settings.CELERY_ENABLED and settings.WEBHOOKS_MAX_RETRIES > 0
+
+
+def _get_retry_delay(attempts):
+    delay = settings.WEBHOOKS_RETRY_BACKOFF * (2 ** (attempts - 1))
+    return datetime.timedelta(seconds=min(delay, settings.WEBHOOKS_RETRY_MAX_BACKOFF))
+
+
+def _update_circuit(webhook_id, failed):
+    """
+    Count the consecutive failed requests of a webhook and open its circuit
+    (for `WEBHOOKS_CIRCUIT_BREAKER_TIMEOUT` seconds) when they reach
+    `WEBHOOKS_CIRCUIT_BREAKER_THRESHOLD`.
+    """
+    if not failed:
+        (Webhook.objects.filter(id=webhook_id, consecutive_failures__gt=0)
+                        .update(consecutive_failures=0, circuit_open_until=None))
+        return
+
+    Webhook.objects.filter(id=webhook_id).update(consecutive_failures=F("consecutive_failures") + 1)
+    circuit_open_until = timezone.now() + datetime.timedelta(seconds=settings.WEBHOOKS_CIRCUIT_BREAKER_TIMEOUT)
+    (Webhook.objects.filter(id=webhook_id,
+                            consecutive_failures__gte=settings.WEBHOOKS_CIRCUIT_BREAKER_THRESHOLD)
+                    .update(circuit_open_until=circuit_open_until))
+
+
+def _deliver(webhook_id, url, key, data, circuit_open_until=None):
+    """
+    Send a request to a webhook, or schedule it for later if its circuit is
+    open or it fails with a retryable error (if the retries are enabled).
+    """
+    if circuit_open_until is not None:
+        if _retries_enabled():
+            WebhookRetry.objects.create(webhook_id=webhook_id, request_data=data,
+                                        next_attempt_at=circuit_open_until)
         else:
-            # Webhook was sent successfully
+            logger.warning("Webhook %s: request dropped, its circuit is open until %s",
+                           webhook_id, circuit_open_until)
+        return None
 
-            # response.content can be a not valid json so we encapsulate it
-            response_data = json.dumps({"content": response.text})
-            webhook_log = WebhookLog.objects.create(webhook_id=webhook_id, url=url,
-                                                    status=response.status_code,
-                                                    request_data=data,
-                                                    request_headers=dict(prepared_request.headers),
-                                                    response_data=response_data,
-                                                    response_headers=dict(response.headers),
-                                                    duration=response.elapsed.total_seconds())
-        finally:
-            _remove_leftover_webhooklogs(webhook_id)
+    webhook_log = _send_request(webhook_id, url, key, data)
+    if _is_invalid_url(webhook_log):
+        return webhook_log
+
+    failed = _is_retryable(webhook_log.status)
+    _update_circuit(webhook_id, failed)
+
+    if failed and _retries_enabled():
+        WebhookRetry.objects.create(webhook_id=webhook_id, request_data=data, attempts=1,
+                                    next_attempt_at=timezone.now() + _get_retry_delay(1))
 
     return webhook_log
 
 
+def _deliver_in_thread(*args):
+    try:
+        return _deliver(*args)
+    finally:
+        connection.close()
+
+
+def send_requests(webhooks, data):
+    """
+    Send the same data to a list of webhooks `(id, url, key)`, concurrently
+    (up to `WEBHOOKS_MAX_WORKERS` requests) if there are several.
+    """
+    open_circuits = dict(Webhook.objects.filter(id__in=[webhook_id for webhook_id, url, key in webhooks],
+                                                circuit_open_until__gt=timezone.now())
+                                        .values_list("id", "circuit_open_until"))
+    deliveries = [(webhook_id, url, key, data, open_circuits.get(webhook_id, None))
+                  for webhook_id, url, key in webhooks]
+
+    if len(deliveries) <= 1 or settings.WEBHOOKS_MAX_WORKERS <= 1:
+        return [_deliver(*delivery) for delivery in deliveries]
+
+    max_workers = min(len(deliveries), settings.WEBHOOKS_MAX_WORKERS)
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda delivery: _deliver_in_thread(*delivery), deliveries))
+
+
+def _retry(webhook_retry):
+    webhook = webhook_retry.webhook
+    webhook_retries = WebhookRetry.objects.filter(id=webhook_retry.id)
+    now = timezone.now()
+    if webhook.circuit_open_until is not None and webhook.circuit_open_until > now:
+        webhook_retries.update(next_attempt_at=webhook.circuit_open_until)
+        return
+
+    webhook_log = _send_request(webhook.id, webhook.url, webhook.key, webhook_retry.request_data)
+    if _is_invalid_url(webhook_log):
+        # The url of the webhook has been changed to an invalid one
+        webhook_retries.update(status=WebhookRetryStatus.dead)
+        return
+
+    failed = _is_retryable(webhook_log.status)
+    _update_circuit(webhook.id, failed)
+
+    if not failed:
+        webhook_retries.delete()
+        return
+
+    attempts = webhook_retry.attempts + 1
+    if attempts > settings.WEBHOOKS_MAX_RETRIES:
+        # Dead letter: kept to be inspected, but not sent again
+        webhook_retries.update(attempts=attempts, status=WebhookRetryStatus.dead)
+    else:
+        webhook_retries.update(attempts=attempts, next_attempt_at=now + _get_retry_delay(attempts))
+
+
+def _claim_webhook_retries(now):
+    """
+    Claim a batch of due retries. They are leased (postponed long enough to
+    send all of them) in a short transaction, so the requests are sent
+    without holding any lock and the other workers claim other retries.
+    """
+    batch_size = settings.WEBHOOKS_RETRY_BATCH_SIZE
+    lease = datetime.timedelta(seconds=2 * batch_size * (settings.WEBHOOKS_CONNECT_TIMEOUT +
+                                                         settings.WEBHOOKS_READ_TIMEOUT))
+    with transaction.atomic():
+        webhook_retries = list(WebhookRetry.objects.select_for_update(skip_locked=True, of=("self",))
+                                                   .select_related("webhook")
+                                                   .filter(status=WebhookRetryStatus.pending,
+                                                           next_attempt_at__lte=now)
+                                                   .order_by("next_attempt_at")
+                                                   [:batch_size])
+        (WebhookRetry.objects.filter(id__in=[webhook_retry.id for webhook_retry in webhook_retries])
+                             .update(next_attempt_at=now + lease))
+    return webhook_retries
+
+
 @app.task
-def create_webhook(webhook_id, url, key, by, date, obj):
-    data = {}
-    data['action'] = "create"
-    data['type'] = _get_type(obj)
-    data['by'] = UserSerializer(by).data
-    data['date'] = date
-    data['data'] = _serialize(obj)
+def retry_webhooks():
+    """
+    Send again the due failed webhook requests. The retries are claimed in
+    batches with SKIP LOCKED, so several workers can run it at once.
+    """
+    now = timezone.now()
+
+    while True:
+        # The retries sent again are rescheduled after `now`, or dead or deleted
+        webhook_retries = _claim_webhook_retries(now)
+        if not webhook_retries:
+            break
+
+        for webhook_retry in webhook_retries:
+            _retry(webhook_retry)
+
 
+@app.task
+def remove_leftover_webhooklogs():
+    """
+    Remove the webhook logs older than the last `MAX_WEBHOOK_LOGS` of every
+    webhook, in batches of `WEBHOOKS_LOGS_PRUNE_BATCH_SIZE` rows.
+    """
+    sql = """
+        DELETE FROM webhooks_webhooklog
+         WHERE id IN (SELECT id
+                        FROM (SELECT id,
+                                     row_number() OVER (PARTITION BY webhook_id ORDER BY id DESC) AS position
+                                FROM webhooks_webhooklog) AS logs
+                       WHERE position > %s
+                       LIMIT %s)
+    """
+    batch_size = settings.WEBHOOKS_LOGS_PRUNE_BATCH_SIZE
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(sql, [MAX_WEBHOOK_LOGS, batch_size])
+            if cursor.rowcount < batch_size:
+                break
+
+
+@app.task
+def send_webhooks(webhooks, action, by, date, obj, change=None):
+    # The object is serialized only once for all the webhooks of the project
+    data = _make_payload(action, by, date, obj, change=change)
+    return send_requests(webhooks, data)
+
+
+@app.task
+def create_webhook(webhook_id, url, key, by, date, obj):
+    data = _make_payload("create", by, date, obj)
     return _send_request(webhook_id, url, key, data)
 
 
 @app.task
 def delete_webhook(webhook_id, url, key, by, date, obj):
-    data = {}
-    data['action'] = "delete"
-    data['type'] = _get_type(obj)
-    data['by'] = UserSerializer(by).data
-    data['date'] = date
-    data['data'] = _serialize(obj)
-
+    data = _make_payload("delete", by, date, obj)
     return _send_request(webhook_id, url, key, data)
 
 
 @app.task
 def change_webhook(webhook_id, url, key, by, date, obj, change):
-    data = {}
-    data['action'] = "change"
-    data['type'] = _get_type(obj)
-    data['by'] = UserSerializer(by).data
-    data['date'] = date
-    data['data'] = _serialize(obj)
-    data['change'] = _serialize(change)
-
+    data = _make_payload("change", by, date, obj, change=change)
     return _send_request(webhook_id, url, key, data)
 
 
@@ -5,12 +5,19 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
+import io
 import pytest
 
+from unittest import mock
+
+from PIL import Image
+
+from django.core.files.storage import default_storage
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from taiga.base.utils import json
+from taiga.projects.attachments import services
 
 from .. import factories as f
 
@@ -254,3 +261,60 @@ def test_api_update_orders_in_bulk_invalid_after_attachment_because_object(clien
     assert response.status_code == 400, response.data
     assert len(response.data) == 1
     assert "after_attachment_id" in response.data
+
+
+def _image_data(format, mode="RGB"):
+    data = io.BytesIO()
+    Image.new(mode, (800, 600), "red").save(data, format=format)
+    return data.getvalue()
+
+
+def test_timeline_image_thumbnail_name_is_known_before_generating_it():
+    png_attachment = f.UserStoryAttachmentFactory(attached_file__data=_image_data("PNG"),
+                                                  attached_file__filename="image.png")
+    jpg_attachment = f.UserStoryAttachmentFactory(attached_file__data=_image_data("JPEG"),
+                                                  attached_file__filename="image.jpg")
+
+    for attachment, extension in [(png_attachment, ".png"), (jpg_attachment, ".jpg")]:
+        # Without celery the thumbnail is generated right away
+        thumbnail_name = services.get_timeline_image_thumbnail_name(attachment)
+        assert thumbnail_name.endswith(extension)
+        assert default_storage.exists(thumbnail_name)
+
+        with default_storage.open(thumbnail_name) as thumbnail_file:
+            assert Image.open(thumbnail_file).size[0] == 640
+
+
+def test_timeline_image_thumbnail_is_reused_for_the_same_content():
+    data = _image_data("PNG")
+    attachment1 = f.UserStoryAttachmentFactory(attached_file__data=data, attached_file__filename="image1.png")
+    attachment2 = f.UserStoryAttachmentFactory(attached_file__data=data, attached_file__filename="image2.png")
+    thumbnail_name1 = services.get_timeline_image_thumbnail_name(attachment1)
+
+    with mock.patch("easy_thumbnails.files.Thumbnailer.generate_thumbnail") as generate_thumbnail_mock:
+        thumbnail_name2 = services.get_timeline_image_thumbnail_name(attachment2)
+
+    assert not generate_thumbnail_mock.called
+    assert thumbnail_name1 != thumbnail_name2
+    assert default_storage.exists(thumbnail_name2)
+
+
+def test_timeline_image_thumbnail_is_not_generated_again_after_failing(settings, django_capture_on_commit_callbacks):
+    attachment = f.UserStoryAttachmentFactory(attached_file__data=b"not an image",
+                                              attached_file__filename="image.png",
+                                              sha1="corrupt-image-sha1")
+
+    settings.CELERY_ENABLED = True
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        assert services.get_timeline_image_thumbnail_name(attachment).endswith(".png")
+    assert len(callbacks) == 1
+
+    # The generation failed: it's not scheduled again and there is no thumbnail
+    with django_capture_on_commit_callbacks() as callbacks:
+        assert services.get_timeline_image_thumbnail_name(attachment) is None
+    assert callbacks == []
+
+    settings.CELERY_ENABLED = False
+    with mock.patch("taiga.projects.attachments.services.generate_thumbnail") as generate_thumbnail_mock:
+        assert services.get_timeline_image_thumbnail_name(attachment) is None
+    assert not generate_thumbnail_mock.called
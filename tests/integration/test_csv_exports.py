@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2021-present Kaleidos INC
+
+import gzip
+import uuid
+from unittest import mock
+
+from django.core.cache import cache
+from django.urls import reverse
+
+from taiga.projects.notifications.services import add_watcher
+from taiga.projects.services import csv_exports
+from taiga.projects.votes.services import add_vote, remove_vote
+
+from .. import factories as f
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def _get_csv_url(project):
+    return "{}?uuid={}".format(reverse("userstories-csv"), project.userstories_csv_uuid)
+
+
+def _get_content(response):
+    if response.streaming:
+        return b"".join(response.streaming_content)
+    return response.content
+
+
+def test_csv_export_not_modified(client):
+    project = f.ProjectFactory.create(userstories_csv_uuid=uuid.uuid4().hex)
+    us = f.UserStoryFactory.create(project=project)
+
+    response = client.get(_get_csv_url(project))
+    assert response.status_code == 200
+    etag = response["ETag"]
+    assert "Last-Modified" not in response
+
+    # Without a date bounding every change, If-Modified-Since is ignored
+    response = client.get(_get_csv_url(project), HTTP_IF_MODIFIED_SINCE="Wed, 21 Oct 2099 07:28:00 GMT")
+    assert response.status_code == 200
+
+    response = client.get(_get_csv_url(project), HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response["ETag"] == etag
+
+    us.subject = "changed"
+    us.save()
+
+    response = client.get(_get_csv_url(project), HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+    assert b"changed" in _get_content(response)
+
+
+def test_csv_export_is_served_from_the_cache_while_it_is_fresh(client, django_capture_on_commit_callbacks, settings):
+    settings.CELERY_ENABLED = True
+    project = f.ProjectFactory.create(userstories_csv_uuid=uuid.uuid4().hex)
+    f.UserStoryFactory.create(project=project, subject="first")
+
+    # The first request streams the export and regenerates the cache in background
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.get(_get_csv_url(project))
+    assert response.status_code == 200
+    assert response.streaming
+    csv_data = _get_content(response)
+
+    response = client.get(_get_csv_url(project), HTTP_ACCEPT_ENCODING="gzip, deflate")
+    assert response.status_code == 200
+    assert not response.streaming
+    assert response["Content-Encoding"] == "gzip"
+    assert response["Content-Disposition"] == 'attachment; filename="userstories.csv"'
+    assert gzip.decompress(response.content) == csv_data
+
+    response = client.get(_get_csv_url(project))
+    assert response.status_code == 200
+    assert not response.streaming
+    assert response.content == csv_data
+
+    # New data make the cache stale
+    f.UserStoryFactory.create(project=project, subject="second")
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.get(_get_csv_url(project))
+    assert response.streaming
+    assert b"second" in _get_content(response)
+
+    response = client.get(_get_csv_url(project))
+    assert not response.streaming
+    assert b"second" in response.content
+
+
+def test_csv_export_representations(client, django_capture_on_commit_callbacks, settings):
+    settings.CELERY_ENABLED = True
+    project = f.ProjectFactory.create(userstories_csv_uuid=uuid.uuid4().hex)
+    f.UserStoryFactory.create(project=project)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.get(_get_csv_url(project), HTTP_ACCEPT_ENCODING="gzip")
+    assert response.streaming
+    assert not response.has_header("Content-Encoding")
+    assert "Accept-Encoding" in response["Vary"]
+    etag = response["ETag"]
+
+    response = client.get(_get_csv_url(project), HTTP_ACCEPT_ENCODING="gzip")
+    assert response["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response["Vary"]
+    gzip_etag = response["ETag"]
+    assert gzip_etag != etag
+
+    response = client.get(_get_csv_url(project), HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=gzip_etag)
+    assert response.status_code == 304
+    assert response["ETag"] == gzip_etag
+
+    response = client.get(_get_csv_url(project), HTTP_IF_NONE_MATCH=gzip_etag)
+    assert response.status_code == 200
+    assert not response.has_header("Content-Encoding")
+    assert response["ETag"] == etag
+
+
+def test_csv_export_regeneration_is_not_scheduled_twice(client, django_capture_on_commit_callbacks, settings):
+    settings.CELERY_ENABLED = True
+    settings.CSV_EXPORT_CACHE_COMPRESS = False
+    project = f.ProjectFactory.create(userstories_csv_uuid=uuid.uuid4().hex)
+    f.UserStoryFactory.create(project=project)
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        client.get(_get_csv_url(project))
+        client.get(_get_csv_url(project))
+    assert len(callbacks) == 1
+
+    callbacks[0]()
+    cached = cache.get(csv_exports._get_cache_key(project.id, "userstories"))
+    assert cached["watermark"] == csv_exports.get_csv_watermark(project, "userstories")
+    assert not cached["compressed"]
+
+
+def test_csv_export_is_built_once_without_celery(client, django_capture_on_commit_callbacks, settings):
+    settings.CELERY_ENABLED = False
+    project = f.ProjectFactory.create(userstories_csv_uuid=uuid.uuid4().hex)
+    f.UserStoryFactory.create(project=project, subject="first")
+
+    with mock.patch("taiga.projects.services.csv_exports._iter_csv", wraps=csv_exports._iter_csv) as iter_csv_mock:
+        with django_capture_on_commit_callbacks() as callbacks:
+            response = client.get(_get_csv_url(project))
+        assert response.status_code == 200
+        assert not response.streaming
+        assert b"first" in response.content
+        assert iter_csv_mock.call_count == 1
+        assert callbacks == []
+
+        response = client.get(_get_csv_url(project))
+        assert response.status_code == 200
+        assert b"first" in response.content
+        assert iter_csv_mock.call_count == 1
+
+
+def test_csv_export_etag_changes_with_the_votes_watchers_and_choices(client):
+    project = f.ProjectFactory.create(userstories_csv_uuid=uuid.uuid4().hex)
+    user = f.UserFactory.create()
+    us = f.UserStoryFactory.create(project=project, status__project=project)
+
+    etags = [client.get(_get_csv_url(project))["ETag"]]
+
+    add_vote(us, user)
+    etags.append(client.get(_get_csv_url(project))["ETag"])
+
+    remove_vote(us, user)
+    etags.append(client.get(_get_csv_url(project))["ETag"])
+
+    add_watcher(us, user)
+    etags.append(client.get(_get_csv_url(project))["ETag"])
+
+    us.status.name = "Renamed"
+    us.status.save()
+    etags.append(client.get(_get_csv_url(project))["ETag"])
+
+    us.owner.full_name = "Renamed"
+    us.owner.save()
+    etags.append(client.get(_get_csv_url(project))["ETag"])
+
+    assert etags[2] == etags[0]
+    assert len(set(etags)) == len(etags) - 1
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (c) 2021-present Kaleidos INC
+
+from unittest import mock
+
+from django.db import transaction
+from django.test.utils import override_settings
+
+from taiga.base.utils import json
+from taiga.events import events
+from taiga.events.backends import base
+from taiga.events.backends import postgresql
+
+import pytest
+pytestmark = pytest.mark.django_db
+
+
+class FakeEventsPushBackend(base.BaseEventsPushBackend):
+    def __init__(self):
+        self.rounds = []
+
+    def emit_event(self, message:str, *, routing_key:str, channel:str="events"):
+        self.emit_events([{"message": message, "routing_key": routing_key, "channel": channel}])
+
+    def emit_events(self, events:list):
+        self.rounds.append(list(events))
+
+
+@pytest.fixture
+def backend():
+    backend = FakeEventsPushBackend()
+    with mock.patch("taiga.events.backends.get_events_backend", return_value=backend):
+        yield backend
+
+
+def test_emit_event_not_on_commit_is_sent_immediately(backend):
+    events.emit_event({"pk": 1}, "changes.project.1.userstories", sessionid="sid", on_commit=False)
+
+    assert len(backend.rounds) == 1
+    assert backend.rounds[0][0]["routing_key"] == "changes.project.1.userstories"
+
+
+def test_emit_events_in_transaction_are_sent_in_one_round(backend, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        with transaction.atomic():
+            events.emit_event({"pk": 1}, "changes.project.1.userstories", sessionid="sid")
+            events.emit_event({"pk": 2}, "changes.project.1.userstories", sessionid="sid")
+            events.emit_event({"pk": 3}, "changes.project.1.tasks", sessionid="sid")
+            assert backend.rounds == []
+
+    assert len(backend.rounds) == 1
+    assert len(backend.rounds[0]) == 3
+
+
+def test_emit_events_in_rolled_back_savepoint_are_discarded(backend, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        with transaction.atomic():
+            events.emit_event({"pk": 1}, "changes.project.1.userstories", sessionid="sid")
+
+            try:
+                with transaction.atomic():
+                    events.emit_event({"pk": 2}, "changes.project.1.userstories", sessionid="sid")
+                    raise ValueError()
+            except ValueError:
+                pass
+
+            events.emit_event({"pk": 3}, "changes.project.1.userstories", sessionid="sid")
+
+    messages = [event["message"] for round in backend.rounds for event in round]
+    assert len(messages) == 2
+    assert '"pk": 2' not in "".join(messages)
+
+
+def test_emit_events_in_rolled_back_transaction_are_discarded(backend, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        try:
+            with transaction.atomic():
+                events.emit_event({"pk": 1}, "changes.project.1.userstories", sessionid="sid")
+                raise ValueError()
+        except ValueError:
+            pass
+
+    assert backend.rounds == []
+
+
+def test_emit_repeated_model_events_in_transaction_are_sent_once(backend, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        with transaction.atomic():
+            events.emit_event({"type": "change", "matches": "userstories.userstory", "pk": 1},
+                              "changes.project.1.userstories.userstory", sessionid="sid")
+            events.emit_event({"type": "change", "matches": "userstories.userstory", "pk": 1},
+                              "changes.project.1.userstories.userstory", sessionid="sid")
+            events.emit_event({"type": "change", "matches": "userstories.userstory", "pk": 2},
+                              "changes.project.1.userstories.userstory", sessionid="sid")
+
+    assert len(backend.rounds) == 1
+    assert [json.loads(event["message"])["data"]["pk"] for event in backend.rounds[0]] == [1, 2]
+
+
+@override_settings(EVENTS_COALESCE_CHANGES=True)
+def test_emit_model_events_in_transaction_are_merged(backend, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        with transaction.atomic():
+            events.emit_event({"type": "change", "matches": "userstories.userstory", "pk": 1},
+                              "changes.project.1.userstories.userstory", sessionid="sid")
+            events.emit_event({"type": "change", "matches": "tasks.task", "pk": 1},
+                              "changes.project.1.tasks.task", sessionid="sid")
+            events.emit_event({"type": "change", "matches": "userstories.userstory", "pk": [2, 1, 3]},
+                              "changes.project.1.userstories.userstory", sessionid="sid")
+            events.emit_event({"type": "delete", "matches": "userstories.userstory", "pk": 4},
+                              "changes.project.1.userstories.userstory", sessionid="sid")
+
+    messages = [json.loads(event["message"])["data"] for event in backend.rounds[0]]
+    assert messages == [
+        {"type": "change", "matches": "userstories.userstory", "pk": [1, 2, 3], "coalesced": True},
+        {"type": "change", "matches": "tasks.task", "pk": [1], "coalesced": True},
+        {"type": "delete", "matches": "userstories.userstory", "pk": [4], "coalesced": True},
+    ]
+
+
+def test_postgresql_backend_notifications():
+    notifications = postgresql.get_notifications([
+        {"message": '{"pk": 1}', "routing_key": "changes.project.1.userstories", "channel": "events"},
+        {"message": '{"pk": 2}', "routing_key": "changes.project.1.userstories", "channel": "events"},
+    ])
+
+    assert notifications == [
+        ("events_changes__project__1__userstories", '{"pk": 1}'),
+        ("events_changes__project__1__userstories", '{"pk": 2}'),
+    ]
+
+
+def test_postgresql_backend_split_long_messages_in_chunks():
+    message = json.dumps({"data": '"' * 10000})
+    events = [{"message": message, "routing_key": "changes.project.1.userstories", "channel": "events"}]
+
+    chunks = [json.loads(payload) for channel, payload in postgresql.get_notifications(events)]
+    assert len(chunks) > 1
+    assert [chunk["chunk"]["index"] for chunk in chunks] == list(range(chunks[0]["chunk"]["total"]))
+    assert len({chunk["chunk"]["id"] for chunk in chunks}) == 1
+    assert "".join(chunk["data"] for chunk in chunks) == message
+
+    # pg_notify fails with payloads longer than the limit
+    postgresql.EventsPushBackend().emit_events(events)
+
+
+@override_settings(EVENTS_MAX_IDS_PER_MESSAGE=2)
+def test_emit_event_for_ids_sends_all_the_ids_in_chunks(backend, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        events.emit_event_for_ids((id for id in [3, 1, 3, 2]), "userstories.userstory", 1, sessionid="sid")
+
+    messages = [json.loads(event["message"]) for round in backend.rounds for event in round]
+    assert [message["data"]["pk"] for message in messages] == [[3, 1], [2]]
+    assert all(event["routing_key"] == "changes.project.1.userstories"
+               for round in backend.rounds for event in round)
+
+
+def test_emit_event_for_ids_without_ids(backend, django_capture_on_commit_callbacks):
+    with django_capture_on_commit_callbacks(execute=True):
+        events.emit_event_for_ids([], "userstories.userstory", 1, sessionid="sid")
+
+    assert backend.rounds == []
@@ -7,6 +7,7 @@
 
 import pytest
 
+from contextlib import contextmanager
 from unittest.mock import patch
 
 from django.urls import reverse
@@ -133,6 +134,119 @@ def test_real_snapshot_frequency(settings):
     assert qs_partials.count() == 2
 
 
+def test_last_snapshot_cache(settings):
+    settings.MAX_PARTIAL_DIFFS = 3
+    issue = f.IssueFactory.create()
+    key = services.make_key_from_model_object(issue)
+
+    for counter in range(5):
+        issue.subject = "subject{}".format(counter)
+        issue.save()
+        services.take_snapshot(issue, user=issue.owner)
+
+        cached_snapshot, cached_need_real_snapshot = services.get_last_snapshot_for_key(key)
+        settings.HISTORY_SNAPSHOT_CACHE_ENABLE = False
+        snapshot, need_real_snapshot = services.get_last_snapshot_for_key(key)
+        settings.HISTORY_SNAPSHOT_CACHE_ENABLE = True
+
+        assert cached_snapshot == snapshot
+        assert cached_snapshot.snapshot["subject"] == "subject{}".format(counter)
+        assert cached_need_real_snapshot == need_real_snapshot
+
+    # The cached snapshot is outdated if the last entry changes
+    HistoryEntry.objects.filter(key=key).order_by("-created_at").first().delete()
+    snapshot, _ = services.get_last_snapshot_for_key(key)
+    assert snapshot.snapshot["subject"] == "subject3"
+
+
+def test_take_snapshots_in_bulk():
+    project = f.ProjectFactory.create()
+    us1 = f.UserStoryFactory.create(project=project)
+    us2 = f.UserStoryFactory.create(project=project)
+    task = f.TaskFactory.create(project=project, user_story=us1)
+    services.take_snapshot(us1, user=us1.owner)
+
+    us1.subject = "new subject"
+    us1.save()
+    entries = services.take_snapshots_in_bulk([us1, us2, task, us2], user=us1.owner)
+
+    assert [entry.key for entry in entries] == [services.make_key_from_model_object(obj)
+                                               for obj in [us1, us2, task]]
+    assert entries[0].type == HistoryType.change
+    assert entries[0].diff["subject"][1] == "new subject"
+    assert entries[1].type == HistoryType.create
+    assert HistoryEntry.objects.filter(key__in=[entry.key for entry in entries]).count() == 4
+
+    # Nothing changed
+    assert services.take_snapshots_in_bulk([us1, us2, task], user=us1.owner) == []
+
+
+def test_take_snapshots_in_bulk_locks_the_objects_in_chunks(settings):
+    settings.HISTORY_BULK_SNAPSHOTS_CHUNK_SIZE = 2
+    project = f.ProjectFactory.create()
+    uss = f.UserStoryFactory.create_batch(5, project=project)
+
+    held_locks = []
+    max_held_locks = []
+
+    @contextmanager
+    def advisory_lock(lock_id):
+        held_locks.append(lock_id)
+        max_held_locks.append(len(held_locks))
+        yield
+        held_locks.remove(lock_id)
+
+    with patch("taiga.projects.history.services.advisory_lock", advisory_lock):
+        entries = services.take_snapshots_in_bulk(list(reversed(uss)), user=uss[0].owner)
+
+    assert max(max_held_locks) == 2
+    assert held_locks == []
+    assert [entry.key for entry in entries] == [services.make_key_from_model_object(us)
+                                               for us in reversed(uss)]
+
+
+def test_make_diffs_values_with_one_query_per_model(django_assert_num_queries):
+    project = f.ProjectFactory.create()
+    status1 = f.UserStoryStatusFactory.create(project=project)
+    status2 = f.UserStoryStatusFactory.create(project=project)
+    user1 = f.UserFactory.create()
+    user2 = f.UserFactory.create()
+    diffs = [
+        ("userstories.userstory", services.FrozenDiff("userstories.userstory:1",
+                                                      {"status": [status1.id, status2.id],
+                                                       "assigned_to": [None, user1.id]}, {})),
+        ("userstories.userstory", services.FrozenDiff("userstories.userstory:2",
+                                                      {"status": [status2.id, status1.id],
+                                                       "assigned_to": [user1.id, user2.id]}, {})),
+    ]
+
+    with django_assert_num_queries(2):
+        values = services.make_diffs_values(diffs)
+
+    assert values[0]["status"] == {str(status1.id): status1.name, str(status2.id): status2.name}
+    assert values[0]["users"] == {str(user1.id): user1.get_full_name()}
+    assert values[1]["users"] == {str(user1.id): user1.get_full_name(),
+                                  str(user2.id): user2.get_full_name()}
+
+
+def test_make_diffs_values_with_an_implementation_without_resolver():
+    calls = []
+
+    def _values(diff):
+        calls.append(diff)
+        return {"status": {"1": "New"}}
+
+    services.register_values_implementation("tests.oldvalues", _values)
+    try:
+        diff = {"status": [1, 2]}
+        values = services.make_diffs_values([("tests.oldvalues", services.FrozenDiff("tests.oldvalues:1", diff, {}))])
+    finally:
+        services._values_impl_map.pop("tests.oldvalues")
+
+    assert values == [{"status": {"1": "New"}}]
+    assert calls == [diff]
+
+
 def test_issue_resource_history_test(client):
     user = f.UserFactory.create()
     project = f.ProjectFactory.create(owner=user)
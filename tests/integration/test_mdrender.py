@@ -61,3 +61,47 @@ def test_proccessor_valid_email():
     result = render(dummy_project, "**beta.tester@taiga.io**")
     expected_result = "<p><strong><a href=\"mailto:beta.tester@taiga.io\" target=\"_blank\">beta.tester@taiga.io</a></strong></p>"
     assert result == expected_result
+
+
+def test_render_and_extract_references_and_mentions_with_one_query_per_type(django_assert_num_queries):
+    project = factories.ProjectFactory()
+    user1 = factories.UserFactory(username="mentioned1")
+    user2 = factories.UserFactory(username="mentioned2")
+    factories.MembershipFactory(user=user1, project=project)
+    factories.MembershipFactory(user=user2, project=project)
+    us1 = factories.UserStoryFactory(project=project)
+    us2 = factories.UserStoryFactory(project=project)
+    task = factories.TaskFactory(project=project)
+    issue = factories.IssueFactory(project=project)
+
+    text = "See #{} #{} #{} #{} #{} #999 @mentioned1 @mentioned2 @mentioned1 @unknown".format(
+        us1.ref, us2.ref, task.ref, issue.ref, us1.ref)
+
+    # references + one per content type (user stories, tasks and issues) + users
+    with django_assert_num_queries(5):
+        (result, extracted) = render_and_extract(project, text)
+
+    assert extracted["references"] == [us1, us2, task, issue, us1]
+    assert extracted["mentions"] == [user1, user2, user1]
+    assert 'class="reference task"' in result
+    assert "#999" in result
+    assert "@unknown" in result
+
+
+def test_render_cache_is_invalidated_by_the_project_changes():
+    project = factories.ProjectFactory(slug="old-slug")
+    us = factories.UserStoryFactory(project=project, subject="Old subject")
+    text = "This text is long enough to be cached and references #{}".format(us.ref)
+
+    assert 'title="#{} Old subject"'.format(us.ref) in render(project, text)
+
+    us.subject = "New subject"
+    us.save()
+    assert 'title="#{} New subject"'.format(us.ref) in render(project, text)
+
+    project.slug = "new-slug"
+    project.save()
+    assert "/project/new-slug/us/{}".format(us.ref) in render(project, text)
+
+    us.delete()
+    assert 'class="reference' not in render(project, text)
@@ -191,7 +191,6 @@ def test_users_to_notify():
     policy_member1.notify_level = NotifyLevel.all
     policy_member1.save()
 
-    del project.cached_notify_policies
     users = services.get_users_to_notify(issue)
     assert len(users) == 2
     assert users == {member1.user, issue.get_owner()}
@@ -201,7 +200,6 @@ def test_users_to_notify():
     policy_member3.notify_level = NotifyLevel.all
     policy_member3.save()
 
-    del project.cached_notify_policies
     users = services.get_users_to_notify(issue)
     assert len(users) == 3
     assert users == {member1.user, member3.user, issue.get_owner()}
@@ -211,14 +209,12 @@ def test_users_to_notify():
     policy_member3.save()
 
     issue.add_watcher(member3.user)
-    del project.cached_notify_policies
     users = services.get_users_to_notify(issue)
     assert len(users) == 2
     assert users == {member1.user, issue.get_owner()}
 
     # Test with watchers without permissions
     issue.add_watcher(member5.user)
-    del project.cached_notify_policies
     users = services.get_users_to_notify(issue)
     assert len(users) == 2
     assert users == {member1.user, issue.get_owner()}
@@ -352,6 +348,51 @@ def test_watching_users_to_notify_on_issue_modification_6():
     assert users == {issue.owner}
 
 
+def test_get_notification_recipients_with_one_query(django_assert_num_queries):
+    project = f.ProjectFactory.create(anon_permissions=[], public_permissions=[])
+    role = f.RoleFactory.create(project=project, permissions=["view_issues"])
+    role_without_perms = f.RoleFactory.create(project=project, permissions=[])
+
+    owner = f.MembershipFactory.create(project=project, role=role).user
+    live_member = f.MembershipFactory.create(project=project, role=role).user
+    email_member = f.MembershipFactory.create(project=project, role=role).user
+    watcher = f.MembershipFactory.create(project=project, role=role).user
+    member_without_perms = f.MembershipFactory.create(project=project, role=role_without_perms).user
+    f.MembershipFactory.create(project=project, role=role)
+    admin = f.MembershipFactory.create(project=project, role=role_without_perms, is_admin=True).user
+
+    NotifyPolicy = apps.get_model("notifications", "NotifyPolicy")
+    NotifyPolicy.objects.filter(project=project, user=live_member).update(notify_level=NotifyLevel.none,
+                                                                           live_notify_level=NotifyLevel.all)
+    NotifyPolicy.objects.filter(project=project, user=email_member).update(notify_level=NotifyLevel.all,
+                                                                            live_notify_level=NotifyLevel.none)
+    NotifyPolicy.objects.filter(project=project, user=member_without_perms).update(notify_level=NotifyLevel.all)
+    NotifyPolicy.objects.filter(project=project, user=admin).update(notify_level=NotifyLevel.all)
+
+    issue = f.IssueFactory.create(project=project, owner=owner)
+    issue.add_watcher(watcher)
+
+    with django_assert_num_queries(1):
+        recipients = services.get_notification_recipients(issue, discard_users=[owner])
+
+    assert recipients.email == {email_member, watcher, admin}
+    assert recipients.live == {live_member, watcher}
+
+
+def test_get_notification_recipients_creates_the_missing_notify_policies():
+    project = f.ProjectFactory.create(anon_permissions=["view_issues"])
+    assigned_user = f.UserFactory.create()
+    issue = f.IssueFactory.create(project=project, assigned_to=assigned_user)
+
+    recipients = services.get_notification_recipients(issue)
+
+    assert recipients.email == {issue.owner, assigned_user}
+    assert recipients.live == {issue.owner, assigned_user}
+    policy = assigned_user.notify_policies.get(project=project)
+    assert policy.notify_level == NotifyLevel.involved
+    assert policy.live_notify_level == NotifyLevel.involved
+
+
 def test_send_notifications_using_services_method_for_user_stories(settings, mail):
     settings.CHANGE_NOTIFICATIONS_MIN_INTERVAL = 1
 
@@ -1499,11 +1540,9 @@ def test_smtp_error_sending_notifications(settings, mail):
                                 history=history_delete)
 
 
-    with patch("taiga.projects.notifications.services._make_template_mail") as make_template_email_mock, \
-         patch("taiga.projects.notifications.services.logger") as logger_mock:
-        email_mock = Mock()
-        email_mock.send.side_effect = smtplib.SMTPDataError(msg="error smtp", code=123)
-        make_template_email_mock.return_value = email_mock
+    with patch("django.core.mail.backends.locmem.EmailBackend.send_messages") as send_messages_mock, \
+         patch("taiga.base.mails.logger") as logger_mock:
+        send_messages_mock.side_effect = smtplib.SMTPDataError(msg="error smtp", code=123)
 
         assert models.HistoryChangeNotification.objects.count() == 3
         assert len(mail.outbox) == 0
@@ -1512,3 +1551,85 @@ def test_smtp_error_sending_notifications(settings, mail):
         assert len(mail.outbox) == 0
 
         assert logger_mock.exception.call_count == 3
+
+
+def test_send_sync_notifications_renders_the_emails_once_per_language(settings, mail):
+    settings.CHANGE_NOTIFICATIONS_MIN_INTERVAL = 0
+    settings.NOTIFICATIONS_EMAIL_BATCH_SIZE = 2
+
+    project = f.ProjectFactory.create()
+    role = f.RoleFactory.create(project=project, permissions=['view_issues', 'view_us', 'view_tasks', 'view_wiki_pages'])
+    member1 = f.MembershipFactory.create(project=project, role=role)
+    users = [f.UserFactory.create(full_name="O'Brien & <Co> {}".format(i), lang=lang)
+             for i, lang in enumerate(["en", "es", "en", "es", "en"])]
+
+    issue = f.IssueFactory.create(project=project, owner=member1.user)
+    history = f.HistoryEntryFactory.create(
+        project=project,
+        user={"pk": member1.user.id},
+        comment="test:change",
+        type=HistoryType.change,
+        key="issues.issue:{}".format(issue.id),
+        is_hidden=False,
+        diff=[]
+    )
+    take_snapshot(issue, user=issue.owner)
+    notification = models.HistoryChangeNotification.objects.create(key="issues.issue:{}".format(issue.id),
+                                                                    owner=member1.user,
+                                                                    project=project,
+                                                                    history_type=HistoryType.change)
+    notification.history_entries.add(history)
+    notification.notify_users.set(users)
+
+    template_email = services._make_template_mail("issues/issue-change")
+    with patch("taiga.projects.notifications.services._make_template_mail", return_value=template_email), \
+         patch.object(template_email, "make_email_object", wraps=template_email.make_email_object) as make_email_object_mock:
+        services.send_sync_notifications(notification.id)
+
+    assert make_email_object_mock.call_count == 2
+    assert sorted(msg.to[0] for msg in mail.outbox) == sorted(user.email for user in users)
+
+    # Every message is personalized as if it was rendered for its user
+    for msg in mail.outbox:
+        user = next(user for user in users if user.email == msg.to[0])
+        context = dict(make_email_object_mock.call_args[0][1], user=user, lang=user.lang)
+        expected_msg = template_email.make_email_object(user.email, context, headers={})
+        assert msg.subject == expected_msg.subject
+        assert msg.body == expected_msg.body
+        assert msg.alternatives == expected_msg.alternatives
+
+
+def test_send_due_notifications_by_shards(settings):
+    settings.CHANGE_NOTIFICATIONS_MIN_INTERVAL = 60
+
+    project = f.ProjectFactory.create()
+    notifications = [models.HistoryChangeNotification.objects.create(key="issues.issue:{}".format(i),
+                                                                     owner=project.owner,
+                                                                     project=project,
+                                                                     history_type=HistoryType.change)
+                     for i in range(5)]
+    due_notifications = notifications[:4]
+    models.HistoryChangeNotification.objects.filter(id__in=[n.id for n in due_notifications]).update(
+        updated_datetime=timezone.now() - datetime.timedelta(minutes=2))
+
+    with patch("taiga.projects.notifications.services.send_sync_notifications") as send_sync_notifications_mock:
+        services.send_due_notifications(shard=1, shards=2)
+        assert sorted(call.args[0] for call in send_sync_notifications_mock.call_args_list) == \
+            sorted(n.id for n in due_notifications if n.id % 2 == 1)
+
+        send_sync_notifications_mock.reset_mock()
+        send_sync_notifications_mock.side_effect = Exception("error")
+        services.send_due_notifications()
+        assert sorted(call.args[0] for call in send_sync_notifications_mock.call_args_list) == \
+            sorted(n.id for n in due_notifications)
+
+
+def test_send_bulk_email_fans_out_the_shards_to_celery(settings):
+    settings.CELERY_ENABLED = True
+    settings.SEND_BULK_EMAILS_WITH_CELERY = True
+    settings.NOTIFICATIONS_DISPATCH_SHARDS = 3
+
+    with patch("taiga.projects.notifications.services.send_due_notifications_task") as task_mock:
+        services.send_bulk_email()
+
+    assert [call.args for call in task_mock.delay.call_args_list] == [(0, 3), (1, 3), (2, 3)]
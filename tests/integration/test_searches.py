@@ -140,3 +140,65 @@ def test_search_text_query_with_an_invalid_project_id(client, searches_initial_d
 
     response = client.get(reverse("search-list"), {"project": "new", "text": "future"})
     assert response.status_code == 404
+
+
+def test_search_text_query_uses_the_updated_search_vector(client, searches_initial_data):
+    data = searches_initial_data
+
+    client.login(data.member1.user)
+
+    data.us14.subject = "Flux capacitor"
+    data.us14.save()
+    data.wikipage11.content = "Flux capacitor"
+    data.wikipage11.save()
+
+    response = client.get(reverse("search-list"), {"project": data.project1.id, "text": "capacitor"})
+    assert response.status_code == 200
+    assert [obj["id"] for obj in response.data["userstories"]] == [data.us14.id]
+    assert [obj["id"] for obj in response.data["wikipages"]] == [data.wikipage11.id]
+
+    response = client.get(reverse("search-list"), {"project": data.project1.id, "text": str(data.task13.ref)})
+    assert response.status_code == 200
+    assert data.task13.id in [obj["id"] for obj in response.data["tasks"]]
+
+
+def test_search_only_the_requested_types(client, searches_initial_data):
+    data = searches_initial_data
+
+    client.login(data.member1.user)
+
+    response = client.get(reverse("search-list"), {"project": data.project1.id, "text": "future",
+                                                   "types": "userstories,issues"})
+    assert response.status_code == 200
+    assert set(response.data.keys()) == {"userstories", "issues", "count"}
+    assert response.data["count"] == 6
+
+    response = client.get(reverse("search-list"), {"project": data.project1.id, "text": "future",
+                                                   "types": "tasks"})
+    assert response.status_code == 200
+    assert set(response.data.keys()) == {"tasks", "count"}
+    assert response.data["count"] == 3
+
+    response = client.get(reverse("search-list"), {"project": data.project1.id, "types": "tasks,sprints"})
+    assert response.status_code == 400
+
+
+def test_search_with_a_limit_per_type(client, searches_initial_data):
+    data = searches_initial_data
+
+    client.login(data.member1.user)
+
+    response = client.get(reverse("search-list"), {"project": data.project1.id, "text": "future", "limit": 2})
+    assert response.status_code == 200
+    assert response.data["count"] == 8
+    assert len(response.data["epics"]) == 2
+    assert len(response.data["userstories"]) == 2
+    assert len(response.data["tasks"]) == 2
+    assert len(response.data["issues"]) == 2
+    assert len(response.data["wikipages"]) == 0
+
+    response = client.get(reverse("search-list"), {"project": data.project1.id, "limit": "many"})
+    assert response.status_code == 400
+
+    response = client.get(reverse("search-list"), {"project": data.project1.id, "limit": 0})
+    assert response.status_code == 400
@@ -10,6 +10,7 @@ import pytest
 
 from .. import factories
 from django.contrib.auth.models import AnonymousUser
+from django.urls import reverse
 from django.utils import timezone
 from taiga.timeline.service import build_project_namespace, build_user_namespace, get_timeline
 from taiga.projects.history import services as history_services
@@ -156,6 +157,33 @@ def test_filter_timeline_private_project_member_superuser():
     assert timeline.count() == 2
 
 
+def test_filter_timeline_private_project_member_changes():
+    Timeline.objects.all().delete()
+    user1 = factories.UserFactory()
+    user2 = factories.UserFactory()
+    project = factories.ProjectFactory.create(is_private=True)
+    membership = factories.MembershipFactory.create(user=user2, project=project)
+    membership.role.permissions = ["view_tasks"]
+    membership.role.save()
+    task = factories.TaskFactory.create(project=project)
+
+    service.register_timeline_implementation("tasks.task", "test", lambda x, extra_data=None: id(x))
+    service._add_to_object_timeline(user1, task, "test", task.created_date)
+    timeline = Timeline.objects.filter(event_type="tasks.task.test")
+    assert service.filter_timeline_for_user(timeline, user2).count() == 1
+
+    membership.role.permissions = []
+    membership.role.save()
+    assert service.filter_timeline_for_user(timeline, user2).count() == 0
+
+    membership.is_admin = True
+    membership.save()
+    assert service.filter_timeline_for_user(timeline, user2).count() == 1
+
+    membership.delete()
+    assert service.filter_timeline_for_user(timeline, user2).count() == 0
+
+
 def test_create_project_timeline():
     project = factories.ProjectFactory.create(name="test project timeline")
     history_services.take_snapshot(project, user=project.owner)
@@ -669,3 +697,37 @@ def _helper_get_timelines_for_accessing_users(project, users):
             timeline_counts['user_timelines'][users.index(accessing_user)].append(user_timeline.count())
 
     return timeline_counts
+
+
+def test_project_timeline_cursor_pagination(client):
+    project = factories.ProjectFactory.create(is_private=False, anon_permissions=["view_project"])
+    namespace = build_project_namespace(project)
+    created = timezone.now()
+
+    service.register_timeline_implementation("projects.project", "test", lambda x, extra_data=None: {})
+    for i in range(5):
+        service._add_to_object_timeline(project, project, "test", created - timedelta(days=i % 3), namespace)
+
+    expected_ids = list(Timeline.objects.filter(namespace=namespace)
+                                        .order_by("-created", "-id")
+                                        .values_list("id", flat=True))
+    assert len(expected_ids) == 5
+
+    url = reverse("project-timeline-detail", kwargs={"pk": project.pk}) + "?page_size=2"
+    ids = []
+    while url:
+        response = client.get(url, HTTP_X_CURSOR_PAGINATION="true")
+        assert response.status_code == 200, response.data
+        assert "x-pagination-count" not in response
+        ids += [entry["id"] for entry in response.data]
+        url = response.get("x-pagination-next", None)
+
+    assert ids == expected_ids
+
+
+def test_project_timeline_invalid_cursor(client):
+    project = factories.ProjectFactory.create(is_private=False, anon_permissions=["view_project"])
+
+    url = reverse("project-timeline-detail", kwargs={"pk": project.pk}) + "?cursor=invalid"
+    response = client.get(url)
+    assert response.status_code == 404
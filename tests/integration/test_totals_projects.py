@@ -13,6 +13,8 @@ from .. import factories as f
 
 from taiga.projects.history.choices import HistoryType
 from taiga.projects.models import Project
+from taiga.projects.models import ProjectTotalsBucket
+from taiga.projects.services import compact_projects_totals_buckets
 
 from django.urls import reverse
 from django.utils import timezone
@@ -148,3 +150,61 @@ def test_project_totals_updated_on_like(client):
     assert project.total_fans_last_month == 2
     assert project.total_fans_last_year == 3
     assert project.totals_updated_datetime > totals_updated_datetime
+
+
+def test_project_totals_buckets_compaction(client):
+    project = f.create_project()
+    now = timezone.now()
+
+    for days in [3, 3, 13, 400, 500]:
+        l = f.LikeFactory.create(content_object=project)
+        l.created_date = now - datetime.timedelta(days=days)
+        l.save()
+
+    f.LikeFactory.create(content_object=project).delete()
+
+    project.refresh_totals()
+    totals = (project.total_fans, project.total_fans_last_week,
+              project.total_fans_last_month, project.total_fans_last_year)
+    assert totals == (5, 2, 3, 3)
+
+    compact_projects_totals_buckets()
+
+    assert project.totals_buckets.count() == 3
+    project.refresh_totals()
+    assert (project.total_fans, project.total_fans_last_week,
+            project.total_fans_last_month, project.total_fans_last_year) == totals
+
+
+def test_project_totals_buckets_compaction_only_rewrites_the_groups_that_need_it(client):
+    project = f.create_project()
+    deleted_project = f.create_project()
+    now = timezone.now()
+
+    for days in [3, 13, 400, 500]:
+        l = f.LikeFactory.create(content_object=project)
+        l.created_date = now - datetime.timedelta(days=days)
+        l.save()
+    f.LikeFactory.create(content_object=deleted_project)
+
+    compact_projects_totals_buckets()
+    old_buckets = project.totals_buckets.filter(date__lt=now - datetime.timedelta(days=10))
+    old_bucket_ids = set(old_buckets.values_list("id", flat=True))
+    assert len(old_bucket_ids) == 2
+    bucket_id = project.totals_buckets.get(date=(now - datetime.timedelta(days=3)).date()).id
+
+    l = f.LikeFactory.create(content_object=project)
+    l.created_date = now - datetime.timedelta(days=3)
+    l.save()
+    deleted_project.delete()
+
+    compact_projects_totals_buckets()
+
+    # Only the day with a new like has been rewritten
+    assert set(old_buckets.values_list("id", flat=True)) == old_bucket_ids
+    assert project.totals_buckets.filter(date=(now - datetime.timedelta(days=3)).date()).count() == 1
+    assert not project.totals_buckets.filter(id=bucket_id).exists()
+    assert not ProjectTotalsBucket.objects.filter(project_id=deleted_project.id).exists()
+    project.refresh_totals()
+    assert (project.total_fans, project.total_fans_last_week,
+            project.total_fans_last_month, project.total_fans_last_year) == (5, 2, 3, 3)
@@ -7,6 +7,7 @@
 
 import uuid
 import csv
+import io
 
 from datetime import timedelta
 from urllib.parse import quote
@@ -1199,6 +1200,49 @@ def test_api_filters_data_roles_with_assigned_users(client):
                        response.data["roles"]))["count"] == 1
 
 
+def test_get_userstories_filters_data_counts_all_the_facets_in_one_query(django_assert_num_queries):
+    project = f.ProjectFactory.create()
+    user1 = f.UserFactory.create()
+    f.MembershipFactory.create(user=user1, project=project)
+    user2 = f.UserFactory.create()
+    f.MembershipFactory.create(user=user2, project=project)
+    status1 = f.UserStoryStatusFactory.create(project=project)
+    status2 = f.UserStoryStatusFactory.create(project=project)
+    epic = f.EpicFactory.create(project=project)
+
+    us1 = f.UserStoryFactory.create(project=project, owner=user1, status=status1,
+                                    assigned_users=[user1, user2])
+    f.RelatedUserStory.create(epic=epic, user_story=us1)
+    f.UserStoryFactory.create(project=project, owner=user2, status=status2)
+    f.UserStoryFactory.create(project=project, owner=user2, status=status2)
+
+    queryset = models.UserStory.objects.filter(project=project)
+    querysets = {
+        "statuses": queryset.filter(owner=user2),
+        "assigned_to": queryset,
+        "assigned_users": queryset,
+        "owners": queryset.filter(status=status2),
+        "tags": queryset,
+        "epics": queryset,
+        "roles": queryset.none(),
+    }
+
+    # counters + statuses + members + members and system users (2) + epics + roles
+    with django_assert_num_queries(7):
+        data = services.get_userstories_filters_data(project, querysets)
+
+    counts = lambda facet: {i["id"]: i["count"] for i in data[facet]}
+    assert counts("statuses")[status1.id] == 0
+    assert counts("statuses")[status2.id] == 2
+    assert counts("assigned_to")[None] == 3
+    assert counts("assigned_users")[user1.id] == 1
+    assert counts("assigned_users")[user2.id] == 1
+    assert counts("assigned_users")[None] == 2
+    assert counts("owners") == {user2.id: 2}
+    assert counts("epics") == {None: 2, epic.id: 1}
+    assert all(count == 0 for count in counts("roles").values())
+
+
 def test_get_invalid_csv(client):
     url = reverse("userstories-csv")
     project = f.ProjectFactory.create()
@@ -1220,6 +1264,43 @@ def test_get_valid_csv(client):
     assert response.status_code == 200
 
 
+def test_get_valid_csv_streamed_with_the_related_data(client, settings):
+    settings.CSV_EXPORT_CACHE_ENABLED = False
+    url = reverse("userstories-csv")
+    project = f.ProjectFactory.create(userstories_csv_uuid=uuid.uuid4().hex)
+    role = f.RoleFactory.create(project=project, computable=True)
+    points = f.PointsFactory.create(project=project, value=3)
+    user1 = f.UserFactory.create(username="alice", full_name="Alice")
+    user2 = f.UserFactory.create(username="bob", full_name="")
+    us = f.UserStoryFactory.create(project=project, assigned_users=[user2, user1])
+    models.RolePoints.objects.update_or_create(user_story=us, role=role, defaults={"points": points})
+    task1 = f.TaskFactory.create(project=project, user_story=us)
+    task2 = f.TaskFactory.create(project=project, user_story=us)
+    epic = f.EpicFactory.create(project=project)
+    f.RelatedUserStory.create(epic=epic, user_story=us)
+    f.UserStoryAttachmentFactory.create(project=project, content_object=us)
+    f.UserStoryFactory.create(project=project)
+
+    response = client.get("{}?uuid={}".format(url, project.userstories_csv_uuid))
+    assert response.status_code == 200
+    assert response.streaming
+
+    reader = csv.DictReader(io.StringIO("".join(line.decode() for line in response.streaming_content)))
+    rows = list(reader)
+    assert len(rows) == 2
+    assert rows[0]["ref"] == str(us.ref)
+    assert rows[0]["assigned_users"] == "alice,bob"
+    assert rows[0]["assigned_users_full_name"] == "Alice,bob"
+    assert rows[0]["{}-points".format(role.slug)] == "3.0"
+    assert rows[0]["total-points"] == "3.0"
+    assert rows[0]["tasks"] == "{},{}".format(task1.ref, task2.ref)
+    assert rows[0]["epics"] == str(epic.ref)
+    assert rows[0]["attachments"] == "1"
+    assert rows[1]["assigned_users"] == ""
+    assert rows[1]["tasks"] == ""
+    assert rows[1]["attachments"] == "0"
+
+
 def test_custom_fields_csv_generation():
     project = f.ProjectFactory.create(userstories_csv_uuid=uuid.uuid4().hex)
     attr = f.UserStoryCustomAttributeFactory.create(project=project,
@@ -5,13 +5,18 @@
 #
 # Copyright (c) 2021-present Kaleidos INC
 
+import datetime
 import pytest
 
 from django.urls import reverse
+from django.utils import timezone
+from requests.exceptions import ConnectionError
 from unittest.mock import patch
 from unittest.mock import Mock
 
 from taiga.base.utils import json
+from taiga.webhooks import tasks
+from taiga.webhooks.choices import WebhookRetryStatus
 
 from .. import factories as f
 
@@ -48,3 +53,214 @@ def test_webhook_action_test_transform_to_json(client, data):
             response = client.json.post(url)
             assert response.status_code == 200
             assert json.loads(response.data["response_data"]) == {"content": "ok"}
+
+
+def test_webhook_sessions_are_kept_by_host_and_not_shared(settings):
+    settings.WEBHOOKS_SESSIONS_MAX_HOSTS = 2
+    tasks._sessions.clear()
+
+    with tasks._get_session("http://example.com/a") as session1:
+        # A session is not used by two threads at once
+        with tasks._get_session("http://example.com/b") as session2:
+            assert session2 is not session1
+
+    with tasks._get_session("http://example.com/c") as session:
+        assert session in (session1, session2)
+
+    with tasks._get_session("https://example.com/a") as session:
+        assert session not in (session1, session2)
+
+    # Only the sessions of the last used hosts are kept
+    with patch("taiga.webhooks.tasks.requests.Session.close", autospec=True) as session_close_mock:
+        with tasks._get_session("http://example.org/a"):
+            pass
+
+    assert list(tasks._sessions.keys()) == [("https", "example.com"), ("http", "example.org")]
+    assert {call.args[0] for call in session_close_mock.call_args_list} == {session1, session2}
+
+    with patch("taiga.webhooks.tasks.os.getpid", return_value=-1):
+        with tasks._get_session("http://example.org/a") as session:
+            assert len(tasks._sessions) == 0
+
+    tasks._sessions.clear()
+
+
+def test_failed_webhook_request_is_retried_with_backoff(settings):
+    settings.CELERY_ENABLED = True
+    settings.WEBHOOKS_RETRY_BACKOFF = 60
+    webhook = f.WebhookFactory.create()
+
+    with patch("taiga.webhooks.tasks.requests.Session.send", side_effect=ConnectionError("refused")), \
+         patch("taiga.base.utils.urls.validate_private_url", return_value=True):
+        tasks.send_requests([(webhook.id, webhook.url, webhook.key)], {"test": "test"})
+
+    retry = webhook.retries.get()
+    assert retry.attempts == 1
+    assert retry.status == WebhookRetryStatus.pending
+    assert retry.next_attempt_at > timezone.now() + datetime.timedelta(seconds=50)
+    assert webhook.logs.get().status == 0
+
+    # Not due yet
+    with patch("taiga.webhooks.tasks.requests.Session.send") as session_send_mock:
+        tasks.retry_webhooks()
+        assert session_send_mock.call_count == 0
+
+    retry.next_attempt_at = timezone.now()
+    retry.save()
+
+    response = Mock(status_code=200, headers={}, text="ok")
+    response.elapsed.total_seconds.return_value = 1
+    with patch("taiga.webhooks.tasks.requests.Session.send", return_value=response) as session_send_mock, \
+         patch("taiga.base.utils.urls.validate_private_url", return_value=True):
+        tasks.retry_webhooks()
+        assert session_send_mock.call_count == 1
+
+    assert not webhook.retries.exists()
+    assert webhook.logs.filter(status=200).count() == 1
+
+
+def test_failed_webhook_request_without_celery(settings):
+    settings.CELERY_ENABLED = False
+    webhook = f.WebhookFactory.create()
+    for i in range(tasks.MAX_WEBHOOK_LOGS):
+        f.WebhookLogFactory.create(webhook=webhook)
+
+    with patch("taiga.webhooks.tasks.requests.Session.send", side_effect=ConnectionError("refused")), \
+         patch("taiga.base.utils.urls.validate_private_url", return_value=True):
+        webhook_log = tasks.send_requests([(webhook.id, webhook.url, webhook.key)], {"test": "test"})[0]
+
+    # Nothing would send the retries, and the leftover logs are removed right away
+    assert not webhook.retries.exists()
+    assert webhook.logs.count() == tasks.MAX_WEBHOOK_LOGS
+    assert webhook.logs.filter(id=webhook_log.id).exists()
+
+
+def test_webhook_retry_is_dead_after_the_max_retries(settings):
+    settings.WEBHOOKS_MAX_RETRIES = 1
+    webhook = f.WebhookFactory.create()
+    retry = webhook.retries.create(request_data={"test": "test"}, attempts=1, next_attempt_at=timezone.now())
+
+    response = Mock(status_code=503, headers={}, text="unavailable")
+    response.elapsed.total_seconds.return_value = 1
+    with patch("taiga.webhooks.tasks.requests.Session.send", return_value=response), \
+         patch("taiga.base.utils.urls.validate_private_url", return_value=True):
+        tasks.retry_webhooks()
+
+    retry.refresh_from_db()
+    assert retry.attempts == 2
+    assert retry.status == WebhookRetryStatus.dead
+
+
+def test_webhook_retries_are_leased_while_they_are_sent(settings):
+    webhook = f.WebhookFactory.create()
+    retry = webhook.retries.create(request_data={"test": "test"}, attempts=1, next_attempt_at=timezone.now())
+    next_attempts_at = []
+
+    def send(*args, **kwargs):
+        # Other workers don't claim it again while it's being sent
+        next_attempts_at.append(webhook.retries.get().next_attempt_at)
+        raise ConnectionError("refused")
+
+    with patch("taiga.webhooks.tasks.requests.Session.send", side_effect=send), \
+         patch("taiga.base.utils.urls.validate_private_url", return_value=True):
+        tasks.retry_webhooks()
+
+    assert next_attempts_at[0] > timezone.now() + datetime.timedelta(minutes=10)
+    retry.refresh_from_db()
+    assert retry.attempts == 2
+    assert retry.status == WebhookRetryStatus.pending
+    assert retry.next_attempt_at < next_attempts_at[0]
+
+
+def test_webhook_circuit_is_opened_after_consecutive_failures(settings):
+    settings.CELERY_ENABLED = True
+    settings.WEBHOOKS_CIRCUIT_BREAKER_THRESHOLD = 2
+    webhook = f.WebhookFactory.create()
+    webhooks = [(webhook.id, webhook.url, webhook.key)]
+
+    with patch("taiga.webhooks.tasks.requests.Session.send", side_effect=ConnectionError("refused")) as session_send_mock, \
+         patch("taiga.base.utils.urls.validate_private_url", return_value=True):
+        tasks.send_requests(webhooks, {"test": "test"})
+        webhook.refresh_from_db()
+        assert webhook.circuit_open_until is None
+
+        tasks.send_requests(webhooks, {"test": "test"})
+        webhook.refresh_from_db()
+        assert webhook.circuit_open_until is not None
+
+        # The circuit is open, the request is only scheduled
+        tasks.send_requests(webhooks, {"test": "test"})
+        assert session_send_mock.call_count == 2
+
+    assert webhook.retries.filter(next_attempt_at=webhook.circuit_open_until).count() == 1
+
+    response = Mock(status_code=200, headers={}, text="ok")
+    response.elapsed.total_seconds.return_value = 1
+    webhook.circuit_open_until = timezone.now()
+    webhook.save()
+    with patch("taiga.webhooks.tasks.requests.Session.send", return_value=response), \
+         patch("taiga.base.utils.urls.validate_private_url", return_value=True):
+        tasks.send_requests(webhooks, {"test": "test"})
+
+    webhook.refresh_from_db()
+    assert webhook.consecutive_failures == 0
+    assert webhook.circuit_open_until is None
+
+
+def test_webhook_request_to_an_invalid_url_is_not_retried(settings):
+    settings.WEBHOOKS_ALLOW_PRIVATE_ADDRESS = False
+    settings.WEBHOOKS_CIRCUIT_BREAKER_THRESHOLD = 1
+    webhook = f.WebhookFactory.create(url="http://127.0.0.1/test")
+
+    with patch("taiga.webhooks.tasks.requests.Session.send") as session_send_mock:
+        tasks.send_requests([(webhook.id, webhook.url, webhook.key)], {"test": "test"})
+        assert session_send_mock.call_count == 0
+
+    assert webhook.logs.get().status == 0
+    assert not webhook.retries.exists()
+    webhook.refresh_from_db()
+    assert webhook.consecutive_failures == 0
+    assert webhook.circuit_open_until is None
+
+
+def test_webhook_retry_to_an_invalid_url_is_dead(settings):
+    settings.WEBHOOKS_ALLOW_PRIVATE_ADDRESS = False
+    webhook = f.WebhookFactory.create(url="http://127.0.0.1/test")
+    retry = webhook.retries.create(request_data={"test": "test"}, attempts=1, next_attempt_at=timezone.now())
+
+    with patch("taiga.webhooks.tasks.requests.Session.send") as session_send_mock:
+        tasks.retry_webhooks()
+        assert session_send_mock.call_count == 0
+
+    retry.refresh_from_db()
+    assert retry.attempts == 1
+    assert retry.status == WebhookRetryStatus.dead
+    webhook.refresh_from_db()
+    assert webhook.consecutive_failures == 0
+
+
+def test_webhook_request_is_dropped_when_the_circuit_is_open_and_retries_are_disabled(settings):
+    settings.CELERY_ENABLED = True
+    settings.WEBHOOKS_MAX_RETRIES = 0
+    webhook = f.WebhookFactory.create(circuit_open_until=timezone.now() + datetime.timedelta(minutes=5))
+
+    with patch("taiga.webhooks.tasks.requests.Session.send") as session_send_mock:
+        assert tasks.send_requests([(webhook.id, webhook.url, webhook.key)], {"test": "test"}) == [None]
+        assert session_send_mock.call_count == 0
+
+    assert not webhook.retries.exists()
+    assert not webhook.logs.exists()
+
+
+def test_remove_leftover_webhooklogs(settings):
+    settings.WEBHOOKS_LOGS_PRUNE_BATCH_SIZE = 1
+    webhook1 = f.WebhookFactory.create()
+    webhook2 = f.WebhookFactory.create()
+    webhook1_logs = [f.WebhookLogFactory.create(webhook=webhook1) for i in range(tasks.MAX_WEBHOOK_LOGS + 2)]
+    webhook2_logs = [f.WebhookLogFactory.create(webhook=webhook2) for i in range(3)]
+
+    tasks.remove_leftover_webhooklogs()
+
+    assert (set(webhook1.logs.values_list("id", flat=True)) ==
+            {log.id for log in webhook1_logs[-tasks.MAX_WEBHOOK_LOGS:]})
+    assert set(webhook2.logs.values_list("id", flat=True)) == {log.id for log in webhook2_logs}
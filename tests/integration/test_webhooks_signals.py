@@ -12,6 +12,7 @@ from unittest.mock import Mock
 from .. import factories as f
 
 from taiga.projects.history import services
+from taiga.webhooks import tasks
 
 pytestmark = pytest.mark.django_db(transaction=True)
 
@@ -123,3 +124,27 @@ def test_send_request_one_webhook_signal(settings):
          patch("taiga.base.utils.urls.validate_private_url", return_value=True):
             services.take_snapshot(obj, user=obj.owner, comment="test", delete=True)
             assert session_send_mock.call_count == 1
+
+
+def test_send_the_webhooks_of_a_project_serializing_the_object_once(settings):
+    settings.WEBHOOKS_ENABLED = True
+    project = f.ProjectFactory()
+    f.WebhookFactory.create(project=project)
+    f.WebhookFactory.create(project=project, url="http://localhost:8081/test")
+    f.WebhookFactory.create(project=project, url="http://localhost:8081/other-test")
+
+    obj = f.IssueFactory.create(project=project)
+
+    response = Mock(status_code=200, headers={}, text="ok")
+    response.elapsed.total_seconds.return_value = 100
+
+    with patch("taiga.webhooks.tasks.requests.Session.send", return_value=response) as session_send_mock, \
+     patch("taiga.webhooks.tasks._serialize", wraps=tasks._serialize) as serialize_mock, \
+     patch("taiga.base.utils.urls.validate_private_url", return_value=True):
+        services.take_snapshot(obj, user=obj.owner, comment="test")
+        assert session_send_mock.call_count == 3
+        assert serialize_mock.call_count == 1
+        for call in session_send_mock.call_args_list:
+            assert call.kwargs["timeout"] == (settings.WEBHOOKS_CONNECT_TIMEOUT, settings.WEBHOOKS_READ_TIMEOUT)
+
+    assert project.webhooks.filter(logs__status=200).count() == 3
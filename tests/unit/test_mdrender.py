@@ -8,10 +8,12 @@
 from unittest.mock import patch, MagicMock
 
 from taiga.mdrender.extensions import emojify
+from taiga.mdrender import service
 from taiga.mdrender.extensions import refresh_attachment
 from taiga.mdrender.service import render, cache_by_sha, get_diff_of_htmls, render_and_extract
 from taiga.projects.attachments.services import REFRESH_PARAM
 
+import sys
 import time
 
 dummy_project = MagicMock()
@@ -37,14 +39,15 @@ def test_proccessor_invalid_emoji():
 def test_mentions_valid_username():
     with patch("taiga.mdrender.extensions.mentions.get_user_model") as get_user_model_mock:
         dummy_uuser = MagicMock()
+        dummy_uuser.username = "hermione"
         dummy_uuser.get_full_name.return_value = "Hermione Granger"
-        get_user_model_mock.return_value.objects.get = MagicMock(return_value=dummy_uuser)
+        get_user_model_mock.return_value.objects.filter = MagicMock(return_value=[dummy_uuser])
 
         result = render(dummy_project, "text @hermione text")
 
-        get_user_model_mock.return_value.objects.get.assert_called_with(
+        get_user_model_mock.return_value.objects.filter.assert_called_with(
             memberships__project_id=1,
-            username="hermione",
+            username__in={"hermione"},
         )
         assert result == ('<p>text <a class="mention" href="http://localhost:9001/profile/hermione" '
                           'title="Hermione Granger">@hermione</a> text</p>')
@@ -53,14 +56,15 @@ def test_mentions_valid_username():
 def test_mentions_valid_username_with_points():
     with patch("taiga.mdrender.extensions.mentions.get_user_model") as get_user_model_mock:
         dummy_uuser = MagicMock()
+        dummy_uuser.username = "luna.lovegood"
         dummy_uuser.get_full_name.return_value = "Luna Lovegood"
-        get_user_model_mock.return_value.objects.get = MagicMock(return_value=dummy_uuser)
+        get_user_model_mock.return_value.objects.filter = MagicMock(return_value=[dummy_uuser])
 
         result = render(dummy_project, "text @luna.lovegood text")
 
-        get_user_model_mock.return_value.objects.get.assert_called_with(
+        get_user_model_mock.return_value.objects.filter.assert_called_with(
             memberships__project_id=1,
-            username="luna.lovegood",
+            username__in={"luna.lovegood"},
         )
         assert result == ('<p>text <a class="mention" href="http://localhost:9001/profile/luna.lovegood" '
                           'title="Luna Lovegood">@luna.lovegood</a> text</p>')
@@ -69,22 +73,24 @@ def test_mentions_valid_username_with_points():
 def test_mentions_valid_username_with_dash():
     with patch("taiga.mdrender.extensions.mentions.get_user_model") as get_user_model_mock:
         dummy_uuser = MagicMock()
+        dummy_uuser.username = "super-ginny"
         dummy_uuser.get_full_name.return_value = "Ginny Weasley"
-        get_user_model_mock.return_value.objects.get = MagicMock(return_value=dummy_uuser)
+        get_user_model_mock.return_value.objects.filter = MagicMock(return_value=[dummy_uuser])
 
         result = render(dummy_project, "text @super-ginny text")
 
-        get_user_model_mock.return_value.objects.get.assert_called_with(
+        get_user_model_mock.return_value.objects.filter.assert_called_with(
             memberships__project_id=1,
-            username="super-ginny",
+            username__in={"super-ginny"},
         )
         assert result == ('<p>text <a class="mention" href="http://localhost:9001/profile/super-ginny" '
                           'title="Ginny Weasley">@super-ginny</a> text</p>')
 
 
 def test_proccessor_valid_us_reference():
-    with patch("taiga.mdrender.extensions.references.get_instance_by_ref") as mock:
-        instance = mock.return_value
+    with patch("taiga.mdrender.extensions.references.get_instances_by_refs") as mock:
+        instance = MagicMock()
+        mock.side_effect = lambda project_id, refs: {ref: instance for ref in refs}
         instance.content_type.model = "userstory"
         instance.content_object.subject = "test"
         result = render(dummy_project, "**#1**")
@@ -93,8 +99,9 @@ def test_proccessor_valid_us_reference():
 
 
 def test_proccessor_valid_issue_reference():
-    with patch("taiga.mdrender.extensions.references.get_instance_by_ref") as mock:
-        instance = mock.return_value
+    with patch("taiga.mdrender.extensions.references.get_instances_by_refs") as mock:
+        instance = MagicMock()
+        mock.side_effect = lambda project_id, refs: {ref: instance for ref in refs}
         instance.content_type.model = "issue"
         instance.content_object.subject = "test"
         result = render(dummy_project, "**#2**")
@@ -103,8 +110,9 @@ def test_proccessor_valid_issue_reference():
 
 
 def test_proccessor_valid_task_reference():
-    with patch("taiga.mdrender.extensions.references.get_instance_by_ref") as mock:
-        instance = mock.return_value
+    with patch("taiga.mdrender.extensions.references.get_instances_by_refs") as mock:
+        instance = MagicMock()
+        mock.side_effect = lambda project_id, refs: {ref: instance for ref in refs}
         instance.content_type.model = "task"
         instance.content_object.subject = "test"
         result = render(dummy_project, "**#3**")
@@ -113,8 +121,9 @@ def test_proccessor_valid_task_reference():
 
 
 def test_proccessor_invalid_type_reference():
-    with patch("taiga.mdrender.extensions.references.get_instance_by_ref") as mock:
-        instance = mock.return_value
+    with patch("taiga.mdrender.extensions.references.get_instances_by_refs") as mock:
+        instance = MagicMock()
+        mock.side_effect = lambda project_id, refs: {ref: instance for ref in refs}
         instance.content_type.model = "other"
         instance.content_object.subject = "test"
         result = render(dummy_project, "**#4**")
@@ -122,12 +131,33 @@ def test_proccessor_invalid_type_reference():
 
 
 def test_proccessor_invalid_reference():
-    with patch("taiga.mdrender.extensions.references.get_instance_by_ref") as mock:
-        mock.return_value = None
+    with patch("taiga.mdrender.extensions.references.get_instances_by_refs") as mock:
+        mock.return_value = {}
         result = render(dummy_project, "**#5**")
         assert result == "<p><strong>#5</strong></p>"
 
 
+def test_proccessor_reference_followed_by_word_characters():
+    with patch("taiga.mdrender.extensions.references.get_instances_by_refs") as mock:
+        instance = MagicMock()
+        mock.side_effect = lambda project_id, refs: {ref: instance for ref in refs}
+        instance.content_type.model = "userstory"
+        instance.content_object.subject = "test"
+        result = render(dummy_project, "see #6abc #7_x")
+        mock.assert_called_once_with(1, {6, 7})
+        assert result == ('<p>see <a class="reference user-story" href="http://localhost:9001/project/test/us/6" '
+                          'title="#6 test">&num;6</a>abc '
+                          '<a class="reference user-story" href="http://localhost:9001/project/test/us/7" '
+                          'title="#7 test">&num;7</a>_x</p>')
+
+
+def test_proccessor_reference_without_project():
+    with patch("taiga.mdrender.extensions.references.get_instances_by_refs") as mock:
+        result = render(None, "**#8**")
+        assert not mock.called
+        assert result == "<p><strong>#8</strong></p>"
+
+
 def test_render_wiki_strong():
     assert render(dummy_project, "**test**") == "<p><strong>test</strong></p>"
     assert render(dummy_project, "__test__") == "<p><strong>test</strong></p>"
@@ -289,8 +319,9 @@ def test_get_diff_of_htmls_modifications():
 
 
 def test_render_and_extract_references():
-    with patch("taiga.mdrender.extensions.references.get_instance_by_ref") as mock:
-        instance = mock.return_value
+    with patch("taiga.mdrender.extensions.references.get_instances_by_refs") as mock:
+        instance = MagicMock()
+        mock.side_effect = lambda project_id, refs: {ref: instance for ref in refs}
         instance.content_type.model = "issue"
         instance.content_object.subject = "test"
         (_, extracted) = render_and_extract(dummy_project, "**#1**")
@@ -339,3 +370,46 @@ def test_render_attachment_file(settings):
 
 def test_render_markdown_to_html():
     assert render(dummy_project, "- [x] test") == "<ul class=\"task-list\">\n<li class=\"task-list-item\"><label class=\"task-list-control\"><input checked type=\"checkbox\"><span class=\"task-list-indicator\"></span></label> test</li>\n</ul>"
+
+
+def test_render_reuses_markdown_instances(settings):
+    settings.MDRENDER_CACHE_ENABLE = False
+    settings.MDRENDER_POOL_SIZE = 3
+
+    with patch("taiga.mdrender.service._make_markdown", wraps=service._make_markdown) as make_markdown_mock:
+        render(dummy_project, "# Title")
+        render(dummy_project, "# Title")
+        render_and_extract(dummy_project, "**test**")
+
+    assert make_markdown_mock.call_count == 1
+
+
+def test_render_rebinds_reused_markdown_instances_to_the_project(settings):
+    settings.MDRENDER_CACHE_ENABLE = False
+    settings.MDRENDER_POOL_SIZE = 3
+
+    other_project = MagicMock()
+    other_project.id = dummy_project.id
+    other_project.slug = "other"
+
+    assert render(dummy_project, "[[wiki page]]") == ("<p><a class=\"reference wiki\" "
+                                                     "href=\"http://localhost:9001/project/test/wiki/wiki-page\" "
+                                                     "title=\"wiki page\">wiki page</a></p>")
+    assert render(other_project, "[[wiki page]]") == ("<p><a class=\"reference wiki\" "
+                                                     "href=\"http://localhost:9001/project/other/wiki/wiki-page\" "
+                                                     "title=\"wiki page\">wiki page</a></p>")
+
+
+def test_lru_cache_evicts_the_least_recently_used_values():
+    lru_cache = service.LRUCache(max_size=sys.getsizeof("a" * 100) * 2)
+
+    lru_cache.set("key1", "a" * 100)
+    lru_cache.set("key2", "b" * 100)
+    assert lru_cache.get("key1") == "a" * 100
+
+    lru_cache.set("key3", "c" * 100)
+
+    assert lru_cache.get("key2") is None
+    assert lru_cache.get("key1") == "a" * 100
+    assert lru_cache.get("key3") == "c" * 100
+    assert lru_cache.get_stats() == {"hits": 3, "misses": 1, "entries": 2, "size": lru_cache.max_size}